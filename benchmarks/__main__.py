@@ -0,0 +1,92 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Run the OTP Service benchmarks, and report their results as JSON.
+
+Usage example:
+    poetry run python -m benchmarks --operations 10000 --concurrency 50 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+from datetime import datetime
+from random import Random
+from typing import Any, Dict, List
+
+from benchmarks.core import git_commit, redact_url
+from benchmarks.scenarios import SCENARIOS
+from immuni_otp.core import config
+
+
+async def _run(arguments: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run the selected scenarios, one at a time.
+
+    :param arguments: the command line arguments.
+    :return: the report, with the environment details and the result of each scenario.
+    """
+    results: List[Dict[str, Any]] = []
+    for name in arguments.scenarios:
+        result = await SCENARIOS[name](
+            arguments.operations, arguments.concurrency, arguments.cun_ratio, Random(arguments.seed)
+        )
+        results.append(result.as_dict())
+        print(
+            f"{result.name}: {result.throughput:.0f} ops/s, p50 {result.p50:.3f} ms, "
+            f"p95 {result.p95:.3f} ms, p99 {result.p99:.3f} ms, {result.errors} errors",
+            file=sys.stderr,
+        )
+    return dict(
+        commit=git_commit(),
+        started_at=datetime.utcnow().isoformat(),
+        python=platform.python_version(),
+        parameters=dict(
+            operations=arguments.operations,
+            concurrency=arguments.concurrency,
+            cun_ratio=arguments.cun_ratio,
+            seed=arguments.seed,
+            storage_format=config.OTP_STORAGE_FORMAT.value,
+            redis_urls=[redact_url(url) for url in config.OTP_CACHE_REDIS_URLS],
+            redis_min_connections=config.OTP_CACHE_REDIS_MIN_CONNECTIONS,
+            redis_max_connections=config.OTP_CACHE_REDIS_MAX_CONNECTIONS,
+        ),
+        results=results,
+    )
+
+
+def main() -> None:
+    """
+    Parse the command line arguments, run the benchmarks and write the JSON report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--cun-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=tuple(SCENARIOS), default=list(SCENARIOS),
+    )
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    arguments = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(_run(arguments))
+    json.dump(report, arguments.output, indent=2)
+    arguments.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import subprocess  # nosec
+from dataclasses import asdict, dataclass
+from math import ceil
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:  # pylint: disable=too-many-instance-attributes
+    """
+    The outcome of a benchmark, with latencies expressed in milliseconds.
+    """
+
+    name: str
+    operations: int
+    concurrency: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return the result as a JSON-serializable dictionary.
+
+        :return: the result as a dictionary.
+        """
+        return asdict(self)
+
+
+def git_commit() -> Optional[str]:
+    """
+    Return the commit the benchmarks are run on, if available.
+
+    :return: the commit hash, None if not in a git repository.
+    """
+    try:
+        return subprocess.run(  # nosec
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def redact_url(url: str) -> str:
+    """
+    Return the given URL without its credentials, so that it can be written in a report.
+
+    :param url: the URL, possibly including a username and a password, or a password parameter
+      (e.g., redis://host?password=secret).
+    :return: the URL without the username and the password.
+    """
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name != "password"]
+    return urlunsplit(
+        parts._replace(netloc=parts.netloc.rpartition("@")[2], query=urlencode(query))
+    )
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """
+    Return the given percentile of the values, with the nearest-rank method.
+
+    :param sorted_values: the values, sorted in ascending order.
+    :param fraction: the percentile, as a fraction between 0 and 1.
+    :return: the percentile of the values, 0 if there are no values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(
+    name: str, latencies: List[float], errors: int, seconds: float, concurrency: int
+) -> BenchmarkResult:
+    """
+    Summarize the latencies of a benchmark run.
+
+    :param name: the name of the benchmark.
+    :param latencies: the latency of each successful operation, in seconds.
+    :param errors: the number of failed operations.
+    :param seconds: the wall-clock duration of the whole run.
+    :param concurrency: the number of operations run concurrently.
+    :return: the summary of the run.
+    """
+    latencies = sorted(latency * 1000 for latency in latencies)
+    operations = len(latencies) + errors
+    return BenchmarkResult(
+        name=name,
+        operations=operations,
+        concurrency=concurrency,
+        errors=errors,
+        seconds=seconds,
+        throughput=operations / seconds if seconds else 0.0,
+        p50=percentile(latencies, 0.50),
+        p95=percentile(latencies, 0.95),
+        p99=percentile(latencies, 0.99),
+        max=latencies[-1] if latencies else 0.0,
+    )
+
+
+def run_sync(name: str, operation: Callable[[int], Any], operations: int) -> BenchmarkResult:
+    """
+    Benchmark a synchronous operation, run sequentially.
+
+    :param name: the name of the benchmark.
+    :param operation: the operation to benchmark, receiving the index of the run.
+    :param operations: the number of times to run the operation.
+    :return: the summary of the run.
+    """
+    latencies: List[float] = []
+    started_at = perf_counter()
+    for index in range(operations):
+        operation_started_at = perf_counter()
+        operation(index)
+        latencies.append(perf_counter() - operation_started_at)
+    return summarize(
+        name=name,
+        latencies=latencies,
+        errors=0,
+        seconds=perf_counter() - started_at,
+        concurrency=1,
+    )
+
+
+async def run_async(
+    name: str, operation: Callable[[int], Awaitable[Any]], operations: int, concurrency: int,
+) -> BenchmarkResult:
+    """
+    Benchmark an asynchronous operation, keeping the given number of operations in flight.
+    Failed operations are counted as errors, and excluded from the latencies.
+
+    :param name: the name of the benchmark.
+    :param operation: the operation to benchmark, receiving the index of the run.
+    :param operations: the number of times to run the operation.
+    :param concurrency: the number of operations to keep in flight.
+    :return: the summary of the run.
+    """
+    indexes = iter(range(operations))
+    latencies: List[float] = []
+    errors = 0
+
+    async def _worker() -> None:
+        nonlocal errors
+        for index in indexes:
+            operation_started_at = perf_counter()
+            try:
+                await operation(index)
+            except Exception:  # pylint: disable=broad-except
+                errors += 1
+            else:
+                latencies.append(perf_counter() - operation_started_at)
+
+    started_at = perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    return summarize(
+        name=name,
+        latencies=latencies,
+        errors=errors,
+        seconds=perf_counter() - started_at,
+        concurrency=concurrency,
+    )
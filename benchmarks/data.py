@@ -0,0 +1,59 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date, timedelta
+from hashlib import sha256
+from random import Random
+from typing import Any, Dict
+from uuid import UUID
+
+from immuni_otp.helpers.validation import OTP_CHARACTERS, check_digit
+
+
+def random_otp(random: Random) -> str:
+    """
+    Return a random valid OTP.
+
+    :param random: the source of randomness.
+    :return: the OTP, including its check digit.
+    """
+    body = "".join(random.choice(OTP_CHARACTERS) for _ in range(9))
+    return body + check_digit(body)
+
+
+def random_cun(random: Random) -> str:
+    """
+    Return a random CUN, i.e., the hex SHA-256 of a random OTP.
+
+    :param random: the source of randomness.
+    :return: the CUN.
+    """
+    return sha256(random_otp(random).encode("utf-8")).hexdigest()
+
+
+def random_authorization(random: Random, cun_ratio: float = 0.0) -> Dict[str, Any]:
+    """
+    Return the JSON body of a random valid OTP authorization.
+
+    :param random: the source of randomness.
+    :param cun_ratio: the probability of the authorization being for a CUN rather than an OTP.
+    :return: the JSON body of the authorization.
+    """
+    symptoms_started_on = (date.today() - timedelta(days=random.randint(0, 14))).isoformat()
+    if random.random() < cun_ratio:
+        return {
+            "otp": random_cun(random),
+            "symptoms_started_on": symptoms_started_on,
+            "id_test_verification": str(UUID(int=random.getrandbits(128), version=4)),
+        }
+    return {"otp": random_otp(random), "symptoms_started_on": symptoms_started_on}
@@ -0,0 +1,209 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the OTP Service while Redis degrades, and report it as JSON.
+
+Each fault scenario runs the POST /v1/otp benchmark through a proxy placed between the service and
+the first Redis of OTP_CACHE_REDIS_URLS, injecting latency, connection resets, slow reads, or an
+outage as during a failover.
+
+Only the first Redis is proxied: OTP_CACHE_REDIS_URLS is replaced by the URL of the proxy, so that
+the service runs against a single shard, all the requests going through the injected faults. The
+behaviour of a sharded deployment with a single shard failing is thus not measured.
+
+Usage example:
+    poetry run python -m benchmarks.faults --operations 2000 --concurrency 50 --output faults.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+from datetime import datetime
+from random import Random
+from typing import Any, Awaitable, Callable, Dict, List
+
+from benchmarks.core import BenchmarkResult, git_commit
+from benchmarks.proxy import Faults, FaultyRedisProxy, constant, lognormal
+from benchmarks.scenarios import post_authorizations
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+
+FaultScenario = Callable[[FaultyRedisProxy, Random], Awaitable[None]]
+
+
+async def healthy(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Inject no fault, as the baseline of the other scenarios.
+    """
+
+
+async def latency(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Add 5 ms to each round trip to Redis.
+    """
+    proxy.faults = Faults(latency=constant(0.005))
+
+
+async def long_tail(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Add a long-tailed latency to each round trip to Redis, 1 ms median.
+    """
+    proxy.faults = Faults(latency=lognormal(0.001, sigma=1.5, random=random))
+
+
+async def resets(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Reset 5% of the round trips to Redis, with their connection.
+    """
+    proxy.faults = Faults(reset_probability=0.05)
+
+
+async def slow_reads(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Forward the replies of Redis at 1 KB/s, so that each one is read in several pieces.
+    """
+    proxy.faults = Faults(read_bytes_per_second=1000)
+
+
+async def failover(proxy: FaultyRedisProxy, random: Random) -> None:
+    """
+    Reset all the connections to Redis after 50 ms, and refuse the new ones for 1 second.
+    """
+    await asyncio.sleep(0.05)
+    await proxy.outage(1.0)
+
+
+FAULTS: Dict[str, FaultScenario] = {
+    "healthy": healthy,
+    "latency": latency,
+    "long_tail": long_tail,
+    "resets": resets,
+    "slow_reads": slow_reads,
+    "failover": failover,
+}
+
+
+async def run_fault(  # pylint: disable=too-many-arguments
+    name: str,
+    proxy: FaultyRedisProxy,
+    client: Any,
+    operations: int,
+    concurrency: int,
+    cun_ratio: float,
+    random: Random,
+) -> BenchmarkResult:
+    """
+    Benchmark the whole POST /v1/otp path while the given fault scenario is injected, removing
+    the faults afterwards.
+
+    :param name: the name of the fault scenario, within FAULTS.
+    :param proxy: the proxy between the service and Redis.
+    :param client: the started Sanic test client.
+    :param operations: the number of authorizations to post.
+    :param concurrency: the number of requests to keep in flight.
+    :param cun_ratio: the probability of each authorization being for a CUN rather than an OTP.
+    :param random: the source of randomness.
+    :return: the summary of the run.
+    """
+    fault = asyncio.ensure_future(FAULTS[name](proxy, random))
+    try:
+        return await post_authorizations(name, client, operations, concurrency, cun_ratio, random)
+    finally:
+        fault.cancel()
+        await asyncio.gather(fault, return_exceptions=True)
+        proxy.faults = Faults()
+
+
+async def _run(arguments: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run the selected fault scenarios, one at a time, against the same application and proxy.
+
+    :param arguments: the command line arguments.
+    :return: the report, with the environment details and the result of each scenario.
+    """
+    # Imported here, as the test client is a test dependency.
+    from pytest_sanic.utils import TestClient  # pylint: disable=import-outside-toplevel
+
+    from immuni_otp.sanic import sanic_app  # pylint: disable=import-outside-toplevel
+
+    proxy = FaultyRedisProxy(config.OTP_CACHE_REDIS_URLS[0], Random(arguments.seed))
+    await proxy.start()
+    # The storage is collapsed to the single proxied shard, see the module docstring.
+    config.OTP_CACHE_REDIS_URLS = [proxy.url]
+    await managers.initialize()
+    client = TestClient(sanic_app)
+    await client.start_server()
+    results: List[Dict[str, Any]] = []
+    try:
+        for name in arguments.faults:
+            result = await run_fault(
+                name,
+                proxy,
+                client,
+                arguments.operations,
+                arguments.concurrency,
+                arguments.cun_ratio,
+                Random(arguments.seed),
+            )
+            results.append(result.as_dict())
+            print(
+                f"{result.name}: {result.throughput:.0f} ops/s, p50 {result.p50:.3f} ms, "
+                f"p99 {result.p99:.3f} ms, max {result.max:.3f} ms, {result.errors} errors",
+                file=sys.stderr,
+            )
+    finally:
+        await client.close()
+        await managers.teardown()
+        await proxy.close()
+    return dict(
+        commit=git_commit(),
+        started_at=datetime.utcnow().isoformat(),
+        python=platform.python_version(),
+        parameters=dict(
+            operations=arguments.operations,
+            concurrency=arguments.concurrency,
+            cun_ratio=arguments.cun_ratio,
+            seed=arguments.seed,
+            redis_min_connections=config.OTP_CACHE_REDIS_MIN_CONNECTIONS,
+            redis_max_connections=config.OTP_CACHE_REDIS_MAX_CONNECTIONS,
+            buffer_enabled=config.OTP_BUFFER_ENABLED,
+            admission_control_enabled=config.OTP_ADMISSION_CONTROL_ENABLED,
+            request_timeout_milliseconds=config.OTP_REQUEST_TIMEOUT_MILLISECONDS,
+        ),
+        results=results,
+    )
+
+
+def main() -> None:
+    """
+    Parse the command line arguments, run the fault scenarios and write the JSON report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--cun-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--faults", nargs="+", choices=tuple(FAULTS), default=list(FAULTS))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    arguments = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(_run(arguments))
+    json.dump(report, arguments.output, indent=2)
+    arguments.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
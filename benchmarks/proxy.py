@@ -0,0 +1,252 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A TCP proxy to place between the OTP Service and Redis, injecting latency, connection resets,
+slow reads and outages, to measure how the service behaves while Redis degrades.
+"""
+
+import asyncio
+import socket
+import struct
+from dataclasses import dataclass, field
+from random import Random
+from typing import Callable, Optional, Set
+from urllib.parse import urlsplit, urlunsplit
+
+# The buffer size of each read from either side of the proxy.
+_CHUNK_BYTES = 64 * 1024
+
+
+def constant(seconds: float) -> Callable[[], float]:
+    """
+    Return a latency distribution always adding the given latency.
+
+    :param seconds: the latency, in seconds.
+    :return: the latency distribution.
+    """
+    return lambda: seconds
+
+
+def lognormal(median_seconds: float, sigma: float, random: Random) -> Callable[[], float]:
+    """
+    Return a lognormal latency distribution, i.e., a long-tailed one, as the latency of a loaded
+    Redis or of a congested network.
+
+    :param median_seconds: the median latency, in seconds.
+    :param sigma: the standard deviation of the latency logarithm, the higher the longer the tail.
+    :param random: the source of randomness.
+    :return: the latency distribution.
+    """
+    return lambda: median_seconds * random.lognormvariate(0, sigma)
+
+
+@dataclass
+class Faults:
+    """
+    The faults injected by the proxy. By default, none.
+    """
+
+    # The distribution of the latency added before forwarding each chunk of commands, in seconds.
+    latency: Callable[[], float] = field(default_factory=lambda: constant(0.0))
+    # The probability of resetting the connection instead of forwarding each chunk of commands.
+    reset_probability: float = 0.0
+    # The throughput the replies are forwarded with, as if read slowly, 0 if not limited.
+    read_bytes_per_second: float = 0.0
+
+
+class FaultyRedisProxy:
+    """
+    A TCP proxy forwarding the connections to the given Redis, injecting the configured faults.
+    Faults can be changed while the proxy runs, and apply to the chunks forwarded from then on.
+    """
+
+    def __init__(self, upstream_url: str, random: Optional[Random] = None) -> None:
+        """
+        :param upstream_url: the URL of the Redis to forward the connections to.
+        :param random: the source of randomness of the connection resets.
+        """
+        upstream = urlsplit(upstream_url)
+        self._upstream_url = upstream
+        self._upstream_host = upstream.hostname or "localhost"
+        self._upstream_port = upstream.port or 6379
+        self._random = random or Random(0)  # nosec
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._outage = False
+        self.faults = Faults()
+
+    @property
+    def url(self) -> str:
+        """
+        The URL of the proxy, with the same database and options as the upstream URL.
+        """
+        if self._server is None:
+            raise RuntimeError("The proxy is not started.")
+        port = self._server.sockets[0].getsockname()[1]
+        netloc = f"127.0.0.1:{port}"
+        if self._upstream_url.password:
+            netloc = f":{self._upstream_url.password}@{netloc}"
+        return urlunsplit(self._upstream_url._replace(netloc=netloc))
+
+    async def start(self) -> None:
+        """
+        Start listening, on a free local port.
+        """
+        self._server = await asyncio.start_server(self._handle, host="127.0.0.1", port=0)
+
+    async def close(self) -> None:
+        """
+        Stop listening, and close all the connections.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._reset_all()
+
+    def start_outage(self) -> None:
+        """
+        Start an outage, as during a failover: all the connections are reset, and the new ones are
+        reset as soon as accepted.
+        """
+        self._outage = True
+        self._reset_all()
+
+    def end_outage(self) -> None:
+        """
+        End the outage, forwarding the new connections again.
+        """
+        self._outage = False
+
+    async def outage(self, seconds: float) -> None:
+        """
+        Cause an outage of the given duration.
+
+        :param seconds: the duration of the outage.
+        """
+        self.start_outage()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.end_outage()
+
+    def _reset_all(self) -> None:
+        """
+        Reset all the connections, on either side.
+        """
+        for writer in list(self._writers):
+            _reset(writer)
+        self._writers.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Forward the given client connection to Redis, until either side closes it.
+
+        :param reader: the reader of the client connection.
+        :param writer: the writer of the client connection.
+        """
+        if self._outage:
+            _reset(writer)
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(
+                self._upstream_host, self._upstream_port
+            )
+        except OSError:
+            _reset(writer)
+            return
+        self._writers.update((writer, upstream_writer))
+        # Either direction stops when its connection is closed or reset, closing the other one.
+        directions = [
+            asyncio.ensure_future(self._forward_commands(reader, writer, upstream_writer)),
+            asyncio.ensure_future(self._forward_replies(upstream_reader, writer)),
+        ]
+        try:
+            await asyncio.wait(directions, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for direction in directions:
+                direction.cancel()
+            await asyncio.gather(*directions, return_exceptions=True)
+            for connection_writer in (writer, upstream_writer):
+                self._writers.discard(connection_writer)
+                connection_writer.close()
+
+    async def _forward_commands(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        upstream_writer: asyncio.StreamWriter,
+    ) -> None:
+        """
+        Forward the commands of the client to Redis, with the configured latency and resets.
+
+        :param reader: the reader of the client connection.
+        :param writer: the writer of the client connection.
+        :param upstream_writer: the writer of the Redis connection.
+        """
+        while True:
+            data = await reader.read(_CHUNK_BYTES)
+            if not data:
+                return
+            latency = self.faults.latency()
+            if latency > 0:
+                await asyncio.sleep(latency)
+            if self._random.random() < self.faults.reset_probability:
+                _reset(writer)
+                _reset(upstream_writer)
+                return
+            upstream_writer.write(data)
+            await upstream_writer.drain()
+
+    async def _forward_replies(
+        self, upstream_reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Forward the replies of Redis to the client, with the configured throughput.
+
+        :param upstream_reader: the reader of the Redis connection.
+        :param writer: the writer of the client connection.
+        """
+        while True:
+            data = await upstream_reader.read(_CHUNK_BYTES)
+            if not data:
+                return
+            bytes_per_second = self.faults.read_bytes_per_second
+            if bytes_per_second <= 0:
+                writer.write(data)
+                await writer.drain()
+                continue
+            # Trickle the reply in chunks of 10 ms each, so that the client reads it in pieces.
+            chunk_bytes = max(int(bytes_per_second / 100), 1)
+            for start in range(0, len(data), chunk_bytes):
+                chunk = data[start : start + chunk_bytes]
+                writer.write(chunk)
+                await writer.drain()
+                await asyncio.sleep(len(chunk) / bytes_per_second)
+
+
+def _reset(writer: asyncio.StreamWriter) -> None:
+    """
+    Reset the given connection, with a TCP RST rather than an orderly shutdown, as a crashed or
+    failed over Redis does.
+
+    :param writer: the writer of the connection to reset.
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except OSError:
+            pass
+    writer.transport.abort()
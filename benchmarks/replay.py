@@ -0,0 +1,335 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Replay the traffic shape of captured access logs against a running OTP Service.
+
+Each POST /v1/otp request of the logs is replayed as a random valid authorization, at its original
+time since the first request, divided by the speed-up. The requests are sent as scheduled, whether
+or not the previous ones have been answered, so that bursts reach the service as they did.
+
+The times of the Gunicorn text format (%(t)s), as well as the ISO 8601 times without a fraction of
+second, have a resolution of one second: the requests logged within the same second are spread
+uniformly (and randomly) across it, rather than being replayed as a burst at its start.
+
+Usage example:
+    poetry run python -m benchmarks.replay access.log --url http://localhost:5000 --speed-up 2
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from http import HTTPStatus
+from random import Random
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from benchmarks.core import BenchmarkResult, git_commit, percentile, redact_url, summarize
+from benchmarks.data import random_authorization
+
+_CONTENT_TYPE_HEADER = {"Content-Type": "application/json; charset=utf-8"}
+_AUTHORIZATION_PATH = "/v1/otp"
+
+# The fields holding the time of the request in the JSON log lines, in order of preference.
+_TIME_FIELDS = ("timestamp", "time", "asctime", "created")
+# The request line (e.g., "POST /v1/otp HTTP/1.1"), and the time in the Gunicorn text format.
+_REQUEST_LINE = re.compile(r"(?P<method>[A-Z]+) (?P<path>/\S*)")
+_TEXT_TIME = re.compile(r"\[(?P<time>[^\]]+)\]")
+_TEXT_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+
+
+@dataclass(frozen=True)
+class ReplayResult:
+    """
+    The outcome of a replay, with the latency of the successful requests and the errors.
+    """
+
+    result: BenchmarkResult
+    # The number of failed requests, by status code or by client exception.
+    errors: Dict[str, int]
+    # How late the requests have been sent compared to their schedule, in milliseconds.
+    lag_p50: float
+    lag_p99: float
+
+
+def _parse_time(value: Union[str, int, float]) -> Optional[Tuple[float, float]]:
+    """
+    Parse the time of a log line, with its resolution.
+
+    :param value: the Unix time, or the time as an ISO 8601 or Gunicorn string.
+    :return: the Unix time and its resolution in seconds, 1 if truncated to the second (e.g., in
+      the Gunicorn text format), 0 otherwise, None if not parsable.
+    """
+    if isinstance(value, (int, float)):
+        return float(value), 0.0
+    text = value.strip().replace("Z", "+00:00").replace(",", ".")
+    try:
+        return datetime.fromisoformat(text).timestamp(), 0.0 if "." in text else 1.0
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, _TEXT_TIME_FORMAT).timestamp(), 1.0
+    except ValueError:
+        return None
+
+
+def _parse_arrival(line: str) -> Optional[Tuple[float, float]]:
+    """
+    Return the time of the given log line, with its resolution, if it records a POST /v1/otp
+    request.
+
+    :param line: the log line.
+    :return: the Unix time of the request and its resolution in seconds, None if the line is not
+      an authorization.
+    """
+    line = line.strip()
+    timestamp: Optional[Tuple[float, float]] = None
+    request = ""
+    if line.startswith("{"):
+        try:
+            record: Dict[str, Any] = json.loads(line)
+        except ValueError:
+            return None
+        for time_field in _TIME_FIELDS:
+            if time_field in record:
+                timestamp = _parse_time(record[time_field])
+                break
+        if "otp_sha" in record:
+            # Each record of the audit log is an authorization.
+            request = f"POST {_AUTHORIZATION_PATH}"
+        elif "request_method" in record and "request_path" in record:
+            request = f"{record['request_method']} {record['request_path']}"
+        else:
+            request = str(record.get("request") or record.get("message") or "")
+    else:
+        time_match = _TEXT_TIME.search(line)
+        if time_match is not None:
+            timestamp = _parse_time(time_match["time"])
+        request = line
+    request_match = _REQUEST_LINE.search(request)
+    if (
+        timestamp is None
+        or request_match is None
+        or request_match["method"] != "POST"
+        or request_match["path"].split("?")[0] != _AUTHORIZATION_PATH
+    ):
+        return None
+    return timestamp
+
+
+def parse_arrival(line: str) -> Optional[float]:
+    """
+    Return the time of the given log line, if it records a POST /v1/otp request.
+    Lines are either JSON, as written by the JSON Gunicorn logger or by the audit log of the
+    service, or in the Gunicorn text format.
+
+    :param line: the log line.
+    :return: the Unix time of the request, None if the line is not an authorization.
+    """
+    arrival = _parse_arrival(line)
+    return None if arrival is None else arrival[0]
+
+
+def parse_offsets(lines: Iterable[str], random: Optional[Random] = None) -> List[float]:
+    """
+    Return the time of each authorization in the given log lines, since the first one.
+    The times with a resolution of one second are spread uniformly across their second.
+
+    :param lines: the log lines, in any order.
+    :param random: the source of randomness of the spreading.
+    :return: the sorted offsets of the authorizations, in seconds, empty if none.
+    """
+    random = random or Random(0)  # nosec
+    parsed = (_parse_arrival(line) for line in lines)
+    arrivals = sorted(
+        arrival[0] + arrival[1] * random.random() for arrival in parsed if arrival is not None
+    )
+    if not arrivals:
+        return []
+    return [arrival - arrivals[0] for arrival in arrivals]
+
+
+async def replay(  # pylint: disable=too-many-arguments,too-many-locals
+    url: str,
+    offsets: List[float],
+    speed_up: float = 1.0,
+    cun_ratio: float = 0.1,
+    random: Optional[Random] = None,
+    connections: int = 100,
+    timeout_seconds: float = 10.0,
+) -> ReplayResult:
+    """
+    Send a random valid authorization at each of the given offsets, to the given service.
+
+    :param url: the base URL of the service (e.g., http://localhost:5000).
+    :param offsets: the sorted offsets of the authorizations, in seconds.
+    :param speed_up: the factor the offsets are divided by.
+    :param cun_ratio: the probability of each authorization being for a CUN rather than an OTP.
+    :param random: the source of randomness of the authorizations.
+    :param connections: the maximum number of connections to the service, the requests exceeding
+      it waiting for a free one.
+    :param timeout_seconds: the time after which a request is considered failed.
+    :return: the summary of the replay.
+    """
+    # Imported here, as the HTTP client is a test dependency.
+    import aiohttp  # pylint: disable=import-outside-toplevel
+
+    random = random or Random(0)  # nosec
+    authorizations = [random_authorization(random, cun_ratio) for _ in offsets]
+    latencies: List[float] = []
+    lags: List[float] = []
+    errors: Dict[str, int] = Counter()
+    in_flight = max_in_flight = 0
+
+    async def _send(session: aiohttp.ClientSession, index: int, scheduled_at: float) -> None:
+        nonlocal in_flight, max_in_flight
+        started_at = perf_counter()
+        lags.append(max(started_at - scheduled_at, 0.0))
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            async with session.post(
+                f"{url}{_AUTHORIZATION_PATH}",
+                json=authorizations[index],
+                headers=_CONTENT_TYPE_HEADER,
+            ) as response:
+                await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+            errors[type(exception).__name__] += 1
+            return
+        finally:
+            in_flight -= 1
+        if status == HTTPStatus.NO_CONTENT.value:
+            latencies.append(perf_counter() - started_at)
+        else:
+            errors[str(status)] += 1
+
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=connections),
+        timeout=aiohttp.ClientTimeout(total=timeout_seconds),
+    ) as session:
+        started_at = perf_counter()
+        requests = []
+        for index, offset in enumerate(offsets):
+            scheduled_at = started_at + offset / speed_up
+            delay = scheduled_at - perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            requests.append(asyncio.ensure_future(_send(session, index, scheduled_at)))
+        await asyncio.gather(*requests)
+        seconds = perf_counter() - started_at
+
+    sorted_lags = sorted(lag * 1000 for lag in lags)
+    return ReplayResult(
+        result=summarize(
+            name="replay",
+            latencies=latencies,
+            errors=sum(errors.values()),
+            seconds=seconds,
+            concurrency=max_in_flight,
+        ),
+        errors=dict(errors),
+        lag_p50=percentile(sorted_lags, 0.50),
+        lag_p99=percentile(sorted_lags, 0.99),
+    )
+
+
+def _run(arguments: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Parse the logs, and replay them.
+
+    :param arguments: the command line arguments.
+    :return: the report, with the parameters, the summary of the replay and its errors.
+    """
+    lines: List[str] = []
+    for log_file in arguments.logs:
+        with log_file:
+            lines.extend(log_file)
+    offsets = parse_offsets(lines, Random(arguments.seed))
+    if arguments.limit:
+        offsets = offsets[: arguments.limit]
+    if not offsets:
+        raise SystemExit("No POST /v1/otp request found in the logs.")
+
+    replayed = asyncio.get_event_loop().run_until_complete(
+        replay(
+            arguments.url,
+            offsets,
+            speed_up=arguments.speed_up,
+            cun_ratio=arguments.cun_ratio,
+            random=Random(arguments.seed),
+            connections=arguments.connections,
+            timeout_seconds=arguments.timeout_seconds,
+        )
+    )
+    result = replayed.result
+    print(
+        f"replayed {result.operations} requests in {result.seconds:.1f} s: "
+        f"p50 {result.p50:.3f} ms, p99 {result.p99:.3f} ms, max {result.max:.3f} ms, "
+        f"{result.concurrency} max in flight, {replayed.errors or 'no'} errors",
+        file=sys.stderr,
+    )
+    return dict(
+        commit=git_commit(),
+        started_at=datetime.utcnow().isoformat(),
+        parameters=dict(
+            url=redact_url(arguments.url),
+            speed_up=arguments.speed_up,
+            cun_ratio=arguments.cun_ratio,
+            seed=arguments.seed,
+            connections=arguments.connections,
+            timeout_seconds=arguments.timeout_seconds,
+            captured_seconds=offsets[-1],
+        ),
+        results=[result.as_dict()],
+        errors=replayed.errors,
+        lag_p50=replayed.lag_p50,
+        lag_p99=replayed.lag_p99,
+    )
+
+
+def main() -> None:
+    """
+    Parse the command line arguments, replay the logs and write the JSON report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "logs",
+        nargs="+",
+        type=argparse.FileType("r"),
+        help="the access logs, or audit logs, to replay. The times of the Gunicorn text format "
+        "have a resolution of one second: the requests within each second are spread uniformly "
+        "across it.",
+    )
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--speed-up", type=float, default=1.0)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--cun-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--timeout-seconds", type=float, default=10.0)
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    arguments = parser.parse_args()
+
+    json.dump(_run(arguments), arguments.output, indent=2)
+    arguments.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+from http import HTTPStatus
+from random import Random
+from typing import Any, Awaitable, Callable, Dict
+
+from benchmarks.core import BenchmarkResult, run_async, run_sync
+from benchmarks.data import random_authorization
+from immuni_common.models.dataclasses import OtpData
+from immuni_common.models.marshmallow.schemas import OtpDataSchema
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.otp import _key_for_otp, store
+
+_CONTENT_TYPE_HEADER = {"Content-Type": "application/json; charset=utf-8"}
+
+Scenario = Callable[[int, int, float, Random], Awaitable[BenchmarkResult]]
+
+
+def _otp_data(authorization: Dict[str, str]) -> OtpData:
+    """
+    Return the OtpData of the given authorization body.
+
+    :param authorization: the JSON body of the authorization.
+    :return: the OtpData to store.
+    """
+    return OtpData(
+        symptoms_started_on=date.fromisoformat(authorization["symptoms_started_on"]),
+        id_test_verification=authorization.get("id_test_verification"),
+    )
+
+
+async def key_derivation(
+    operations: int, concurrency: int, cun_ratio: float, random: Random
+) -> BenchmarkResult:
+    """
+    Benchmark the derivation of the database key of OTPs and CUNs.
+    """
+    otps = [random_authorization(random, cun_ratio)["otp"] for _ in range(operations)]
+    return run_sync("key_derivation", lambda index: _key_for_otp(otps[index]), operations)
+
+
+async def serialization(
+    operations: int, concurrency: int, cun_ratio: float, random: Random
+) -> BenchmarkResult:
+    """
+    Benchmark the serialization of OtpData with OtpDataSchema.
+    """
+    otp_data = [_otp_data(random_authorization(random, cun_ratio)) for _ in range(operations)]
+    schema = OtpDataSchema()
+    return run_sync("serialization", lambda index: schema.dumps(otp_data[index]), operations)
+
+
+async def redis_store(
+    operations: int, concurrency: int, cun_ratio: float, random: Random
+) -> BenchmarkResult:
+    """
+    Benchmark storing OTPs with store(), against the configured Redis.
+    """
+    authorizations = [random_authorization(random, cun_ratio) for _ in range(operations)]
+
+    async def _store(index: int) -> None:
+        authorization = authorizations[index]
+        await store(otp=authorization["otp"], otp_data=_otp_data(authorization))
+
+    await managers.initialize()
+    try:
+        return await run_async("store", _store, operations, concurrency)
+    finally:
+        await managers.teardown()
+
+
+async def post_authorizations(
+    name: str, client: Any, operations: int, concurrency: int, cun_ratio: float, random: Random
+) -> BenchmarkResult:
+    """
+    Benchmark the whole POST /v1/otp path, through the given Sanic test client. Requests not
+    answered with 204 are counted as errors.
+
+    :param name: the name of the benchmark.
+    :param client: the started Sanic test client.
+    :param operations: the number of authorizations to post.
+    :param concurrency: the number of requests to keep in flight.
+    :param cun_ratio: the probability of each authorization being for a CUN rather than an OTP.
+    :param random: the source of randomness of the authorizations.
+    :return: the summary of the run.
+    """
+    authorizations = [random_authorization(random, cun_ratio) for _ in range(operations)]
+
+    async def _post(index: int) -> None:
+        response = await client.post(
+            uri="/v1/otp", json=authorizations[index], headers=_CONTENT_TYPE_HEADER
+        )
+        await response.read()
+        if response.status != HTTPStatus.NO_CONTENT.value:
+            raise RuntimeError(f"Unexpected status: {response.status}.")
+
+    return await run_async(name, _post, operations, concurrency)
+
+
+async def api(
+    operations: int, concurrency: int, cun_ratio: float, random: Random
+) -> BenchmarkResult:
+    """
+    Benchmark the whole POST /v1/otp path, through the Sanic test client.
+    """
+    # Imported here, so that the other scenarios do not need the test dependencies.
+    from pytest_sanic.utils import TestClient  # pylint: disable=import-outside-toplevel
+
+    from immuni_otp.sanic import sanic_app  # pylint: disable=import-outside-toplevel
+
+    await managers.initialize()
+    client = TestClient(sanic_app)
+    await client.start_server()
+    try:
+        return await post_authorizations("api", client, operations, concurrency, cun_ratio, random)
+    finally:
+        await client.close()
+        await managers.teardown()
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "key_derivation": key_derivation,
+    "serialization": serialization,
+    "store": redis_store,
+    "api": api,
+}
@@ -0,0 +1,172 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the cold start of the OTP Service workers, and report it as JSON.
+
+Each run starts a fresh interpreter, as a recycled worker does, measuring the time spent importing
+the Sanic application, and the time until its first request has been served.
+
+Usage example:
+    poetry run python -m benchmarks.startup --runs 20 --output startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess  # nosec
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, List
+
+from benchmarks.core import BenchmarkResult, git_commit, summarize
+
+_CONTENT_TYPE_HEADER = {"Content-Type": "application/json; charset=utf-8"}
+
+
+def _probe() -> Dict[str, float]:
+    """
+    Start the application in the current process, serving a single request.
+    Nothing but the standard library and the benchmark core has been imported before, so that the
+    import time is the one of a fresh worker.
+
+    :return: the seconds spent importing the application, and until its first request has been
+      served. The latter includes, as for a worker, the initialization of the managers (e.g., the
+      connections to Redis) and the start of the server, but not the import of the test client.
+    """
+    started_at = perf_counter()
+    from immuni_otp.sanic import sanic_app  # pylint: disable=import-outside-toplevel
+
+    import_seconds = perf_counter() - started_at
+
+    # Imported here, so that their import time is not accounted for.
+    # pylint: disable=import-outside-toplevel
+    from random import Random
+
+    from pytest_sanic.utils import TestClient
+
+    from benchmarks.data import random_authorization
+    from immuni_otp.core.managers import managers
+
+    authorization = random_authorization(Random(), cun_ratio=0)
+
+    async def _first_request() -> float:
+        serving_started_at = perf_counter()
+        await managers.initialize()
+        client = TestClient(sanic_app)
+        await client.start_server()
+        try:
+            response = await client.post(
+                uri="/v1/otp", json=authorization, headers=_CONTENT_TYPE_HEADER
+            )
+            await response.read()
+            return perf_counter() - serving_started_at
+        finally:
+            await client.close()
+            await managers.teardown()
+
+    serving_seconds = asyncio.get_event_loop().run_until_complete(_first_request())
+    return dict(
+        import_seconds=import_seconds, first_request_seconds=import_seconds + serving_seconds
+    )
+
+
+def startup_results(
+    probes: List[Dict[str, float]], process_seconds: List[float]
+) -> List[BenchmarkResult]:
+    """
+    Summarize the measures of the runs.
+
+    :param probes: the measures reported by each run.
+    :param process_seconds: the wall-clock duration of each run, interpreter start included.
+    :return: the summary of the import time, time to the first request, and process duration.
+    """
+    results = []
+    for name, latencies in (
+        ("import", [probe["import_seconds"] for probe in probes]),
+        ("first_request", [probe["first_request_seconds"] for probe in probes]),
+        ("process", process_seconds),
+    ):
+        results.append(
+            summarize(
+                name=name, latencies=latencies, errors=0, seconds=sum(latencies), concurrency=1,
+            )
+        )
+    return results
+
+
+def _run(runs: int) -> Dict[str, Any]:
+    """
+    Run the given number of fresh processes, one at a time.
+
+    :param runs: the number of processes to run.
+    :return: the report, with the environment details and the summary of the runs.
+    """
+    probes: List[Dict[str, float]] = []
+    process_seconds: List[float] = []
+    with tempfile.TemporaryDirectory() as directory:
+        probe_path = os.path.join(directory, "probe.json")
+        for _ in range(runs):
+            started_at = perf_counter()
+            subprocess.run(  # nosec
+                [sys.executable, "-m", "benchmarks.startup", f"--probe={probe_path}"],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            process_seconds.append(perf_counter() - started_at)
+            with open(probe_path) as probe_file:
+                probes.append(json.load(probe_file))
+
+    results = startup_results(probes, process_seconds)
+    for result in results:
+        print(
+            f"{result.name}: p50 {result.p50:.1f} ms, p95 {result.p95:.1f} ms, "
+            f"max {result.max:.1f} ms",
+            file=sys.stderr,
+        )
+    return dict(
+        commit=git_commit(),
+        started_at=datetime.utcnow().isoformat(),
+        python=platform.python_version(),
+        parameters=dict(runs=runs, api_docs_enabled=os.environ.get("OTP_API_DOCS_ENABLED", "true")),
+        results=[result.as_dict() for result in results],
+    )
+
+
+def main() -> None:
+    """
+    Parse the command line arguments, run the processes and write the JSON report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    # Internal: measure the current process, writing the measures to the given path.
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.probe:
+        probe = _probe()
+        with open(arguments.probe, "w") as probe_file:
+            json.dump(probe, probe_file)
+        return
+
+    json.dump(_run(arguments.runs), arguments.output, indent=2)
+    arguments.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,13 @@ case "$1" in
             --max-requests=${API_WORKER_MAX_REQUESTS} \
             --workers=${API_WORKERS} \
             --worker-class=immuni_common.uvicorn.ImmuniUvicornWorker ;;
+    api-prefork) OTP_PREFORK_WORKERS=${API_WORKERS} \
+            OTP_PREFORK_HOST=${API_HOST} \
+            OTP_PREFORK_PORT=${API_PORT} \
+            OTP_PREFORK_MAX_REQUESTS=${API_WORKER_MAX_REQUESTS} \
+            poetry run python -m immuni_otp.sanic ;;
     debug) echo "Running in debug mode ..." \
             && tail -f /dev/null ;;  # Allow entering the container to inspect the environment.
-    *) echo "Received unknown command $1 (allowed: api)"
+    *) echo "Received unknown command $1 (allowed: api, api-prefork)"
        exit 2 ;;
 esac
@@ -0,0 +1,50 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+from sanic import Blueprint
+from sanic.request import Request
+from sanic.response import HTTPResponse, text
+from sanic_openapi import doc
+
+from immuni_common.core.exceptions import SchemaValidationException
+from immuni_common.helpers.cache import cache
+from immuni_otp.core import config
+from immuni_otp.helpers.profiler import profile
+
+bp = Blueprint("admin", url_prefix="/admin")
+
+
+@bp.route("/profile", methods=["GET"], version=1)
+@doc.exclude(True)
+@cache(no_store=True)
+async def profile_worker(request: Request) -> HTTPResponse:
+    """
+    Profile the worker serving the request, sampling its event loop for the number of seconds in
+    the "seconds" query parameter (10 by default). Besides the stacks run on the event loop
+    (rooted at "cpu", or at "idle" while waiting for I/O), the stacks of the tasks suspended in an
+    await (rooted at "await", e.g., waiting for Redis) are sampled as well.
+    Only registered if the profiler is enabled in the configuration.
+
+    :param request: the HTTP request object.
+    :return: 200 with the collapsed stacks as text, and the PID of the profiled worker in the
+      X-Worker-Pid header, 400 if the duration is not valid.
+    """
+    seconds: str = request.args.get("seconds", "10")
+    if not seconds.isdigit() or not 0 < int(seconds) <= config.OTP_PROFILER_MAX_SECONDS:
+        raise SchemaValidationException
+    collapsed = await profile(
+        seconds=int(seconds), interval_seconds=config.OTP_PROFILER_INTERVAL_MILLISECONDS / 1000
+    )
+    return text(collapsed, headers={"X-Worker-Pid": str(os.getpid())})
@@ -0,0 +1,63 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from http import HTTPStatus
+
+from sanic import Blueprint
+from sanic.request import Request
+from sanic.response import HTTPResponse
+from sanic_openapi import doc
+
+from immuni_common.helpers.cache import cache
+from immuni_common.helpers.sanic import json_response
+from immuni_otp.core import config
+from immuni_otp.helpers.health import redis_health
+from immuni_otp.models.enums import StorageBackend
+
+bp = Blueprint("health", url_prefix="/health")
+
+
+@bp.route("/live", methods=["GET"])
+@doc.exclude(True)
+@cache(no_store=True)
+async def live(request: Request) -> HTTPResponse:
+    """
+    Check whether the worker is alive, i.e., its event loop is serving requests.
+    The database is not involved, so that a database outage does not get the workers restarted.
+    Only registered if the health checks are enabled in the configuration.
+
+    :param request: the HTTP request object.
+    :return: 200.
+    """
+    return json_response(body=dict(alive=True), status=HTTPStatus.OK)
+
+
+@bp.route("/ready", methods=["GET"])
+@doc.exclude(True)
+@cache(no_store=True)
+async def ready(request: Request) -> HTTPResponse:
+    """
+    Check whether the worker is ready to serve traffic, from the outcome of the latest probes of
+    the database run in the background, without any round trip to the database.
+    Only registered if the health checks are enabled in the configuration.
+
+    :param request: the HTTP request object.
+    :return: 200 with the report of the probes if ready, 503 with the report, including the reason,
+      otherwise.
+    """
+    if config.OTP_STORAGE_BACKEND == StorageBackend.MEMORY:
+        return json_response(body=dict(ready=True, reason=None), status=HTTPStatus.OK)
+    report = redis_health.readiness()
+    return json_response(
+        body=report, status=HTTPStatus.OK if report["ready"] else HTTPStatus.SERVICE_UNAVAILABLE,
+    )
@@ -12,9 +12,15 @@
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from datetime import date
+from functools import wraps
 from http import HTTPStatus
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
 
+from marshmallow import ValidationError, fields
+from marshmallow.validate import Length
 from sanic import Blueprint
+from sanic.exceptions import InvalidUsage
 from sanic.request import Request
 from sanic.response import HTTPResponse
 from sanic_openapi import doc
@@ -28,11 +34,89 @@ from immuni_common.models.enums import Location
 from immuni_common.models.marshmallow.fields import IdTestVerification, IsoDate, OtpCode
 from immuni_common.models.marshmallow.validators import OTP_LENGTH
 from immuni_common.models.swagger import HeaderImmuniContentTypeJson
-from immuni_otp.helpers.otp import store
-from immuni_otp.models.swagger import OtpBody
+from immuni_otp.core import config
+from immuni_otp.core.exceptions import (
+    DeadlineExceededException,
+    ServiceUnavailableException,
+    TooManyRequestsException,
+)
+from immuni_otp.helpers.admission import handle_service_unavailable
+from immuni_otp.helpers.deadline import request_deadline
+from immuni_otp.helpers.monitoring import timed_validation, validation_started_at
+from immuni_otp.helpers.otp import audit, audit_invalid, otp_type, store, store_many
+from immuni_otp.helpers.validation import fast_validation, parse_authorization
+from immuni_otp.models.enums import AuthorizationOutcome
+from immuni_otp.models.marshmallow.schemas import OtpAuthorizationSchema
+from immuni_otp.models.swagger import OtpBatchBody, OtpBatchResponse, OtpBody
+from immuni_otp.monitoring.api import OTP_AUTHORIZATIONS, OTP_VALIDATION_SECONDS
+
+_Handler = Callable[..., Awaitable[HTTPResponse]]
 
 bp = Blueprint("otp", url_prefix="/otp")
 
+# The outcome audited for the authorizations failing with each exception, "error" if not listed.
+_AUDITED_OUTCOMES: Dict[Type[Exception], str] = {
+    OtpCollisionException: AuthorizationOutcome.COLLISION.value,
+    TooManyRequestsException: AuthorizationOutcome.RATE_LIMITED.value,
+    ServiceUnavailableException: "shed",
+    DeadlineExceededException: "deadline_exceeded",
+}
+
+
+def _caller(request: Request) -> Optional[str]:
+    """
+    Return the identity of the client, as forwarded in the configured header.
+
+    :param request: the HTTP request object.
+    :return: the value of the configured header, None if missing.
+    """
+    return request.headers.get(config.OTP_RATE_LIMIT_CLIENT_HEADER)
+
+
+def _client(request: Request) -> Optional[str]:
+    """
+    Return the identity of the client to rate limit, if enabled in the configuration.
+
+    :param request: the HTTP request object.
+    :return: the value of the configured header, empty if missing, None if not rate limited.
+    """
+    if not config.OTP_RATE_LIMIT_ENABLED:
+        return None
+    return _caller(request) or ""
+
+
+def _submitted_otp(request: Request) -> Any:
+    """
+    Return the OTP submitted with the given request, as is.
+
+    :param request: the HTTP request object.
+    :return: the value of the otp field, None if missing or if the body is not a JSON object.
+    """
+    try:
+        body = request.json
+    except InvalidUsage:
+        return None
+    return body.get("otp") if isinstance(body, dict) else None
+
+
+def _audit_invalid(handler: _Handler) -> _Handler:
+    """
+    Decorator auditing the authorizations rejected as invalid (i.e., with 400).
+
+    :param handler: the handler to decorate, validating its request.
+    :return: the decorated handler.
+    """
+
+    @wraps(handler)
+    async def _wrapper(request: Request, *args: Any, **kwargs: Any) -> HTTPResponse:
+        try:
+            return await handler(request, *args, **kwargs)
+        except (SchemaValidationException, InvalidUsage):
+            audit_invalid(_submitted_otp(request), _caller(request), validation_started_at())
+            raise
+
+    return _wrapper
+
 
 @bp.route("", methods=["POST"], version=1)
 @doc.summary("Authorise OTP (caller: HIS).")
@@ -43,6 +127,9 @@ bp = Blueprint("otp", url_prefix="/otp")
     "the infrastructure level. "
     "The payload also contains the start date of the symptoms, so that the Exposure Ingestion "
     "Service can compute the Transmission Risk for each uploaded TEK."
+    "<br><br>"
+    "Authorising again an already authorised OTP with the same payload (e.g., when retrying after "
+    "a timeout) succeeds without effects, while authorising it with a different payload fails."
 )
 @doc.consumes(OtpBody, location="body")
 @doc.consumes(HeaderImmuniContentTypeJson(), location="header", required=True)
@@ -51,11 +138,22 @@ bp = Blueprint("otp", url_prefix="/otp")
 )
 @doc_exception(SchemaValidationException)
 @doc_exception(OtpCollisionException)
-@validate(
-    location=Location.JSON,
-    otp=OtpCode(),
-    symptoms_started_on=IsoDate(),
-    id_test_verification=IdTestVerification(),
+@doc_exception(ServiceUnavailableException)
+@doc_exception(TooManyRequestsException)
+@doc_exception(DeadlineExceededException)
+@handle_service_unavailable
+@_audit_invalid
+@timed_validation(
+    OTP_VALIDATION_SECONDS,
+    fast_validation(
+        parse_authorization,
+        validate(
+            location=Location.JSON,
+            otp=OtpCode(),
+            symptoms_started_on=IsoDate(),
+            id_test_verification=IdTestVerification(),
+        ),
+    ),
 )
 @cache(no_store=True)
 async def authorize_otp(
@@ -68,14 +166,111 @@ async def authorize_otp(
     :param otp: the OTP code to authorize.
     :param symptoms_started_on: the date of the first symptoms.
     :param id_test_verification: the id of the test returned from HIS service.
-    :return: 204 on OTP successfully authorized, 400 on BadRequest, 409 on OTP already authorized.
+    :return: 204 on OTP successfully authorized (or already authorized with the same payload), 400
+      on BadRequest, 409 on OTP already authorized with a different payload, 429 with Retry-After
+      if the client exceeded its rate limit, 503 with Retry-After if the database call is shed by
+      the admission control, 504 with Retry-After if the OTP is not stored before the deadline.
     """
     if len(otp) > OTP_LENGTH and id_test_verification is None:
         raise SchemaValidationException
-    await store(
-        otp=otp,
-        otp_data=OtpData(
-            symptoms_started_on=symptoms_started_on, id_test_verification=id_test_verification
-        ),
-    )
+    validated_at = perf_counter()
+    outcome = "error"
+    try:
+        outcome = (
+            await store(
+                otp=otp,
+                otp_data=OtpData(
+                    symptoms_started_on=symptoms_started_on,
+                    id_test_verification=id_test_verification,
+                ),
+                client=_client(request),
+                deadline=request_deadline(request),
+            )
+        ).value
+    except Exception as exception:
+        outcome = _AUDITED_OUTCOMES.get(type(exception), outcome)
+        raise
+    finally:
+        audit(otp, _caller(request), outcome, validation_started_at(), validated_at)
     return json_response(body=None, status=HTTPStatus.NO_CONTENT)
+
+
+@bp.route("/batch", methods=["POST"], version=1)
+@doc.summary("Authorise a batch of OTPs (caller: HIS).")
+@doc.description(
+    "Authorise multiple OTPs at once, e.g., when reconciling the authorisations queued by the HIS "
+    "during an outage. Each OTP is validated and stored independently, with the same semantics "
+    "as /v1/otp, and all the OTPs are stored with a single round trip to the database. "
+    "The response reports the outcome of each OTP, in the same order as the request."
+)
+@doc.consumes(OtpBatchBody, location="body")
+@doc.consumes(HeaderImmuniContentTypeJson(), location="header", required=True)
+@doc.response(
+    HTTPStatus.OK.value, OtpBatchResponse, description="Outcome of each OTP authorisation.",
+)
+@doc_exception(SchemaValidationException)
+@doc_exception(ServiceUnavailableException)
+@doc_exception(TooManyRequestsException)
+@doc_exception(DeadlineExceededException)
+@handle_service_unavailable
+@validate(
+    location=Location.JSON,
+    otps=fields.List(
+        fields.Raw(), required=True, validate=Length(min=1, max=config.OTP_BATCH_MAX_SIZE)
+    ),
+)
+@cache(no_store=True)
+async def authorize_otp_batch(request: Request, otps: List[Any]) -> HTTPResponse:
+    """
+    Authorize the upload of the Mobile Client’s TEKs for a batch of OTPs.
+
+    :param request: the HTTP request object.
+    :param otps: the list of OTP authorizations, each one to be validated independently.
+    :return: 200 with the outcome of each authorization, 400 on BadRequest, 503 with Retry-After
+      if the database calls are shed by the admission control, 504 with Retry-After if the OTPs
+      are not stored before the deadline.
+    """
+    started_at = perf_counter()
+    schema = OtpAuthorizationSchema()
+    authorizations: List[Optional[Dict[str, Any]]] = []
+    for item in otps:
+        try:
+            authorizations.append(schema.load(item))
+        except ValidationError:
+            authorizations.append(None)
+            audit_invalid(
+                item.get("otp") if isinstance(item, dict) else None, _caller(request), started_at
+            )
+
+    valid: List[Tuple[str, OtpData]] = [
+        (authorization["otp"], authorization["otp_data"])
+        for authorization in authorizations
+        if authorization is not None
+    ]
+    validated_at = perf_counter()
+    try:
+        stored_outcomes = await store_many(
+            valid, client=_client(request), deadline=request_deadline(request)
+        )
+    except Exception as exception:
+        for otp, _ in valid:
+            audit(
+                otp,
+                _caller(request),
+                _AUDITED_OUTCOMES.get(type(exception), "error"),
+                started_at,
+                validated_at,
+            )
+        raise
+    for (otp, _), outcome in zip(valid, stored_outcomes):
+        OTP_AUTHORIZATIONS.labels(otp_type(otp), outcome.value).inc()
+        audit(otp, _caller(request), outcome.value, started_at, validated_at)
+    stored = iter(stored_outcomes)
+
+    outcomes = [
+        AuthorizationOutcome.INVALID if authorization is None else next(stored)
+        for authorization in authorizations
+    ]
+    return json_response(
+        body={"outcomes": [outcome.value for outcome in outcomes]}, status=HTTPStatus.OK
+    )
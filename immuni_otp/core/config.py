@@ -11,14 +11,201 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import tempfile
 from datetime import timedelta
+from typing import List
 
-from decouple import config
+from decouple import Csv, config
 
+from immuni_otp.models.enums import StorageBackend, StorageFormat
+
+# The backend to store OtpData on. The memory backend keeps OtpData within each process, and is
+# only suitable for single-process deployments and tests.
+OTP_STORAGE_BACKEND: StorageBackend = config(
+    "OTP_STORAGE_BACKEND", default=StorageBackend.REDIS.value, cast=StorageBackend
+)
+# The resolution the memory backend reclaims the memory of expired OtpData with.
+OTP_MEMORY_STORAGE_TICK_MILLISECONDS: int = config(
+    "OTP_MEMORY_STORAGE_TICK_MILLISECONDS", default=1000, cast=int
+)
 OTP_CACHE_REDIS_URL: str = config("OTP_CACHE_REDIS_URL", default="redis://localhost:6379/0")
+# The URLs of the Redis shards to store OtpData on. If not set, OtpData are stored on the single
+# Redis at OTP_CACHE_REDIS_URL. Keys are assigned to the shards by their position in the list, so
+# that their URLs can change: new shards must be appended, and existing ones never reordered.
+OTP_CACHE_REDIS_URLS: List[str] = config(
+    "OTP_CACHE_REDIS_URLS", default=OTP_CACHE_REDIS_URL, cast=Csv()
+)
+OTP_CACHE_REDIS_VIRTUAL_NODES: int = config("OTP_CACHE_REDIS_VIRTUAL_NODES", default=160, cast=int)
+# The number of connections each worker opens to each Redis on start, and keeps open, warming
+# them up before serving requests.
+OTP_CACHE_REDIS_MIN_CONNECTIONS: int = config(
+    "OTP_CACHE_REDIS_MIN_CONNECTIONS", default=1, cast=int
+)
 OTP_CACHE_REDIS_MAX_CONNECTIONS: int = config(
     "OTP_CACHE_REDIS_MAX_CONNECTIONS", default=10, cast=int
 )
+# The interval at which each worker samples the open and free connections of its Redis pools, so
+# that the gauges are live even while the worker stores no OTP. If 0, they are only sampled when
+# storing OTPs.
+OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS: int = config(
+    "OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS", default=1000, cast=int
+)
 OTP_EXPIRATION_SECONDS: int = config(
     "OTP_EXPIRATION_SECONDS", default=int(timedelta(minutes=2.5).total_seconds()), cast=int
 )
+OTP_BATCH_MAX_SIZE: int = config("OTP_BATCH_MAX_SIZE", default=500, cast=int)
+OTP_STORE_COALESCING_ENABLED: bool = config(
+    "OTP_STORE_COALESCING_ENABLED", default=False, cast=bool
+)
+OTP_STORE_COALESCING_MAX_ITEMS: int = config("OTP_STORE_COALESCING_MAX_ITEMS", default=64, cast=int)
+OTP_STORE_COALESCING_WINDOW_MILLISECONDS: int = config(
+    "OTP_STORE_COALESCING_WINDOW_MILLISECONDS", default=2, cast=int
+)
+OTP_STORAGE_FORMAT: StorageFormat = config(
+    "OTP_STORAGE_FORMAT", default=StorageFormat.JSON.value, cast=StorageFormat
+)
+# If enabled, an OTP is considered already authorised if stored with any of the formats, so that
+# the format can be switched while OTPs stored with the previous one are still alive.
+OTP_STORAGE_DUAL_READ: bool = config("OTP_STORAGE_DUAL_READ", default=False, cast=bool)
+# If enabled, each worker remembers the OTPs it stored in the last OTP_EXPIRATION_SECONDS, so that
+# repeated authorisations are rejected without reaching the database. The local answers are not
+# charged to the rate limit of the client. An OTP is forgotten once consumed through this worker,
+# but not when consumed by another process (e.g., the Exposure Ingestion Service): enable only if
+# re-authorising a consumed OTP before its expiration is not expected.
+OTP_RECENT_FILTER_ENABLED: bool = config("OTP_RECENT_FILTER_ENABLED", default=False, cast=bool)
+OTP_RECENT_FILTER_BUCKET_SECONDS: int = config(
+    "OTP_RECENT_FILTER_BUCKET_SECONDS", default=10, cast=int
+)
+OTP_RECENT_FILTER_MAX_SIZE: int = config("OTP_RECENT_FILTER_MAX_SIZE", default=100000, cast=int)
+# If enabled, the Redis calls of each worker are subject to admission control: calls are rejected
+# with 503 when too many are in flight, or when the latency or the error rate of the last calls
+# crosses the thresholds, instead of queueing behind the connection pool.
+OTP_ADMISSION_CONTROL_ENABLED: bool = config(
+    "OTP_ADMISSION_CONTROL_ENABLED", default=False, cast=bool
+)
+OTP_ADMISSION_MAX_IN_FLIGHT: int = config("OTP_ADMISSION_MAX_IN_FLIGHT", default=100, cast=int)
+OTP_ADMISSION_RETRY_AFTER_SECONDS: int = config(
+    "OTP_ADMISSION_RETRY_AFTER_SECONDS", default=1, cast=int
+)
+OTP_CIRCUIT_BREAKER_WINDOW_SIZE: int = config(
+    "OTP_CIRCUIT_BREAKER_WINDOW_SIZE", default=100, cast=int
+)
+OTP_CIRCUIT_BREAKER_MIN_CALLS: int = config("OTP_CIRCUIT_BREAKER_MIN_CALLS", default=20, cast=int)
+OTP_CIRCUIT_BREAKER_FAILURE_RATE: float = config(
+    "OTP_CIRCUIT_BREAKER_FAILURE_RATE", default=0.5, cast=float
+)
+OTP_CIRCUIT_BREAKER_SLOW_CALL_MILLISECONDS: int = config(
+    "OTP_CIRCUIT_BREAKER_SLOW_CALL_MILLISECONDS", default=250, cast=int
+)
+OTP_CIRCUIT_BREAKER_SLOW_CALL_RATE: float = config(
+    "OTP_CIRCUIT_BREAKER_SLOW_CALL_RATE", default=0.5, cast=float
+)
+OTP_CIRCUIT_BREAKER_OPEN_SECONDS: int = config(
+    "OTP_CIRCUIT_BREAKER_OPEN_SECONDS", default=5, cast=int
+)
+# If enabled, the OTP authorizations in canonical form are validated with a specialized parser,
+# rather than through the generic schema validation.
+OTP_FAST_VALIDATION_ENABLED: bool = config("OTP_FAST_VALIDATION_ENABLED", default=False, cast=bool)
+# If enabled, the authorizations which cannot be stored because Redis is unreachable are appended
+# to a local ring file and acknowledged, and replayed into Redis in the background, with their
+# remaining expiration, as soon as Redis is reachable again. A buffered authorization colliding,
+# when replayed, with an OTP stored meanwhile with a different payload is discarded, after having
+# been acknowledged: enable only if this is acceptable.
+OTP_BUFFER_ENABLED: bool = config("OTP_BUFFER_ENABLED", default=False, cast=bool)
+# The directory of the ring files, one per worker.
+OTP_BUFFER_DIRECTORY: str = config(
+    "OTP_BUFFER_DIRECTORY", default=os.path.join(tempfile.gettempdir(), "immuni-otp-buffer")
+)
+OTP_BUFFER_MAX_BYTES: int = config("OTP_BUFFER_MAX_BYTES", default=16 * 1024 * 1024, cast=int)
+OTP_BUFFER_REPLAY_INTERVAL_MILLISECONDS: int = config(
+    "OTP_BUFFER_REPLAY_INTERVAL_MILLISECONDS", default=1000, cast=int
+)
+# If disabled, the API documentation of the service is neither served nor built at the start of
+# each worker, to speed it up (e.g., in production).
+OTP_API_DOCS_ENABLED: bool = config("OTP_API_DOCS_ENABLED", default=True, cast=bool)
+# The number of worker processes of the native multi-worker server, each one binding its own
+# socket with SO_REUSEPORT. If 0, the application is run with run_app() instead.
+OTP_PREFORK_WORKERS: int = config("OTP_PREFORK_WORKERS", default=0, cast=int)
+OTP_PREFORK_HOST: str = config("OTP_PREFORK_HOST", default="0.0.0.0")  # nosec
+OTP_PREFORK_PORT: int = config("OTP_PREFORK_PORT", default=5000, cast=int)
+# The number of requests after which each worker is replaced, plus a random jitter, so that the
+# workers are not replaced all at once. If 0, the workers are never replaced. The connections still
+# queued in the backlog of a replaced worker are reset, and must be retried by the clients.
+OTP_PREFORK_MAX_REQUESTS: int = config("OTP_PREFORK_MAX_REQUESTS", default=10000, cast=int)
+OTP_PREFORK_MAX_REQUESTS_JITTER: int = config(
+    "OTP_PREFORK_MAX_REQUESTS_JITTER", default=1000, cast=int
+)
+# If enabled, each worker is pinned to a single CPU.
+OTP_PREFORK_CPU_AFFINITY: bool = config("OTP_PREFORK_CPU_AFFINITY", default=False, cast=bool)
+# The time given to the open connections to complete when a worker is stopped. Workers still
+# running 5 seconds after are killed.
+OTP_PREFORK_GRACEFUL_TIMEOUT_SECONDS: int = config(
+    "OTP_PREFORK_GRACEFUL_TIMEOUT_SECONDS", default=15, cast=int
+)
+# The Redis URLs of the storage OtpData are being migrated to, sharded by consistent hashing as
+# OTP_CACHE_REDIS_URLS. If set, each OTP stored (or consumed) is also stored on (or deleted from)
+# the target storage, on a best-effort basis, until the cutover is complete.
+OTP_MIGRATION_REDIS_URLS: List[str] = config("OTP_MIGRATION_REDIS_URLS", default="", cast=Csv())
+# If enabled, the authorizations of each client (e.g., each HIS deployment) are rate limited with a
+# token bucket on Redis, taken by the same script storing the OTP, at no additional round trip.
+# The client is identified by the given header (e.g., the subject of its TLS client certificate, as
+# forwarded by the ingress), the requests without the header sharing the same bucket.
+OTP_RATE_LIMIT_ENABLED: bool = config("OTP_RATE_LIMIT_ENABLED", default=False, cast=bool)
+OTP_RATE_LIMIT_CLIENT_HEADER: str = config(
+    "OTP_RATE_LIMIT_CLIENT_HEADER", default="X-Client-Subject"
+)
+# The sustained number of authorizations per second allowed to each client, and the number of
+# authorizations it can burst with. The rate must be positive if rate limiting is enabled.
+OTP_RATE_LIMIT_PER_SECOND: float = config("OTP_RATE_LIMIT_PER_SECOND", default=100, cast=float)
+OTP_RATE_LIMIT_BURST: int = config("OTP_RATE_LIMIT_BURST", default=200, cast=int)
+# The time within which each authorization must be stored, after which the Redis call (and the
+# wait for a free connection before it) is cancelled, and the request fails with 504, to be
+# retried. Clients can request a shorter timeout, in milliseconds, with the given header. If 0, the
+# requests without the header have no deadline.
+OTP_REQUEST_TIMEOUT_MILLISECONDS: int = config(
+    "OTP_REQUEST_TIMEOUT_MILLISECONDS", default=0, cast=int
+)
+OTP_REQUEST_TIMEOUT_HEADER: str = config("OTP_REQUEST_TIMEOUT_HEADER", default="X-Request-Timeout")
+# If enabled, an audit record of each authorization (the SHA-256 of the OTP, the client, the
+# outcome, and the duration of each stage) is queued in memory, and written in the background to
+# NDJSON files in the given directory, one per worker at a time, rotated at the given size.
+OTP_AUDIT_ENABLED: bool = config("OTP_AUDIT_ENABLED", default=False, cast=bool)
+OTP_AUDIT_DIRECTORY: str = config(
+    "OTP_AUDIT_DIRECTORY", default=os.path.join(tempfile.gettempdir(), "immuni-otp-audit")
+)
+OTP_AUDIT_MAX_FILE_BYTES: int = config(
+    "OTP_AUDIT_MAX_FILE_BYTES", default=64 * 1024 * 1024, cast=int
+)
+# The maximum number of records waiting to be written, the records exceeding it being dropped.
+OTP_AUDIT_QUEUE_SIZE: int = config("OTP_AUDIT_QUEUE_SIZE", default=10000, cast=int)
+# The records are written as soon as the given number of them is queued, or at the given interval.
+OTP_AUDIT_BATCH_SIZE: int = config("OTP_AUDIT_BATCH_SIZE", default=1000, cast=int)
+OTP_AUDIT_FLUSH_INTERVAL_MILLISECONDS: int = config(
+    "OTP_AUDIT_FLUSH_INTERVAL_MILLISECONDS", default=1000, cast=int
+)
+# If enabled, GET /v1/admin/profile is registered, sampling the event loop of the worker serving it
+# for the given number of seconds (at most the configured maximum), returning the collapsed stacks.
+# This route is internal, and must not be exposed outside of the cluster.
+OTP_PROFILER_ENABLED: bool = config("OTP_PROFILER_ENABLED", default=False, cast=bool)
+OTP_PROFILER_MAX_SECONDS: int = config("OTP_PROFILER_MAX_SECONDS", default=60, cast=int)
+OTP_PROFILER_INTERVAL_MILLISECONDS: int = config(
+    "OTP_PROFILER_INTERVAL_MILLISECONDS", default=5, cast=int
+)
+# If enabled, each worker pings Redis in the background at the given interval, and GET /health/live
+# and GET /health/ready are registered, served from the outcome of the last probes without any
+# round trip to Redis. The worker is not ready if, over the given number of probes, the ratio of
+# failed probes reaches the given rate, or the mean latency of the successful ones exceeds the
+# given one.
+OTP_HEALTH_ENABLED: bool = config("OTP_HEALTH_ENABLED", default=False, cast=bool)
+OTP_HEALTH_PROBE_INTERVAL_MILLISECONDS: int = config(
+    "OTP_HEALTH_PROBE_INTERVAL_MILLISECONDS", default=1000, cast=int
+)
+OTP_HEALTH_PROBE_TIMEOUT_MILLISECONDS: int = config(
+    "OTP_HEALTH_PROBE_TIMEOUT_MILLISECONDS", default=500, cast=int
+)
+OTP_HEALTH_WINDOW_SIZE: int = config("OTP_HEALTH_WINDOW_SIZE", default=10, cast=int)
+OTP_HEALTH_MAX_FAILURE_RATE: float = config("OTP_HEALTH_MAX_FAILURE_RATE", default=0.5, cast=float)
+OTP_HEALTH_MAX_LATENCY_MILLISECONDS: int = config(
+    "OTP_HEALTH_MAX_LATENCY_MILLISECONDS", default=100, cast=int
+)
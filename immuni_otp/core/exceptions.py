@@ -0,0 +1,59 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from http import HTTPStatus
+
+from immuni_common.core.exceptions import ApiException
+
+
+class RetryableException(ApiException):
+    """
+    Raised when the request has not been served, and can be retried later.
+    """
+
+    def __init__(self, retry_after: int = 1) -> None:
+        """
+        :param retry_after: the number of seconds after which the request can be retried.
+        """
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class ServiceUnavailableException(RetryableException):
+    """
+    Raised when the request is shed to protect the database, and can be retried later.
+    """
+
+    status_code = HTTPStatus.SERVICE_UNAVAILABLE
+    error_code = 1503
+    error_message = "Service temporarily unavailable, please retry later."
+
+
+class TooManyRequestsException(RetryableException):
+    """
+    Raised when the client exceeded its rate limit, and can retry later.
+    """
+
+    status_code = HTTPStatus.TOO_MANY_REQUESTS
+    error_code = 1429
+    error_message = "Too many requests, please retry later."
+
+
+class DeadlineExceededException(RetryableException):
+    """
+    Raised when the request could not be served before its deadline, and can be retried.
+    """
+
+    status_code = HTTPStatus.GATEWAY_TIMEOUT
+    error_code = 1504
+    error_message = "The request could not be served in time, please retry."
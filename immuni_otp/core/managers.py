@@ -11,13 +11,44 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Optional
+import asyncio
+from typing import Optional, Sequence, Tuple
 
 from aioredis import Redis, create_redis_pool
 
 from immuni_common.core.exceptions import ImmuniException
 from immuni_common.core.managers import BaseManagers
 from immuni_otp.core import config
+from immuni_otp.helpers.audit import AuditLog
+from immuni_otp.helpers.pool import observe_pool, warm_up
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.helpers.sharding import HashRing, shard_nodes
+from immuni_otp.helpers.storage import MemoryStorage, OtpStorage, RedisStorage
+from immuni_otp.models.enums import StorageBackend
+
+
+async def _create_shards(urls: Sequence[str]) -> Tuple[Redis, ...]:
+    """
+    Create the connection pools of the given Redis shards, and warm them up.
+
+    :param urls: the URLs of the shards.
+    :return: the Redis managers of the shards, in the given order.
+    """
+    shards = tuple(
+        await asyncio.gather(
+            *(
+                create_redis_pool(
+                    address=url,
+                    encoding="utf-8",
+                    minsize=config.OTP_CACHE_REDIS_MIN_CONNECTIONS,
+                    maxsize=config.OTP_CACHE_REDIS_MAX_CONNECTIONS,
+                )
+                for url in urls
+            )
+        )
+    )
+    await asyncio.gather(*(warm_up(redis) for redis in shards))
+    return shards
 
 
 class Managers(BaseManagers):
@@ -26,11 +57,58 @@ class Managers(BaseManagers):
     """
 
     _otp_redis: Optional[Redis] = None
+    _otp_redis_shards: Tuple[Redis, ...] = ()
+    _otp_storage: Optional[OtpStorage] = None
+    _otp_buffer: Optional[RingBuffer] = None
+    _otp_migration_shards: Tuple[Redis, ...] = ()
+    _otp_migration_storage: Optional[RedisStorage] = None
+    _otp_audit_log: Optional[AuditLog] = None
+
+    @property
+    def otp_storage(self) -> OtpStorage:
+        """
+        Return the storage of OtpData, on the configured backend.
+
+        :return: the storage of OtpData.
+        :raise: ImmuniException if the storage is not initialized.
+        """
+        if self._otp_storage is None:
+            raise ImmuniException("Cannot use the OTP storage before initialising it.")
+        return self._otp_storage
+
+    @property
+    def otp_buffer(self) -> Optional[RingBuffer]:
+        """
+        Return the local buffer of the authorizations to replay into Redis, if enabled in the
+        configuration.
+
+        :return: the local buffer of this process, None if not enabled.
+        """
+        return self._otp_buffer
+
+    @property
+    def otp_migration_storage(self) -> Optional[RedisStorage]:
+        """
+        Return the storage OtpData are being migrated to, if configured.
+
+        :return: the storage on the migration target Redis, None if not configured.
+        """
+        return self._otp_migration_storage
+
+    @property
+    def otp_audit_log(self) -> Optional[AuditLog]:
+        """
+        Return the audit log of the authorizations, if enabled in the configuration.
+
+        :return: the audit log of this process, None if not enabled.
+        """
+        return self._otp_audit_log
 
     @property
     def otp_redis(self) -> Redis:
         """
         Return the Redis manager to store OtpData.
+        If OtpData are sharded across multiple Redis, this is the manager of the first shard.
 
         :return: the Redis manager to store OtpData.
         :raise: ImmuniException if the manager is not initialized.
@@ -39,25 +117,79 @@ class Managers(BaseManagers):
             raise ImmuniException("Cannot use the Redis manager before initialising it.")
         return self._otp_redis
 
+    @property
+    def otp_redis_shards(self) -> Tuple[Redis, ...]:
+        """
+        Return the Redis managers of all the shards OtpData are stored on.
+
+        :return: the Redis managers of all the shards, in configuration order.
+        :raise: ImmuniException if the managers are not initialized.
+        """
+        if not self._otp_redis_shards:
+            raise ImmuniException("Cannot use the Redis managers before initialising them.")
+        return self._otp_redis_shards
+
     async def initialize(self) -> None:
         """
         Initialize managers on demand.
         """
         await super().initialize()
-        self._otp_redis = await create_redis_pool(
-            address=config.OTP_CACHE_REDIS_URL,
-            encoding="utf-8",
-            maxsize=config.OTP_CACHE_REDIS_MAX_CONNECTIONS,
+        if config.OTP_AUDIT_ENABLED:
+            self._otp_audit_log = AuditLog(
+                directory=config.OTP_AUDIT_DIRECTORY,
+                queue_size=config.OTP_AUDIT_QUEUE_SIZE,
+                batch_size=config.OTP_AUDIT_BATCH_SIZE,
+                max_file_bytes=config.OTP_AUDIT_MAX_FILE_BYTES,
+            )
+        if config.OTP_STORAGE_BACKEND == StorageBackend.MEMORY:
+            self._otp_storage = MemoryStorage(
+                tick_seconds=config.OTP_MEMORY_STORAGE_TICK_MILLISECONDS / 1000
+            )
+            return
+        self._otp_redis_shards = await _create_shards(config.OTP_CACHE_REDIS_URLS)
+        for shard, otp_redis in enumerate(self._otp_redis_shards):
+            observe_pool(shard, otp_redis.connection)
+        self._otp_redis = self._otp_redis_shards[0]
+        self._otp_storage = RedisStorage(
+            shards=self._otp_redis_shards,
+            ring=HashRing(
+                nodes=shard_nodes(len(self._otp_redis_shards)),
+                virtual_nodes=config.OTP_CACHE_REDIS_VIRTUAL_NODES,
+            ),
         )
+        if config.OTP_MIGRATION_REDIS_URLS:
+            self._otp_migration_shards = await _create_shards(config.OTP_MIGRATION_REDIS_URLS)
+            self._otp_migration_storage = RedisStorage(
+                shards=self._otp_migration_shards,
+                ring=HashRing(
+                    nodes=shard_nodes(len(self._otp_migration_shards)),
+                    virtual_nodes=config.OTP_CACHE_REDIS_VIRTUAL_NODES,
+                ),
+                label_prefix="migration-",
+            )
+        if config.OTP_BUFFER_ENABLED:
+            self._otp_buffer = RingBuffer.open_slot(
+                directory=config.OTP_BUFFER_DIRECTORY, capacity_bytes=config.OTP_BUFFER_MAX_BYTES
+            )
 
     async def teardown(self) -> None:
         """
         Perform teardown actions (e.g., close open connections).
         """
         await super().teardown()
-        if self._otp_redis is not None:
-            self._otp_redis.close()
-            await self._otp_redis.wait_closed()
+        for otp_redis in (*self._otp_redis_shards, *self._otp_migration_shards):
+            otp_redis.close()
+        for otp_redis in (*self._otp_redis_shards, *self._otp_migration_shards):
+            await otp_redis.wait_closed()
+        self._otp_migration_shards = ()
+        self._otp_migration_storage = None
+        if self._otp_buffer is not None:
+            self._otp_buffer.close()
+            self._otp_buffer = None
+        if self._otp_audit_log is not None:
+            await self._otp_audit_log.flush()
+            self._otp_audit_log.close()
+            self._otp_audit_log = None
 
 
 managers = Managers()
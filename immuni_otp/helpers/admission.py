@@ -0,0 +1,286 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import wraps
+from math import ceil
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Optional, Tuple
+
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from immuni_common.helpers.sanic import json_response
+from immuni_otp.core.exceptions import RetryableException, ServiceUnavailableException
+from immuni_otp.models.enums import CircuitState
+from immuni_otp.monitoring.api import OTP_CIRCUIT_STATE, OTP_SHED_REQUESTS
+
+
+class InFlightLimiter:
+    """
+    Bound the number of operations in flight, rejecting new ones instead of queueing them.
+    """
+
+    def __init__(self, max_in_flight: int) -> None:
+        """
+        :param max_in_flight: the maximum number of operations in flight.
+        """
+        self._max_in_flight = max_in_flight
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of operations currently in flight.
+        """
+        return self._in_flight
+
+    def try_acquire(self) -> bool:
+        """
+        Start an operation, if the limit allows it.
+
+        :return: True if the operation can start, False if too many operations are in flight.
+        """
+        if self._in_flight >= self._max_in_flight:
+            return False
+        self._in_flight += 1
+        return True
+
+    def release(self) -> None:
+        """
+        Complete an operation started with try_acquire().
+        """
+        self._in_flight -= 1
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """
+    Stop sending calls to a dependency whose latency or error rate has degraded.
+
+    The breaker is closed as long as, over the last calls, both the ratio of failed calls and the
+    ratio of slow calls are below the configured thresholds. Otherwise, it opens, rejecting all the
+    calls for a cool-down period. After the cool-down, it is half-open, letting a single probe call
+    through: the breaker closes again if the probe is fast and successful, and reopens otherwise.
+    The outcome of the calls started before the last change of state is ignored.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        window_size: int,
+        min_calls: int,
+        failure_rate_threshold: float,
+        slow_call_seconds: float,
+        slow_call_rate_threshold: float,
+        open_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param window_size: the number of most recent calls the rates are computed on.
+        :param min_calls: the minimum number of calls in the window for the breaker to open.
+        :param failure_rate_threshold: the ratio of failed calls opening the breaker.
+        :param slow_call_seconds: the latency above which a call is considered slow.
+        :param slow_call_rate_threshold: the ratio of slow calls opening the breaker.
+        :param open_seconds: the number of seconds the breaker stays open before a probe.
+        :param clock: the monotonic clock, in seconds.
+        """
+        self._min_calls = min_calls
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_seconds = slow_call_seconds
+        self._slow_call_rate_threshold = slow_call_rate_threshold
+        self._open_seconds = open_seconds
+        self._clock = clock
+        # Whether each call in the window failed, and whether it was slow.
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        # Incremented at each change of state, telling apart the calls started before it.
+        self._generation = 0
+
+    @property
+    def state(self) -> CircuitState:
+        """
+        The current state of the breaker, turning half-open once the cool-down has elapsed.
+        """
+        if (
+            self._state == CircuitState.OPEN
+            and self._clock() >= self._opened_at + self._open_seconds
+        ):
+            self._set_state(CircuitState.HALF_OPEN)
+        return self._state
+
+    @property
+    def retry_after(self) -> int:
+        """
+        The number of seconds, rounded up, before the breaker lets calls through again.
+        """
+        return max(ceil(self._opened_at + self._open_seconds - self._clock()), 1)
+
+    def allow(self) -> Optional[int]:
+        """
+        Start a call, if the breaker lets it through.
+
+        :return: the ticket of the call, to be passed to record() or abandon(), None if the breaker
+          rejects the call.
+        """
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return self._generation
+        if state == CircuitState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return self._generation
+        return None
+
+    def record(self, call: int, seconds: float, failed: bool) -> None:
+        """
+        Record the outcome of a call started with allow().
+
+        :param call: the ticket of the call, as returned by allow().
+        :param seconds: the latency of the call.
+        :param failed: whether the call failed.
+        """
+        if call != self._generation:
+            # The call started before the last change of state (e.g., before the breaker opened,
+            # while the probe is in flight): its outcome says nothing about the current state.
+            return
+        slow = seconds > self._slow_call_seconds
+        if self._state == CircuitState.HALF_OPEN:
+            # Only the probe call was let through since the breaker turned half-open.
+            self._probing = False
+            if failed or slow:
+                self._open()
+            else:
+                self._calls.clear()
+                self._set_state(CircuitState.CLOSED)
+            return
+
+        self._calls.append((failed, slow))
+        if len(self._calls) < self._min_calls:
+            return
+        failures = sum(call_failed for call_failed, _ in self._calls)
+        slow_calls = sum(call_slow for _, call_slow in self._calls)
+        if (
+            failures / len(self._calls) >= self._failure_rate_threshold
+            or slow_calls / len(self._calls) >= self._slow_call_rate_threshold
+        ):
+            self._open()
+
+    def abandon(self, call: int, seconds: float) -> None:
+        """
+        Give up a call started with allow() before its outcome is known (e.g., cancelled as the
+        client disconnected). The call is only recorded as slow, if it already was, and otherwise
+        ignored, letting another probe through if it was the probe.
+
+        :param call: the ticket of the call, as returned by allow().
+        :param seconds: the time elapsed since the call started.
+        """
+        if seconds > self._slow_call_seconds:
+            self.record(call, seconds, failed=False)
+        elif call == self._generation and self._state == CircuitState.HALF_OPEN:
+            self._probing = False
+
+    def _open(self) -> None:
+        """
+        Open the breaker, starting the cool-down period.
+        """
+        self._opened_at = self._clock()
+        self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        """
+        Set the state of the breaker, monitoring it.
+
+        :param state: the new state of the breaker.
+        """
+        self._state = state
+        self._generation += 1
+        for circuit_state in CircuitState:
+            OTP_CIRCUIT_STATE.labels(circuit_state.value).set(circuit_state == state)
+
+
+class Admission:
+    """
+    Admission control for the calls to a dependency, combining a bounded in-flight limiter and a
+    circuit breaker.
+    """
+
+    def __init__(
+        self, limiter: InFlightLimiter, breaker: CircuitBreaker, retry_after_seconds: int
+    ) -> None:
+        """
+        :param limiter: the limiter bounding the calls in flight.
+        :param breaker: the circuit breaker monitoring the latency and outcome of the calls.
+        :param retry_after_seconds: the number of seconds after which a call rejected by the
+          limiter can be retried.
+        """
+        self.limiter = limiter
+        self.breaker = breaker
+        self._retry_after_seconds = retry_after_seconds
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Admit the call made within the context, monitoring its latency and outcome.
+
+        :raises: ServiceUnavailableException if too many calls are in flight, or if the breaker is
+          open.
+        """
+        if not self.limiter.try_acquire():
+            OTP_SHED_REQUESTS.labels("in_flight").inc()
+            raise ServiceUnavailableException(retry_after=self._retry_after_seconds)
+        try:
+            call = self.breaker.allow()
+            if call is None:
+                OTP_SHED_REQUESTS.labels("circuit_open").inc()
+                raise ServiceUnavailableException(retry_after=self.breaker.retry_after)
+            started_at = time.perf_counter()
+            try:
+                yield
+            except asyncio.CancelledError:
+                # Not a failure of the dependency, but of the caller (e.g., a client disconnection).
+                self.breaker.abandon(call, time.perf_counter() - started_at)
+                raise
+            except BaseException:
+                self.breaker.record(call, time.perf_counter() - started_at, failed=True)
+                raise
+            self.breaker.record(call, time.perf_counter() - started_at, failed=False)
+        finally:
+            self.limiter.release()
+
+
+def handle_service_unavailable(
+    handler: Callable[..., Awaitable[HTTPResponse]]
+) -> Callable[..., Awaitable[HTTPResponse]]:
+    """
+    Decorator converting RetryableException (e.g., ServiceUnavailableException) into its error
+    response, with the Retry-After header, so that clients know when to retry.
+
+    :param handler: the request handler to decorate.
+    :return: the decorated request handler.
+    """
+
+    @wraps(handler)
+    async def _wrapper(request: Request, *args: Any, **kwargs: Any) -> HTTPResponse:
+        try:
+            return await handler(request, *args, **kwargs)
+        except RetryableException as exception:
+            response = json_response(
+                body=dict(error_code=exception.error_code, message=exception.error_message),
+                status=exception.status_code,
+            )
+            response.headers["Retry-After"] = str(exception.retry_after)
+            return response
+
+    return _wrapper
@@ -0,0 +1,173 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from itertools import count
+from typing import IO, Deque, List, Optional
+
+from immuni_otp.monitoring.api import OTP_AUDIT_DROPPED, OTP_AUDIT_QUEUED, OTP_AUDIT_WRITTEN
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AuditRecord:
+    """
+    The audit record of an authorization, with the duration of each stage in milliseconds.
+    """
+
+    timestamp: float
+    otp_sha: str
+    client: Optional[str]
+    outcome: str
+    validation_ms: float
+    store_ms: float
+
+    def encode(self) -> bytes:
+        """
+        Serialize the record, as a line of NDJSON.
+
+        :return: the serialized record, terminated by a newline.
+        """
+        return json.dumps(asdict(self), separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class AuditLog:
+    """
+    Audit log of the authorizations, off the request path: records are pushed into a bounded
+    in-memory queue, and written in batches to NDJSON files by a background task, so that requests
+    never wait for the disk. Records pushed while the queue is full are dropped, and counted.
+
+    Each process writes its own files, named after the time they are created at and the process,
+    and starts a new one once the current one exceeds the configured size. Rotated files are never
+    deleted, their retention being up to the collection of the audit logs.
+    """
+
+    def __init__(
+        self, directory: str, queue_size: int, batch_size: int, max_file_bytes: int
+    ) -> None:
+        """
+        :param directory: the directory of the audit files, created if missing.
+        :param queue_size: the maximum number of records waiting to be written.
+        :param batch_size: the number of queued records triggering a write before the interval.
+        :param max_file_bytes: the size after which a new audit file is started.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._max_file_bytes = max_file_bytes
+        self._queue: Deque[AuditRecord] = deque()
+        self._batch_ready = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._stopped = False
+        self._file: Optional[IO[bytes]] = None
+        self._file_bytes = 0
+        self._file_sequence = count()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def push(self, record: AuditRecord) -> bool:
+        """
+        Queue the given record, to be written by the background task.
+
+        :param record: the record to write.
+        :return: True if queued, False if dropped because the queue is full.
+        """
+        if len(self._queue) >= self._queue_size:
+            OTP_AUDIT_DROPPED.inc()
+            return False
+        self._queue.append(record)
+        OTP_AUDIT_QUEUED.inc()
+        if len(self._queue) >= self._batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self) -> None:
+        """
+        Write all the queued records, in batches, in the default executor.
+        Records which cannot be written (e.g., the disk is full) are dropped, and counted.
+        """
+        async with self._write_lock:
+            loop = asyncio.get_event_loop()
+            while self._queue:
+                batch = [
+                    self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))
+                ]
+                OTP_AUDIT_QUEUED.dec(len(batch))
+                try:
+                    await loop.run_in_executor(None, self._write, batch)
+                except OSError:
+                    _LOGGER.exception("Cannot write the audit records.")
+                    OTP_AUDIT_DROPPED.inc(len(batch))
+                else:
+                    OTP_AUDIT_WRITTEN.inc(len(batch))
+
+    async def flush_forever(self, interval_seconds: float) -> None:
+        """
+        Write the queued records as soon as a batch is ready, or periodically, until stopped.
+        The records queued when stopped are written before returning.
+
+        :param interval_seconds: the maximum number of seconds a record waits to be written.
+        """
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    def stop(self) -> None:
+        """
+        Stop flush_forever(), after a last write. Unlike cancelling it, no batch is interrupted
+        while being written.
+        """
+        self._stopped = True
+        self._batch_ready.set()
+
+    def close(self) -> None:
+        """
+        Close the current audit file. Records still queued are discarded, so callers should flush
+        them first.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch: List[AuditRecord]) -> None:
+        """
+        Append the given records to the current audit file, starting a new one if full.
+
+        :param batch: the records to write.
+        """
+        data = b"".join(record.encode() for record in batch)
+        if self._file is not None and self._file_bytes + len(data) > self._max_file_bytes:
+            self.close()
+        if self._file is None:
+            path = os.path.join(
+                self._directory,
+                f"audit-{int(time.time() * 1000)}-{os.getpid()}-{next(self._file_sequence)}.ndjson",
+            )
+            self._file = open(path, "ab")
+            self._file_bytes = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
@@ -0,0 +1,104 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Awaitable, Callable, Generic, List, Optional, Sequence, Set, Tuple, TypeVar
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+
+class WriteCoalescer(Generic[_T, _R]):
+    """
+    Gather the items submitted by concurrent callers, and flush them together with a single call.
+
+    A flush is triggered as soon as either the maximum number of items is pending, or the time
+    window started by the first pending item elapses, whichever comes first.
+    Each caller is resolved with the result (or the exception) associated with its own item.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Sequence[_T]], Awaitable[List[_R]]],
+        max_items: int,
+        window_seconds: float,
+    ) -> None:
+        """
+        :param flush: the coroutine function processing a batch of items, returning one result
+          per item, in the same order.
+        :param max_items: the number of pending items triggering an immediate flush.
+        :param window_seconds: the maximum time an item can wait before being flushed.
+        """
+        self._flush = flush
+        self._max_items = max_items
+        self._window_seconds = window_seconds
+        self._pending: List[Tuple[_T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # The flushes in progress, referenced until done so that they are not garbage collected.
+        self._flushes: Set[asyncio.Future] = set()
+
+    async def submit(self, item: _T) -> _R:
+        """
+        Enqueue the given item for the next flush, and wait for its result.
+
+        :param item: the item to be flushed.
+        :return: the result associated with the given item.
+        :raise: any exception raised while flushing the batch containing the item.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_items:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window_seconds, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self) -> None:
+        """
+        Detach the pending items and flush them in a dedicated task.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            flush = asyncio.ensure_future(self._run(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def close(self) -> None:
+        """
+        Flush the pending items right away, and wait for all the flushes in progress, so that no
+        caller is left waiting, e.g., before the event loop is closed.
+        """
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes)
+
+    async def _run(self, batch: List[Tuple[_T, asyncio.Future]]) -> None:
+        """
+        Flush the given batch, resolving the future associated with each item.
+
+        :param batch: the items to flush, each one with the future awaited by its caller.
+        """
+        try:
+            results = await self._flush([item for item, _ in batch])
+        except Exception as exception:  # pylint: disable=broad-except
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,66 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from sanic.request import Request
+
+from immuni_otp.core import config
+from immuni_otp.core.exceptions import DeadlineExceededException
+from immuni_otp.monitoring.api import OTP_DEADLINE_EXCEEDED
+
+_T = TypeVar("_T")
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """
+    Return the deadline of the given request, after the timeout requested by the client with the
+    configured header, if any, capped by the configured timeout.
+
+    :param request: the HTTP request object.
+    :return: the monotonic time the request must be served by, None if it has no deadline.
+    """
+    timeouts = []
+    if config.OTP_REQUEST_TIMEOUT_MILLISECONDS > 0:
+        timeouts.append(config.OTP_REQUEST_TIMEOUT_MILLISECONDS)
+    header = request.headers.get(config.OTP_REQUEST_TIMEOUT_HEADER, "")
+    # Invalid timeouts are ignored, rather than failing the request.
+    if header.isdigit() and int(header) > 0:
+        timeouts.append(int(header))
+    if not timeouts:
+        return None
+    return time.monotonic() + min(timeouts) / 1000
+
+
+async def within_deadline(awaitable: Awaitable[_T], deadline: Optional[float]) -> _T:
+    """
+    Wait for the given awaitable, cancelling it if the deadline passes first (e.g., a Redis call,
+    and the wait for a free connection before it).
+    Note that a cancelled write may have been applied nonetheless, hence it must be idempotent.
+
+    :param awaitable: the awaitable to wait for.
+    :param deadline: the monotonic time to cancel the awaitable at, None to wait indefinitely.
+    :return: the result of the awaitable.
+    :raise: DeadlineExceededException if the deadline passes before the awaitable is done.
+    """
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        # The awaitable itself may time out (e.g., when connecting), before the deadline.
+        if time.monotonic() < deadline:
+            raise
+        OTP_DEADLINE_EXCEEDED.inc()
+        raise DeadlineExceededException() from None
@@ -0,0 +1,152 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+from struct import Struct
+from typing import Union
+from uuid import UUID
+
+from immuni_common.helpers.otp import key_for_otp_sha
+from immuni_common.models.dataclasses import OtpData
+from immuni_common.models.marshmallow.schemas import OtpDataSchema
+from immuni_otp.models.enums import StorageFormat
+
+_BINARY_KEY_PREFIX = key_for_otp_sha("").encode("utf-8")
+# The size of the raw SHA-256 digest of the OTP, in the keys in BINARY format.
+_DIGEST_SIZE = 32
+
+# Binary OtpData layout (big endian): version, id_test_verification kind, days since epoch of
+# symptoms_started_on, followed by the id_test_verification, if any.
+_BINARY_VERSION = 1
+_BINARY_HEADER = Struct(">BBH")
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# The largest number of days, and id_test_verification length, the binary layout can represent.
+# OtpData out of range (i.e., symptoms_started_on before 1970 or after 2149, or a non-UUID
+# id_test_verification longer than 255 bytes) are stored as UTF-8 JSON instead.
+_MAX_BINARY_DAYS = 2 ** 16 - 1
+_MAX_RAW_ID_TEST_VERIFICATION_BYTES = 2 ** 8 - 1
+
+_NO_ID_TEST_VERIFICATION = 0
+# The id_test_verification is a UUID, stored as its 16 bytes.
+_UUID_ID_TEST_VERIFICATION = 1
+# The id_test_verification is not a canonical UUID, stored as its length-prefixed UTF-8 bytes.
+_RAW_ID_TEST_VERIFICATION = 2
+
+
+def encode_key(otp_sha: str, storage_format: StorageFormat) -> Union[str, bytes]:
+    """
+    Return the database key associated with the given OTP SHA-256, in the given format.
+
+    :param otp_sha: the hex SHA-256 of the OTP (i.e., the CUN).
+    :param storage_format: the format of the key.
+    :return: the hex key if the format is JSON, the raw digest key if the format is BINARY.
+    """
+    if storage_format == StorageFormat.BINARY:
+        return _BINARY_KEY_PREFIX + bytes.fromhex(otp_sha)
+    return key_for_otp_sha(otp_sha)
+
+
+def decode_key(key: bytes) -> str:
+    """
+    Return the hex SHA-256 of the OTP associated with the given database key, in either format.
+
+    :param key: the raw database key.
+    :return: the hex SHA-256 of the OTP.
+    :raise: ValueError if the key is not the key of an OTP.
+    """
+    if not key.startswith(_BINARY_KEY_PREFIX):
+        raise ValueError("Not the key of an OTP.")
+    suffix = key[len(_BINARY_KEY_PREFIX) :]
+    if len(suffix) == _DIGEST_SIZE:
+        return suffix.hex()
+    otp_sha = suffix.decode("ascii")
+    if len(bytes.fromhex(otp_sha)) != _DIGEST_SIZE:
+        raise ValueError("Not the key of an OTP.")
+    return otp_sha
+
+
+def key_format(key: bytes) -> StorageFormat:
+    """
+    Return the format of the given database key.
+
+    :param key: the raw database key.
+    :return: the format the key has been stored with.
+    :raise: ValueError if the key is not the key of an OTP.
+    """
+    decode_key(key)
+    if len(key) == len(_BINARY_KEY_PREFIX) + _DIGEST_SIZE:
+        return StorageFormat.BINARY
+    return StorageFormat.JSON
+
+
+def encode_otp_data(otp_data: OtpData, storage_format: StorageFormat) -> Union[str, bytes]:
+    """
+    Serialize the given OtpData, in the given format.
+
+    :param otp_data: the OtpData to serialize.
+    :param storage_format: the format of the value.
+    :return: the JSON string if the format is JSON, the binary record if the format is BINARY, or
+      the UTF-8 JSON if the OtpData do not fit the binary layout.
+    """
+    if storage_format == StorageFormat.JSON:
+        return OtpDataSchema().dumps(otp_data)
+
+    days = otp_data.symptoms_started_on.toordinal() - _EPOCH_ORDINAL
+    if not 0 <= days <= _MAX_BINARY_DAYS:
+        return OtpDataSchema().dumps(otp_data).encode("utf-8")
+    id_test_verification = otp_data.id_test_verification
+    if id_test_verification is None:
+        return _BINARY_HEADER.pack(_BINARY_VERSION, _NO_ID_TEST_VERIFICATION, days)
+    try:
+        uuid = UUID(id_test_verification)
+    except ValueError:
+        uuid = None
+    if uuid is not None and str(uuid) == id_test_verification:
+        return _BINARY_HEADER.pack(_BINARY_VERSION, _UUID_ID_TEST_VERIFICATION, days) + uuid.bytes
+    raw = id_test_verification.encode("utf-8")
+    if len(raw) > _MAX_RAW_ID_TEST_VERIFICATION_BYTES:
+        return OtpDataSchema().dumps(otp_data).encode("utf-8")
+    return (
+        _BINARY_HEADER.pack(_BINARY_VERSION, _RAW_ID_TEST_VERIFICATION, days)
+        + bytes((len(raw),))
+        + raw
+    )
+
+
+def decode_otp_data(value: Union[str, bytes]) -> OtpData:
+    """
+    Deserialize the given OtpData, detecting the format it has been stored with.
+
+    :param value: the stored value, either JSON or binary.
+    :return: the deserialized OtpData.
+    :raise: ValueError if the binary record has an unknown version or layout.
+    """
+    if isinstance(value, str):
+        return OtpDataSchema().loads(value)
+    if not value.startswith(bytes((_BINARY_VERSION,))):
+        return OtpDataSchema().loads(value.decode("utf-8"))
+
+    _, kind, days = _BINARY_HEADER.unpack_from(value)
+    payload = value[_BINARY_HEADER.size :]
+    symptoms_started_on = date.fromordinal(_EPOCH_ORDINAL + days)
+    if kind == _NO_ID_TEST_VERIFICATION:
+        id_test_verification = None
+    elif kind == _UUID_ID_TEST_VERIFICATION:
+        id_test_verification = str(UUID(bytes=payload))
+    elif kind == _RAW_ID_TEST_VERIFICATION:
+        id_test_verification = payload[1 : 1 + payload[0]].decode("utf-8")
+    else:
+        raise ValueError(f"Unknown id_test_verification kind: {kind}.")
+    return OtpData(
+        symptoms_started_on=symptoms_started_on, id_test_verification=id_test_verification
+    )
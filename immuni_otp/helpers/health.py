@@ -0,0 +1,182 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Sequence
+
+from aioredis import Redis, RedisError
+
+from immuni_otp.core import config
+from immuni_otp.helpers.storage import STORAGE_UNAVAILABLE_ERRORS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """
+    The outcome of a probe of Redis.
+    """
+
+    # The monotonic time the probe completed at.
+    probed_at: float
+    latency_seconds: float
+    failed: bool
+    # The number of open, and free, connections of the pools of all the shards.
+    pool_size: int
+    pool_free: int
+
+
+class HealthState:
+    """
+    The health of Redis, as probed in the background by this worker, so that the health checks
+    are answered from memory, without a round trip to Redis each.
+
+    The worker is ready as long as, over the last probes, the ratio of failed probes and the mean
+    latency of the successful ones are below the configured thresholds, and the last probe is
+    recent, i.e., the probes are not stuck.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        window_size: int,
+        max_latency_seconds: float,
+        max_failure_rate: float,
+        max_age_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param window_size: the number of most recent probes the readiness is computed on.
+        :param max_latency_seconds: the mean latency of the successful probes above which the
+          worker is not ready.
+        :param max_failure_rate: the ratio of failed probes from which the worker is not ready.
+        :param max_age_seconds: the age of the last probe above which the worker is not ready.
+        :param clock: the monotonic clock, in seconds.
+        """
+        self._max_latency_seconds = max_latency_seconds
+        self._max_failure_rate = max_failure_rate
+        self._max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._results: Deque[ProbeResult] = deque(maxlen=window_size)
+
+    def record(self, result: ProbeResult) -> None:
+        """
+        Record the outcome of a probe.
+
+        :param result: the outcome of the probe.
+        """
+        self._results.append(result)
+
+    def clear(self) -> None:
+        """
+        Forget all the probes, e.g., when the probing stops.
+        """
+        self._results.clear()
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Return whether the worker is ready, with the details of the probes it is based on.
+
+        :return: the report of the readiness, with "ready" True if ready, and "reason" set to
+          "not_probed", "stale", "failing", or "slow" otherwise.
+        """
+        if not self._results:
+            return dict(ready=False, reason="not_probed")
+        last = self._results[-1]
+        failure_rate = sum(result.failed for result in self._results) / len(self._results)
+        latencies = [result.latency_seconds for result in self._results if not result.failed]
+        mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        age_seconds = self._clock() - last.probed_at
+        reason: Optional[str] = None
+        if age_seconds > self._max_age_seconds:
+            reason = "stale"
+        elif failure_rate >= self._max_failure_rate:
+            reason = "failing"
+        elif mean_latency > self._max_latency_seconds:
+            reason = "slow"
+        return dict(
+            ready=reason is None,
+            reason=reason,
+            probes=len(self._results),
+            failure_rate=failure_rate,
+            mean_latency_ms=mean_latency * 1000,
+            last_latency_ms=last.latency_seconds * 1000,
+            last_failed=last.failed,
+            last_probe_age_ms=age_seconds * 1000,
+            pool_size=last.pool_size,
+            pool_free=last.pool_free,
+        )
+
+
+async def probe_redis(shards: Sequence[Redis], timeout_seconds: float) -> ProbeResult:
+    """
+    Send a PING to each shard concurrently, through their pools, so that the latency includes the
+    wait for a free connection, as for any other call.
+
+    :param shards: the Redis managers of the shards.
+    :param timeout_seconds: the time after which the probe is considered failed.
+    :return: the outcome of the probe, failed if any shard failed.
+    """
+    started_at = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(redis.ping() for redis in shards)), timeout=timeout_seconds
+        )
+        failed = False
+    except (RedisError, *STORAGE_UNAVAILABLE_ERRORS):
+        failed = True
+    latency_seconds = time.perf_counter() - started_at
+    return ProbeResult(
+        probed_at=time.monotonic(),
+        latency_seconds=latency_seconds,
+        failed=failed,
+        pool_size=sum(redis.connection.size for redis in shards),
+        pool_free=sum(redis.connection.freesize for redis in shards),
+    )
+
+
+async def probe_forever(
+    state: HealthState, shards: Sequence[Redis], interval_seconds: float, timeout_seconds: float,
+) -> None:
+    """
+    Probe Redis periodically, recording the outcome of each probe, until cancelled.
+
+    :param state: the health state to record the probes in.
+    :param shards: the Redis managers of the shards.
+    :param interval_seconds: the number of seconds to wait between probes.
+    :param timeout_seconds: the time after which a probe is considered failed.
+    """
+    while True:
+        result = await probe_redis(shards, timeout_seconds)
+        if result.failed:
+            _LOGGER.warning("Redis health probe failed.")
+        state.record(result)
+        await asyncio.sleep(interval_seconds)
+
+
+# The health of Redis as probed by this worker, if enabled in the configuration.
+redis_health = HealthState(
+    window_size=config.OTP_HEALTH_WINDOW_SIZE,
+    max_latency_seconds=config.OTP_HEALTH_MAX_LATENCY_MILLISECONDS / 1000,
+    max_failure_rate=config.OTP_HEALTH_MAX_FAILURE_RATE,
+    # Tolerate a couple of missed probes before considering them stuck.
+    max_age_seconds=(
+        3 * config.OTP_HEALTH_PROBE_INTERVAL_MILLISECONDS
+        + config.OTP_HEALTH_PROBE_TIMEOUT_MILLISECONDS
+    )
+    / 1000,
+)
@@ -0,0 +1,149 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from bisect import bisect_left
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Sequence
+
+from aioredis import Redis
+
+from immuni_common.helpers.otp import key_for_otp_sha
+from immuni_otp.helpers.encoding import key_format
+from immuni_otp.models.enums import StorageFormat
+
+# Redis replies to PTTL with -2 if the key does not exist, and with -1 if it does not expire.
+_PTTL_MISSING = -2
+_PTTL_PERSISTENT = -1
+
+
+@dataclass
+class KeyspaceReport:  # pylint: disable=too-many-instance-attributes
+    """
+    The summary of the OTP keyspace, possibly across multiple shards.
+
+    OTPs and CUNs are both stored at the SHA-256 they are authorised with, and cannot be told apart
+    from their keys: the keys are counted by storage format instead.
+    """
+
+    # The upper bounds of the TTL buckets, in seconds, in ascending order.
+    ttl_buckets: Sequence[int]
+    keys: int = 0
+    json_keys: int = 0
+    binary_keys: int = 0
+    # Keys matching the OTP prefix which are not the key of an OTP.
+    invalid_keys: int = 0
+    # Keys whose value is not a string, hence not OtpData.
+    non_string: int = 0
+    # Keys which do not expire.
+    persistent: int = 0
+    total_bytes: int = 0
+    max_key_bytes: int = 0
+    # The number of keys whose TTL is within each bucket, the last one being unbounded.
+    ttl_counts: List[int] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        """
+        :raise: ValueError if the TTL buckets are not in strictly ascending order.
+        """
+        if any(lower >= upper for lower, upper in zip(self.ttl_buckets, self.ttl_buckets[1:])):
+            raise ValueError("The TTL buckets must be in strictly ascending order.")
+        if not self.ttl_counts:
+            self.ttl_counts = [0] * (len(self.ttl_buckets) + 1)
+
+    def add(self, key: bytes, pttl: int, memory_usage: int, key_type: bytes) -> None:
+        """
+        Account for a live key.
+
+        :param key: the key.
+        :param pttl: the TTL of the key, in milliseconds, as returned by PTTL.
+        :param memory_usage: the bytes used by the key and its value, as returned by MEMORY USAGE.
+        :param key_type: the type of the value of the key, as returned by TYPE.
+        """
+        self.keys += 1
+        self.total_bytes += memory_usage
+        self.max_key_bytes = max(self.max_key_bytes, memory_usage)
+        if pttl == _PTTL_PERSISTENT:
+            self.persistent += 1
+        else:
+            self.ttl_counts[bisect_left(self.ttl_buckets, pttl / 1000)] += 1
+        if key_type != b"string":
+            self.non_string += 1
+        try:
+            storage_format = key_format(key)
+        except ValueError:
+            self.invalid_keys += 1
+            return
+        if storage_format == StorageFormat.BINARY:
+            self.binary_keys += 1
+        else:
+            self.json_keys += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return the report as a JSON-serializable dictionary.
+
+        :return: the report as a dictionary, including the average bytes per key, and the TTL
+          distribution labelled by bucket upper bound.
+        """
+        report = asdict(self)
+        del report["ttl_buckets"], report["ttl_counts"]
+        report["mean_key_bytes"] = self.total_bytes / self.keys if self.keys else 0.0
+        report["ttl_distribution"] = {
+            f"le_{bound}s" if bound is not None else "inf": count
+            for bound, count in zip([*self.ttl_buckets, None], self.ttl_counts)
+        }
+        return report
+
+
+async def analyze_keyspace(
+    redis: Redis, report: KeyspaceReport, scan_count: int = 1000, pause_seconds: float = 0.0
+) -> None:
+    """
+    Account for all the OTP keys of the given Redis in the report, incrementally.
+    The keyspace is iterated with SCAN, never with KEYS, and the PTTL, MEMORY USAGE and TYPE of
+    each page of keys are sent without waiting for each reply, so that they are pipelined by the
+    connection. The values are never read. Redis is thus never blocked for longer than a single
+    page.
+
+    :param redis: the Redis manager to analyze the keys of.
+    :param report: the report to account for the keys in.
+    :param scan_count: the number of keys to scan with each SCAN call (i.e., the page size).
+    :param pause_seconds: the time to wait between pages, to further limit the load on Redis.
+    """
+    match = key_for_otp_sha("").encode("utf-8") + b"*"
+    cursor = b"0"
+    while True:
+        cursor, keys = await redis.execute(
+            b"SCAN", cursor, b"MATCH", match, b"COUNT", scan_count, encoding=None
+        )
+        replies = await asyncio.gather(
+            *(
+                command
+                for key in keys
+                for command in (
+                    redis.execute(b"PTTL", key),
+                    redis.execute(b"MEMORY", b"USAGE", key),
+                    redis.execute(b"TYPE", key, encoding=None),
+                )
+            )
+        )
+        for key, index in zip(keys, range(0, len(replies), 3)):
+            pttl, memory_usage, key_type = replies[index : index + 3]
+            # Skip the keys expired (or consumed) after being scanned.
+            if pttl != _PTTL_MISSING and key_type != b"none":
+                report.add(key, pttl, memory_usage or 0, key_type)
+        if cursor == b"0":
+            return
+        if pause_seconds:
+            await asyncio.sleep(pause_seconds)
@@ -0,0 +1,74 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from hashlib import sha1
+from typing import Any, Awaitable, Dict, Sequence, Union
+
+from aioredis import Redis, ReplyError
+from aioredis.commands import Pipeline
+
+
+class LuaScript:
+    """
+    Lua script to be executed atomically by Redis.
+    """
+
+    def __init__(self, source: str, decode: bool = True) -> None:
+        """
+        :param source: the Lua source of the script.
+        :param decode: whether to decode the value returned by the script with the encoding of the
+          connection, or to return it as raw bytes (e.g., binary values). Raw bytes are only
+          supported when the script is executed directly.
+        """
+        self.source = source
+        self._execute_options: Dict[str, Any] = {} if decode else dict(encoding=None)
+        # SHA-1 is mandated by Redis to identify scripts, it has no security implications here.
+        self.sha = sha1(source.encode("utf-8")).hexdigest()  # nosec
+
+    def __call__(
+        self, redis: Union[Redis, Pipeline], keys: Sequence[Any], args: Sequence[Any]
+    ) -> Awaitable[Any]:
+        """
+        Execute the script, either directly or as part of a pipeline.
+        When executed directly, the script is referenced by its SHA-1, and only sent in full if
+        not yet cached by Redis. Within a pipeline, the script is always sent in full, since the
+        cache cannot be checked without an additional round trip.
+
+        :param redis: the Redis manager, or the pipeline, to execute the script with.
+        :param keys: the keys the script accesses.
+        :param args: the additional arguments of the script.
+        :return: the awaitable resolved with the value returned by the script.
+        """
+        if isinstance(redis, Pipeline):
+            return redis.eval(self.source, keys=list(keys), args=list(args))
+        return self._execute(redis, keys, args)
+
+    async def _execute(self, redis: Redis, keys: Sequence[Any], args: Sequence[Any]) -> Any:
+        """
+        Execute the script by its SHA-1, falling back on its full source if not cached by Redis.
+
+        :param redis: the Redis manager to execute the script with.
+        :param keys: the keys the script accesses.
+        :param args: the additional arguments of the script.
+        :return: the value returned by the script.
+        """
+        try:
+            return await redis.execute(
+                b"EVALSHA", self.sha, len(keys), *keys, *args, **self._execute_options
+            )
+        except ReplyError as error:
+            if not str(error).startswith("NOSCRIPT"):
+                raise
+        return await redis.execute(
+            b"EVAL", self.source, len(keys), *keys, *args, **self._execute_options
+        )
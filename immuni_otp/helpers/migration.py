@@ -0,0 +1,275 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import time
+from dataclasses import dataclass
+from struct import Struct
+from typing import BinaryIO, Dict, Iterable, Iterator, List
+
+from aioredis import Redis
+
+from immuni_common.helpers.otp import key_for_otp_sha
+from immuni_otp.helpers.encoding import decode_key, encode_key
+from immuni_otp.helpers.lua import LuaScript
+from immuni_otp.helpers.storage import RedisStorage
+from immuni_otp.models.enums import StorageFormat
+
+# The header of the stream: a magic number, and the version of the format.
+_STREAM_HEADER = Struct(">4sB")
+_MAGIC = b"OTPM"
+_VERSION = 1
+# The header of each record: the Unix time in milliseconds the key expires at (0 if it does not
+# expire), the length of the key, and the length of its DUMP payload, followed in turn by the key
+# and the payload.
+_RECORD_HEADER = Struct(">qBI")
+
+# Redis replies to PTTL with -2 if the key does not exist, and with -1 if it does not expire.
+_PTTL_MISSING = -2
+_PTTL_PERSISTENT = -1
+
+# The prefix of the tombstones left on the target by the OTPs consumed during a migration.
+_TOMBSTONE_PREFIX = b"~otp-consumed:"
+
+# Restore the key unless the OTP is already stored, with any of the formats, so that the keys
+# written after the export (e.g., by the dual write) are never overwritten, or unless the OTP has
+# been consumed after the export, so that it cannot be used once more after the cutover.
+# KEYS[1] is the tombstone of the OTP, followed by its keys in each format, starting from the one
+# to restore, ARGV[1] is the TTL to restore it with, in milliseconds, and ARGV[2] its DUMP payload.
+# The script returns 1 if the key has been restored, 0 if the OTP was already stored, and -1 if
+# the OTP has been consumed.
+_RESTORE = LuaScript(
+    """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return -1
+    end
+    for index = 2, #KEYS do
+        if redis.call("EXISTS", KEYS[index]) == 1 then
+            return 0
+        end
+    end
+    redis.call("RESTORE", KEYS[2], ARGV[1], ARGV[2])
+    return 1
+    """
+)
+
+# Delete the OTP in every format, and leave its tombstone, so that it is never restored afterwards.
+# KEYS[1] is the tombstone of the OTP, followed by its keys in each format, and ARGV[1] is the TTL
+# of the tombstone, in milliseconds.
+_CONSUME = LuaScript(
+    """
+    redis.call("SET", KEYS[1], 1, "PX", ARGV[1])
+    return redis.call("DEL", unpack(KEYS, 2))
+    """
+)
+
+
+@dataclass(frozen=True)
+class MigrationRecord:
+    """
+    A key exported from Redis, with its value serialized by DUMP.
+    """
+
+    key: bytes
+    payload: bytes
+    # The Unix time in milliseconds the key expires at, 0 if it does not expire.
+    expires_at: int
+
+
+def _now_milliseconds() -> int:
+    """
+    Return the current Unix time, in milliseconds.
+
+    :return: the current Unix time, in milliseconds.
+    """
+    return int(time.time() * 1000)
+
+
+def write_header(stream: BinaryIO) -> None:
+    """
+    Write the header of an export stream.
+
+    :param stream: the binary stream to write to.
+    """
+    stream.write(_STREAM_HEADER.pack(_MAGIC, _VERSION))
+
+
+def write_record(stream: BinaryIO, record: MigrationRecord) -> None:
+    """
+    Append the given record to an export stream.
+
+    :param stream: the binary stream to write to.
+    :param record: the record to write.
+    """
+    stream.write(_RECORD_HEADER.pack(record.expires_at, len(record.key), len(record.payload)))
+    stream.write(record.key)
+    stream.write(record.payload)
+
+
+def read_records(stream: BinaryIO) -> Iterator[MigrationRecord]:
+    """
+    Read the records of an export stream, in the order they have been written.
+
+    :param stream: the binary stream to read from.
+    :return: the iterator of the records.
+    :raise: ValueError if the stream is not an export stream, or it is truncated.
+    """
+    header = stream.read(_STREAM_HEADER.size)
+    if len(header) != _STREAM_HEADER.size or _STREAM_HEADER.unpack(header) != (_MAGIC, _VERSION):
+        raise ValueError("Not an OTP export stream.")
+    while True:
+        record_header = stream.read(_RECORD_HEADER.size)
+        if not record_header:
+            return
+        if len(record_header) != _RECORD_HEADER.size:
+            raise ValueError("Truncated OTP export stream.")
+        expires_at, key_length, payload_length = _RECORD_HEADER.unpack(record_header)
+        key = stream.read(key_length)
+        payload = stream.read(payload_length)
+        if len(key) != key_length or len(payload) != payload_length:
+            raise ValueError("Truncated OTP export stream.")
+        yield MigrationRecord(key=key, payload=payload, expires_at=expires_at)
+
+
+def _keys_for_otp_sha(otp_sha: str) -> List[bytes]:
+    """
+    Return the raw database keys of the given OTP, in each format.
+
+    :param otp_sha: the hex SHA-256 of the OTP.
+    :return: the raw database keys of the OTP.
+    """
+    keys = [encode_key(otp_sha, storage_format) for storage_format in StorageFormat]
+    return [key if isinstance(key, bytes) else key.encode("utf-8") for key in keys]
+
+
+def _tombstone_key(otp_sha: str) -> bytes:
+    """
+    Return the key of the tombstone of the given OTP, on the migration target.
+
+    :param otp_sha: the hex SHA-256 of the OTP.
+    :return: the raw key of the tombstone.
+    """
+    return _TOMBSTONE_PREFIX + otp_sha.encode("ascii")
+
+
+async def consume_on_target(storage: RedisStorage, otp_sha: str, tombstone_seconds: int) -> None:
+    """
+    Delete the given OTP from the storage it is being migrated to, leaving a tombstone, so that
+    importing an export taken before the OTP has been consumed does not make it usable again.
+
+    :param storage: the Redis storage the OTPs are being migrated to.
+    :param otp_sha: the hex SHA-256 of the consumed OTP.
+    :param tombstone_seconds: the time to keep the tombstone for, at least the expiration of the
+      OTPs, so that it outlives any exported copy of the OTP.
+    """
+    await _CONSUME(
+        storage.redis_for(otp_sha),
+        keys=[_tombstone_key(otp_sha), *_keys_for_otp_sha(otp_sha)],
+        args=[tombstone_seconds * 1000],
+    )
+
+
+async def export_keys(
+    redis: Redis, stream: BinaryIO, scan_count: int = 1000, pause_seconds: float = 0.0
+) -> int:
+    """
+    Export all the OTP keys of the given Redis to a stream, with their value and the time they
+    expire at, incrementally.
+    The keyspace is iterated with SCAN, and the DUMP and PTTL of each page of keys are sent
+    without waiting for each reply, so that they are pipelined by the connection.
+
+    :param redis: the Redis manager to export the keys of.
+    :param stream: the binary stream to write the records to, after its header.
+    :param scan_count: the number of keys to scan with each SCAN call (i.e., the page size).
+    :param pause_seconds: the time to wait between pages, to further limit the load on Redis.
+    :return: the number of exported keys.
+    """
+    match = key_for_otp_sha("").encode("utf-8") + b"*"
+    exported = 0
+    cursor = b"0"
+    while True:
+        cursor, keys = await redis.execute(
+            b"SCAN", cursor, b"MATCH", match, b"COUNT", scan_count, encoding=None
+        )
+        replies = await asyncio.gather(
+            *(
+                command
+                for key in keys
+                for command in (
+                    redis.execute(b"PTTL", key),
+                    redis.execute(b"DUMP", key, encoding=None),
+                )
+            )
+        )
+        now = _now_milliseconds()
+        for key, pttl, payload in zip(keys, replies[::2], replies[1::2]):
+            # Skip the keys expired (or consumed) after being scanned.
+            if pttl == _PTTL_MISSING or payload is None:
+                continue
+            expires_at = 0 if pttl == _PTTL_PERSISTENT else now + pttl
+            write_record(stream, MigrationRecord(key=key, payload=payload, expires_at=expires_at))
+            exported += 1
+        if cursor == b"0":
+            return exported
+        if pause_seconds:
+            await asyncio.sleep(pause_seconds)
+
+
+async def import_records(
+    storage: RedisStorage, records: Iterable[MigrationRecord], batch_size: int = 1000
+) -> Dict[str, int]:
+    """
+    Restore the given records into the given storage, with their remaining TTL, skipping the
+    expired ones, the OTPs already stored, so that fresher writes are never overwritten, and the
+    OTPs consumed since the export, as recorded by consume_on_target().
+    The export must hence be taken once the dual write is enabled on every process storing or
+    consuming OTPs, so that the OTPs consumed after the export leave their tombstone.
+    The records of each batch are restored on all the shards concurrently, without waiting for
+    each reply, so that they are pipelined by the connections.
+
+    :param storage: the Redis storage to restore the records into.
+    :param records: the records to restore.
+    :param batch_size: the number of records to restore concurrently.
+    :return: the number of records restored, existing, consumed and expired.
+    :raise: ValueError if any of the keys is not the key of an OTP.
+    """
+    counts = dict(restored=0, existing=0, consumed=0, expired=0)
+
+    async def _restore(batch: List[MigrationRecord]) -> None:
+        now = _now_milliseconds()
+        commands = []
+        for record in batch:
+            ttl = record.expires_at - now if record.expires_at else 0
+            if record.expires_at and ttl <= 0:
+                counts["expired"] += 1
+                continue
+            otp_sha = decode_key(record.key)
+            keys = [
+                _tombstone_key(otp_sha),
+                record.key,
+                *(key for key in _keys_for_otp_sha(otp_sha) if key != record.key),
+            ]
+            commands.append(
+                _RESTORE(storage.redis_for(otp_sha), keys=keys, args=[ttl, record.payload])
+            )
+        for restored in await asyncio.gather(*commands):
+            counts[{1: "restored", 0: "existing", -1: "consumed"}[restored]] += 1
+
+    batch: List[MigrationRecord] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            await _restore(batch)
+            batch = []
+    if batch:
+        await _restore(batch)
+    return counts
@@ -0,0 +1,62 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Optional
+
+from prometheus_client.metrics import Histogram
+
+_Handler = Callable[..., Awaitable[Any]]
+
+_VALIDATION_STARTED_AT: ContextVar[float] = ContextVar("validation_started_at")
+
+
+def timed_validation(
+    histogram: Histogram, validator: Callable[[_Handler], _Handler]
+) -> Callable[[_Handler], _Handler]:
+    """
+    Decorator monitoring the time spent by the given validator before calling the handler.
+    Requests rejected by the validator are not monitored.
+
+    :param histogram: the histogram to observe the validation time with.
+    :param validator: the validation decorator to monitor (e.g., validate(...)).
+    :return: the decorator validating and monitoring the handler.
+    """
+
+    def _decorator(handler: _Handler) -> _Handler:
+        @wraps(handler)
+        async def _validated(*args: Any, **kwargs: Any) -> Any:
+            histogram.observe(perf_counter() - _VALIDATION_STARTED_AT.get())
+            return await handler(*args, **kwargs)
+
+        validated = validator(_validated)
+
+        @wraps(handler)
+        async def _wrapper(*args: Any, **kwargs: Any) -> Any:
+            _VALIDATION_STARTED_AT.set(perf_counter())
+            return await validated(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
+
+
+def validation_started_at() -> Optional[float]:
+    """
+    Return the time the validation of the current request started at, if monitored.
+
+    :return: the perf_counter() value the validation started at, None if not monitored.
+    """
+    return _VALIDATION_STARTED_AT.get(None)
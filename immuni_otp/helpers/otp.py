@@ -11,46 +11,570 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import date
 from hashlib import sha256
+from math import ceil
+from struct import Struct
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union, cast
 
-from aioredis.commands import StringCommandsMixin
+from aioredis import RedisError
 
 from immuni_common.core.exceptions import OtpCollisionException
 from immuni_common.helpers.otp import key_for_otp_sha
 from immuni_common.models.dataclasses import OtpData
-from immuni_common.models.marshmallow.schemas import OtpDataSchema
 from immuni_common.models.marshmallow.validators import OTP_LENGTH
 from immuni_otp.core import config
+from immuni_otp.core.exceptions import TooManyRequestsException
 from immuni_otp.core.managers import managers
+from immuni_otp.helpers.admission import Admission, CircuitBreaker, InFlightLimiter
+from immuni_otp.helpers.audit import AuditRecord
+from immuni_otp.helpers.coalescing import WriteCoalescer
+from immuni_otp.helpers.deadline import within_deadline
+from immuni_otp.helpers.encoding import decode_otp_data, encode_key, encode_otp_data
+from immuni_otp.helpers.migration import consume_on_target
+from immuni_otp.helpers.recent import RecentKeys
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.helpers.storage import STORAGE_UNAVAILABLE_ERRORS
+from immuni_otp.models.enums import AuthorizationOutcome, StorageFormat
+from immuni_otp.monitoring.api import (
+    OTP_AUTHORIZATIONS,
+    OTP_BUFFER_REPLAYS,
+    OTP_BUFFERED_AUTHORIZATIONS,
+    OTP_BUFFERED_BYTES,
+    OTP_KEY_DERIVATION_SECONDS,
+    OTP_MIGRATION_MIRRORED,
+)
 
+_LOGGER = logging.getLogger(__name__)
 
-def _key_for_otp(otp: str) -> str:
+# The header of the buffered authorizations: the Unix time they expire at, and the length of the
+# hex SHA-256 of the OTP following it, followed in turn by the binary OtpData.
+_BUFFERED_HEADER = Struct(">dB")
+
+
+def _rate_limit_retry_after_seconds() -> int:
+    """
+    Return the number of seconds after which a rate limited client has a token again, at least.
+
+    :return: the number of seconds, computed on demand, since the rate is only required to be
+      positive if rate limiting is enabled.
+    """
+    return max(ceil(1 / config.OTP_RATE_LIMIT_PER_SECOND), 1)
+
+
+def _otp_sha(otp: str) -> str:
+    """
+    Return the hex SHA-256 of the given OTP. CUNs are already hashed by the Mobile Client.
+
+    :param otp: the OTP or the CUN.
+    :return: the hex SHA-256 of the OTP.
+    """
+    if len(otp) == OTP_LENGTH:
+        return sha256(otp.encode("utf-8")).hexdigest()
+    return otp
+
+
+def _key_for_otp(otp: str, storage_format: StorageFormat = StorageFormat.JSON) -> Union[str, bytes]:
     """
     Return database key associated with the given OTP.
 
     :param otp: the OTP whose key is to be computed.
+    :param storage_format: the format of the key.
     :return: the database key associated with the given OTP.
     """
-    if len(otp) == OTP_LENGTH:
-        otp_sha = sha256(otp.encode("utf-8")).hexdigest()
+    return encode_key(_otp_sha(otp), storage_format)
+
+
+def otp_type(otp: str) -> str:
+    """
+    Return the type of the given OTP, for monitoring purposes.
+
+    :param otp: the OTP or the CUN.
+    :return: "otp" for OTPs, "cun" for CUNs.
+    """
+    return "otp" if len(otp) == OTP_LENGTH else "cun"
+
+
+def audit(
+    otp: str, client: Optional[str], outcome: str, started_at: Optional[float], validated_at: float
+) -> None:
+    """
+    Queue the audit record of the given authorization, if enabled in the configuration.
+
+    :param otp: the authorized OTP or CUN.
+    :param client: the identity of the client, None if unknown.
+    :param outcome: the outcome of the authorization.
+    :param started_at: the perf_counter() value the validation started at, None if unknown.
+    :param validated_at: the perf_counter() value the validation completed, and the storing
+      started, at.
+    """
+    audit_log = managers.otp_audit_log
+    if audit_log is None:
+        return
+    stored_at = time.perf_counter()
+    audit_log.push(
+        AuditRecord(
+            timestamp=time.time(),
+            otp_sha=_otp_sha(otp),
+            client=client,
+            outcome=outcome,
+            validation_ms=0.0 if started_at is None else (validated_at - started_at) * 1000,
+            store_ms=(stored_at - validated_at) * 1000,
+        )
+    )
+
+
+def audit_invalid(otp: Any, client: Optional[str], started_at: Optional[float]) -> None:
+    """
+    Queue the audit record of an authorization failing the validation, if enabled in the
+    configuration. Since the submitted OTP may be anything, it is hashed unless it has the length
+    of an OTP or of a CUN, so that the records keep a bounded size.
+
+    :param otp: the submitted OTP or CUN, of any type, None if missing.
+    :param client: the identity of the client, None if unknown.
+    :param started_at: the perf_counter() value the validation started at, None if unknown.
+    """
+    audit_log = managers.otp_audit_log
+    if audit_log is None:
+        return
+    if not isinstance(otp, str):
+        otp_sha = ""
+    elif len(otp) in (OTP_LENGTH, sha256().digest_size * 2):
+        otp_sha = _otp_sha(otp)
     else:
-        otp_sha = otp
-    return key_for_otp_sha(otp_sha)
+        otp_sha = sha256(otp.encode("utf-8", "surrogatepass")).hexdigest()
+    audit_log.push(
+        AuditRecord(
+            timestamp=time.time(),
+            otp_sha=otp_sha,
+            client=client,
+            outcome=AuthorizationOutcome.INVALID.value,
+            validation_ms=0.0 if started_at is None else (time.perf_counter() - started_at) * 1000,
+            store_ms=0.0,
+        )
+    )
+
+
+@asynccontextmanager
+async def _admitted() -> AsyncIterator[None]:
+    """
+    Admit the database call made within the context, if the admission control is enabled in the
+    configuration.
+
+    :raises: ServiceUnavailableException if the call is rejected by the admission control.
+    """
+    if not config.OTP_ADMISSION_CONTROL_ENABLED:
+        yield
+        return
+    async with _redis_admission.guard():
+        yield
+
+
+def _recent_key(key: str, otp_data: OtpData) -> Tuple[str, date, Optional[str]]:
+    """
+    Return the key identifying the given OTP and OtpData among the recent OTPs.
+
+    :param key: the database key of the OTP.
+    :param otp_data: the OtpData of the OTP.
+    :return: the key identifying both the OTP and its OtpData.
+    """
+    return key, otp_data.symptoms_started_on, otp_data.id_test_verification
+
+
+def _recent_outcome(key: str, otp_data: OtpData) -> Optional[AuthorizationOutcome]:
+    """
+    Return the outcome of storing the given OTP if certainly known from the recent OTPs stored by
+    this worker, if enabled in the configuration.
+
+    :param key: the database key of the OTP to store.
+    :param otp_data: the OtpData to store.
+    :return: DUPLICATE or COLLISION if the OTP has recently been stored, with the same or a
+      different OtpData, respectively, None if unknown.
+    """
+    if not config.OTP_RECENT_FILTER_ENABLED or key not in _recent_otps:
+        return None
+    if _recent_key(key, otp_data) in _recent_otps:
+        return AuthorizationOutcome.DUPLICATE
+    return AuthorizationOutcome.COLLISION
+
+
+def _remember(key: str, otp_data: OtpData, started_at: float) -> None:
+    """
+    Add the given OTP to the recent OTPs stored by this worker, if enabled in the configuration.
+
+    :param key: the database key of the stored OTP.
+    :param otp_data: the stored OtpData.
+    :param started_at: the time the OTP has been sent to the database at.
+    """
+    if config.OTP_RECENT_FILTER_ENABLED:
+        _recent_otps.add(key, added_at=started_at)
+        _recent_otps.add(_recent_key(key, otp_data), added_at=started_at)
+
+
+def _forget(key: str, otp_data: Optional[OtpData]) -> None:
+    """
+    Remove the given OTP from the recent OTPs stored by this worker, e.g., once consumed, so that
+    authorising it again reaches the database.
+
+    :param key: the database key of the OTP.
+    :param otp_data: the OtpData the OTP was stored with, None if unknown.
+    """
+    _recent_otps.discard(key)
+    if otp_data is not None:
+        _recent_otps.discard(_recent_key(key, otp_data))
+
+
+def _encode_buffered(otp_sha: str, otp_data: OtpData, expires_at: float) -> bytes:
+    """
+    Serialize the given authorization, to be buffered.
+
+    :param otp_sha: the hex SHA-256 of the OTP.
+    :param otp_data: the OtpData of the OTP.
+    :param expires_at: the Unix time the authorization expires at.
+    :return: the serialized authorization.
+    """
+    otp_sha_bytes = otp_sha.encode("ascii")
+    return (
+        _BUFFERED_HEADER.pack(expires_at, len(otp_sha_bytes))
+        + otp_sha_bytes
+        + cast(bytes, encode_otp_data(otp_data, StorageFormat.BINARY))
+    )
+
+
+def _decode_buffered(record: bytes) -> Tuple[str, OtpData, float]:
+    """
+    Deserialize the given buffered authorization.
+
+    :param record: the serialized authorization.
+    :return: the hex SHA-256 of the OTP, its OtpData, and the Unix time it expires at.
+    """
+    expires_at, otp_sha_length = _BUFFERED_HEADER.unpack_from(record)
+    otp_sha_end = _BUFFERED_HEADER.size + otp_sha_length
+    otp_sha = record[_BUFFERED_HEADER.size : otp_sha_end].decode("ascii")
+    return otp_sha, decode_otp_data(record[otp_sha_end:]), expires_at
+
+
+def _observe_buffer(buffer: RingBuffer) -> None:
+    """
+    Monitor the backlog of the given buffer.
+
+    :param buffer: the buffer of the authorizations to replay.
+    """
+    OTP_BUFFERED_AUTHORIZATIONS.set(len(buffer))
+    OTP_BUFFERED_BYTES.set(buffer.size_bytes)
+
+
+def _buffer(otp_sha: str, otp_data: OtpData) -> bool:
+    """
+    Append the given authorization to the local buffer, if enabled in the configuration, to be
+    replayed into the database once reachable again.
+
+    :param otp_sha: the hex SHA-256 of the OTP.
+    :param otp_data: the OtpData of the OTP.
+    :return: True if buffered, False if the buffer is not enabled, or full.
+    """
+    buffer = managers.otp_buffer
+    if buffer is None:
+        return False
+    buffered = buffer.append(
+        _encode_buffered(otp_sha, otp_data, expires_at=time.time() + config.OTP_EXPIRATION_SECONDS)
+    )
+    _observe_buffer(buffer)
+    return buffered
+
+
+async def _mirror(
+    otps: Sequence[Tuple[str, OtpData]], expiration_seconds: Optional[int] = None
+) -> None:
+    """
+    Store the given OTPs on the storage they are being migrated to, if configured, on a
+    best-effort basis: failures are logged, and never affect the outcome of the authorization.
+
+    :param otps: the sequence of hex SHA-256 of the OTPs to store, each one with its OtpData.
+    :param expiration_seconds: the expiration of the OTPs, defaulting to the configured one.
+    """
+    storage = managers.otp_migration_storage
+    if storage is None or not otps:
+        return
+    try:
+        if expiration_seconds is None:
+            results = await storage.store_many(otps)
+        else:
+            results = await asyncio.gather(
+                *(
+                    storage.store(otp_sha, otp_data, expiration_seconds)
+                    for otp_sha, otp_data in otps
+                )
+            )
+        outcomes = [outcome.value for outcome in results]
+    except (RedisError, *STORAGE_UNAVAILABLE_ERRORS):
+        _LOGGER.warning("Cannot store the OTPs on the migration target.", exc_info=True)
+        outcomes = ["failed"] * len(otps)
+    for outcome in outcomes:
+        OTP_MIGRATION_MIRRORED.labels(outcome).inc()
+
+
+async def replay_buffered() -> None:
+    """
+    Replay the authorizations buffered by this worker into the database, oldest first, with their
+    remaining expiration, discarding the expired ones, and the ones colliding with an OTP stored
+    meanwhile with a different OtpData (already acknowledged to the HIS).
+
+    :raises: any of STORAGE_UNAVAILABLE_ERRORS if the database is still unreachable, leaving the
+      authorizations not yet replayed in the buffer.
+    """
+    buffer = managers.otp_buffer
+    if buffer is None:
+        return
+    record = buffer.peek()
+    while record is not None:
+        otp_sha, otp_data, expires_at = _decode_buffered(record)
+        expiration_seconds = int(expires_at - time.time())
+        if expiration_seconds > 0:
+            outcome = (
+                await managers.otp_storage.store(otp_sha, otp_data, expiration_seconds)
+            ).value
+            if outcome == AuthorizationOutcome.STORED.value:
+                await _mirror([(otp_sha, otp_data)], expiration_seconds)
+            elif outcome == AuthorizationOutcome.COLLISION.value:
+                _LOGGER.warning(
+                    "Discarding a buffered authorization colliding with a stored one.",
+                    extra=dict(otp_sha=otp_sha),
+                )
+        else:
+            outcome = "expired"
+        buffer.pop()
+        _observe_buffer(buffer)
+        OTP_BUFFER_REPLAYS.labels(outcome).inc()
+        record = buffer.peek()
+
+
+async def replay_buffered_forever(interval_seconds: float) -> None:
+    """
+    Replay the buffered authorizations periodically, until cancelled.
+
+    :param interval_seconds: the number of seconds to wait between replays.
+    """
+    while True:
+        try:
+            await replay_buffered()
+        except STORAGE_UNAVAILABLE_ERRORS:
+            _LOGGER.info("Cannot replay the buffered authorizations, the database is unreachable.")
+        await asyncio.sleep(interval_seconds)
 
 
-async def store(otp: str, otp_data: OtpData) -> None:
+async def store(
+    otp: str, otp_data: OtpData, client: Optional[str] = None, deadline: Optional[float] = None
+) -> AuthorizationOutcome:
     """
     Store the OtpData associated with the OTP, managing the key and value dump to the database.
+    Storing again the same OtpData for the same OTP (e.g., a retry by the HIS) succeeds without
+    effects.
+    If the database is unreachable, the OtpData is buffered locally, if enabled in the
+    configuration, and stored once the database is reachable again. The buffered authorization is
+    acknowledged right away: if, when replayed, the OTP turns out to be stored meanwhile with a
+    different OtpData, the authorization is discarded, and only counted on the "collision" outcome
+    of OTP_BUFFER_REPLAYS, as the HIS can no longer be answered with a collision.
+    While a migration is in progress, the OtpData is also stored on the target database.
+    If the recent OTP filter is enabled, repeated authorisations of an OTP stored by this worker are
+    answered without reaching the database: they are neither rate limited nor bounded by the
+    deadline, as they cost no database call.
 
     :param otp: the OTP associated with the database entry.
     :param otp_data: the OtpData to store.
-    :raises: OtpCollision if the OTP is already in the database.
+    :param client: the identity of the client to rate limit, None if not rate limited.
+    :param deadline: the monotonic time to cancel the database call at, None if not bounded.
+    :return: STORED if stored, DUPLICATE if already in the database with the same OtpData, BUFFERED
+      if buffered locally.
+    :raises: OtpCollision if the OTP is already in the database, with a different OtpData.
+    :raises: ServiceUnavailableException if the database call is rejected by the admission control.
+    :raises: TooManyRequestsException if the client exceeded its rate limit.
+    :raises: DeadlineExceededException if the database call is cancelled at the deadline.
+    :raises: any of STORAGE_UNAVAILABLE_ERRORS if the database is unreachable, and the OtpData
+      cannot be buffered.
     """
-    did_set = await managers.otp_redis.set(
-        key=_key_for_otp(otp),
-        value=OtpDataSchema().dumps(otp_data),
-        expire=config.OTP_EXPIRATION_SECONDS,
-        exist=StringCommandsMixin.SET_IF_NOT_EXIST,
-    )
-    if not did_set:
+    with OTP_KEY_DERIVATION_SECONDS.time():
+        otp_sha = _otp_sha(otp)
+        key = key_for_otp_sha(otp_sha)
+    outcome = _recent_outcome(key, otp_data)
+    if outcome is None:
+        try:
+            if config.OTP_STORE_COALESCING_ENABLED:
+                outcome = await within_deadline(
+                    _store_coalescer.submit((otp, otp_data, client)), deadline
+                )
+            else:
+                started_at = time.monotonic()
+                async with _admitted():
+                    outcome = await within_deadline(
+                        managers.otp_storage.store(otp_sha, otp_data, client=client), deadline
+                    )
+                if outcome == AuthorizationOutcome.STORED:
+                    _remember(key, otp_data, started_at)
+                    await _mirror([(otp_sha, otp_data)])
+        except STORAGE_UNAVAILABLE_ERRORS:
+            if not _buffer(otp_sha, otp_data):
+                raise
+            outcome = AuthorizationOutcome.BUFFERED
+    OTP_AUTHORIZATIONS.labels(otp_type(otp), outcome.value).inc()
+    if outcome == AuthorizationOutcome.COLLISION:
         raise OtpCollisionException()
+    if outcome == AuthorizationOutcome.RATE_LIMITED:
+        raise TooManyRequestsException(retry_after=_rate_limit_retry_after_seconds())
+    return outcome
+
+
+async def store_many(
+    otps: Sequence[Tuple[str, OtpData]],
+    client: Optional[str] = None,
+    deadline: Optional[float] = None,
+) -> List[AuthorizationOutcome]:
+    """
+    Store the OtpData associated with each OTP, with as few round trips to the database as the
+    storage allows (e.g., a single pipeline per Redis shard).
+    If the database is unreachable, the OtpData are buffered locally as by store().
+
+    :param otps: the sequence of OTPs to store, each one with its associated OtpData.
+    :param client: the identity of the client to rate limit, None if not rate limited.
+    :param deadline: the monotonic time to cancel the database calls at, None if not bounded.
+    :return: for each OTP, in the given order, STORED if stored, DUPLICATE if already in the
+      database with the same OtpData, COLLISION if already in the database with a different one,
+      RATE_LIMITED if the client exceeded its rate limit, BUFFERED if buffered locally.
+    :raises: ServiceUnavailableException if the database call is rejected by the admission control.
+    :raises: DeadlineExceededException if the database calls are cancelled at the deadline.
+    :raises: any of STORAGE_UNAVAILABLE_ERRORS if the database is unreachable, and the OtpData
+      cannot all be buffered. The ones buffered before are replayed anyway, the retry of the batch
+      being idempotent.
+    """
+    if not otps:
+        return []
+    with OTP_KEY_DERIVATION_SECONDS.time():
+        otp_shas = [_otp_sha(otp) for otp, _ in otps]
+        keys = [key_for_otp_sha(otp_sha) for otp_sha in otp_shas]
+    outcome_by_position: Dict[int, AuthorizationOutcome] = {}
+    pending: List[int] = []
+    for position, (key, (_, otp_data)) in enumerate(zip(keys, otps)):
+        outcome = _recent_outcome(key, otp_data)
+        if outcome is None:
+            pending.append(position)
+        else:
+            outcome_by_position[position] = outcome
+
+    if pending:
+        started_at = time.monotonic()
+        try:
+            async with _admitted():
+                outcomes = await within_deadline(
+                    managers.otp_storage.store_many(
+                        [(otp_shas[position], otps[position][1]) for position in pending],
+                        client=client,
+                    ),
+                    deadline,
+                )
+        except STORAGE_UNAVAILABLE_ERRORS:
+            if not all(_buffer(otp_shas[position], otps[position][1]) for position in pending):
+                raise
+            outcomes = [AuthorizationOutcome.BUFFERED] * len(pending)
+        stored: List[Tuple[str, OtpData]] = []
+        for position, outcome in zip(pending, outcomes):
+            outcome_by_position[position] = outcome
+            if outcome == AuthorizationOutcome.STORED:
+                _remember(keys[position], otps[position][1], started_at)
+                stored.append((otp_shas[position], otps[position][1]))
+        await _mirror(stored)
+    return [outcome_by_position[position] for position in range(len(otps))]
+
+
+async def _store_coalesced(
+    otps: Sequence[Tuple[str, OtpData, Optional[str]]]
+) -> List[AuthorizationOutcome]:
+    """
+    Store the OtpData coalesced from concurrent store() calls, with a single store_many() call per
+    client, all the clients being stored concurrently.
+
+    :param otps: the sequence of OTPs to store, each one with its OtpData and its client.
+    :return: the outcome of each OTP, in the given order.
+    """
+    positions_by_client: Dict[Optional[str], List[int]] = defaultdict(list)
+    for position, (_, _, client) in enumerate(otps):
+        positions_by_client[client].append(position)
+    results = await asyncio.gather(
+        *(
+            store_many([otps[position][:2] for position in positions], client=client)
+            for client, positions in positions_by_client.items()
+        )
+    )
+    outcome_by_position: Dict[int, AuthorizationOutcome] = {}
+    for positions, outcomes in zip(positions_by_client.values(), results):
+        outcome_by_position.update(zip(positions, outcomes))
+    return [outcome_by_position[position] for position in range(len(otps))]
+
+
+async def close_store_coalescer() -> None:
+    """
+    Flush the authorizations waiting to be coalesced, and wait for the flushes in progress.
+    """
+    await _store_coalescer.close()
+
+
+async def consume(otp: str) -> Optional[OtpData]:
+    """
+    Retrieve and delete the OtpData associated with the OTP, atomically, so that each authorised
+    OTP can be used once only.
+
+    :param otp: the OTP or the CUN to consume.
+    :return: the OtpData associated with the OTP, None if the OTP is not authorised (or expired).
+    :raises: ServiceUnavailableException if the database call is rejected by the admission control.
+    """
+    with OTP_KEY_DERIVATION_SECONDS.time():
+        otp_sha = _otp_sha(otp)
+    async with _admitted():
+        otp_data = await managers.otp_storage.consume(otp_sha)
+    _forget(key_for_otp_sha(otp_sha), otp_data)
+    migration_storage = managers.otp_migration_storage
+    if migration_storage is not None:
+        # Consume the OTP on the migration target as well, so that it cannot be used once more
+        # after the cutover, even if restored from an export taken before.
+        try:
+            await consume_on_target(migration_storage, otp_sha, config.OTP_EXPIRATION_SECONDS)
+        except (RedisError, *STORAGE_UNAVAILABLE_ERRORS):
+            _LOGGER.warning("Cannot consume the OTP on the migration target.", exc_info=True)
+    return otp_data
+
+
+# The OTPs recently stored by this worker, to reject repeated authorisations without reaching the
+# database, if enabled in the configuration.
+_recent_otps = RecentKeys(
+    ttl_seconds=config.OTP_EXPIRATION_SECONDS,
+    bucket_seconds=config.OTP_RECENT_FILTER_BUCKET_SECONDS,
+    max_size=config.OTP_RECENT_FILTER_MAX_SIZE,
+)
+
+# Coalesce the writes issued by concurrent store() calls on the same worker into a single
+# pipeline, if enabled in the configuration.
+_store_coalescer: WriteCoalescer[
+    Tuple[str, OtpData, Optional[str]], AuthorizationOutcome
+] = WriteCoalescer(
+    flush=_store_coalesced,
+    max_items=config.OTP_STORE_COALESCING_MAX_ITEMS,
+    window_seconds=config.OTP_STORE_COALESCING_WINDOW_MILLISECONDS / 1000,
+)
+
+# The admission control of the database calls of this worker, if enabled in the configuration.
+_redis_admission = Admission(
+    limiter=InFlightLimiter(max_in_flight=config.OTP_ADMISSION_MAX_IN_FLIGHT),
+    breaker=CircuitBreaker(
+        window_size=config.OTP_CIRCUIT_BREAKER_WINDOW_SIZE,
+        min_calls=config.OTP_CIRCUIT_BREAKER_MIN_CALLS,
+        failure_rate_threshold=config.OTP_CIRCUIT_BREAKER_FAILURE_RATE,
+        slow_call_seconds=config.OTP_CIRCUIT_BREAKER_SLOW_CALL_MILLISECONDS / 1000,
+        slow_call_rate_threshold=config.OTP_CIRCUIT_BREAKER_SLOW_CALL_RATE,
+        open_seconds=config.OTP_CIRCUIT_BREAKER_OPEN_SECONDS,
+    ),
+    retry_after_seconds=config.OTP_ADMISSION_RETRY_AFTER_SECONDS,
+)
@@ -0,0 +1,64 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import List, Sequence, Tuple, Union
+
+from aioredis import ConnectionsPool, Redis, RedisConnection
+
+from immuni_otp.monitoring.api import OTP_REDIS_POOL_FREE, OTP_REDIS_POOL_SIZE
+
+
+async def warm_up(redis: Redis) -> None:
+    """
+    Send a PING on each of the connections the pool keeps open, so that they are established and
+    verified before serving any request.
+
+    :param redis: the Redis manager whose pool is to be warmed up.
+    """
+    pool = redis.connection
+    connections: List[RedisConnection] = []
+    try:
+        for _ in range(pool.minsize):
+            connections.append(await pool.acquire())
+        await asyncio.gather(*(connection.execute(b"PING") for connection in connections))
+    finally:
+        for connection in connections:
+            pool.release(connection)
+
+
+def observe_pool(shard: Union[int, str], pool: ConnectionsPool) -> None:
+    """
+    Monitor the number of open and free connections of the given pool.
+
+    :param shard: the index (or the label) of the shard the pool is connected to.
+    :param pool: the pool of connections.
+    """
+    OTP_REDIS_POOL_SIZE.labels(str(shard)).set(pool.size)
+    OTP_REDIS_POOL_FREE.labels(str(shard)).set(pool.freesize)
+
+
+async def observe_pools_forever(
+    pools: Sequence[Tuple[str, ConnectionsPool]], interval_seconds: float
+) -> None:
+    """
+    Monitor the number of open and free connections of the given pools periodically, until
+    cancelled.
+
+    :param pools: the label of the shard each pool is connected to, with the pool.
+    :param interval_seconds: the number of seconds to wait between samples.
+    """
+    while True:
+        for shard, pool in pools:
+            observe_pool(shard, pool)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,264 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+_LOGGER = logging.getLogger(__name__)
+_ACCESS_LOGGER = logging.getLogger(f"{__name__}.access")
+
+# The Unix time the request being served has been received at.
+_RECEIVED_AT: ContextVar[float] = ContextVar("received_at")
+
+# Workers exiting sooner than this after being spawned are respawned with a delay, so that a
+# worker failing on start does not turn into a fork loop.
+_MIN_WORKER_SECONDS = 1.0
+
+
+def bind_socket(host: str, port: int, backlog: int = 100) -> socket.socket:
+    """
+    Return a listening socket bound with SO_REUSEPORT, so that each worker can bind its own socket
+    to the same address, and the kernel balances the incoming connections across them.
+
+    :param host: the host to bind to.
+    :param port: the port to bind to.
+    :param backlog: the maximum number of pending connections.
+    :return: the listening socket.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def worker_cpu(slot: int, cpus: Sequence[int]) -> int:
+    """
+    Return the CPU the worker in the given slot is pinned to, spreading the workers evenly.
+
+    :param slot: the slot of the worker.
+    :param cpus: the CPUs available to the process.
+    :return: the CPU to pin the worker to.
+    """
+    return sorted(cpus)[slot % len(cpus)]
+
+
+def log_access(app: Sanic) -> None:
+    """
+    Log each request served by the application with the logger of the service, with the same
+    fields as the JSON Gunicorn access log (e.g., so that it can be replayed by the benchmarks).
+
+    :param app: the Sanic application.
+    """
+
+    @app.middleware("request")
+    async def _receive(request: Request) -> None:
+        _RECEIVED_AT.set(time.time())
+
+    @app.middleware("response")
+    async def _log(request: Request, response: HTTPResponse) -> None:
+        received_at = _RECEIVED_AT.get(None)
+        _ACCESS_LOGGER.info(
+            "Request served.",
+            extra=dict(
+                timestamp=received_at,
+                request_method=request.method,
+                request_path=request.path,
+                status=response.status,
+                duration_ms=None
+                if received_at is None
+                else round((time.time() - received_at) * 1000, 3),
+                remote_addr=request.ip,
+            ),
+        )
+
+
+def recycle_after(app: Sanic, max_requests: int) -> None:
+    """
+    Stop the application gracefully once it has served the given number of requests, so that its
+    worker is replaced by a fresh one.
+
+    Only the connections already accepted are drained: the connections still queued in the backlog
+    of the SO_REUSEPORT socket of the worker are reset by the kernel when it is closed, since they
+    are not moved to the sockets of the other workers. Clients should retry them.
+
+    :param app: the Sanic application.
+    :param max_requests: the number of requests to serve.
+    """
+    served = 0
+
+    @app.middleware("response")
+    async def _count(request: Request, response: HTTPResponse) -> None:
+        nonlocal served
+        served += 1
+        if served == max_requests:
+            _LOGGER.info("Recycling the worker.", extra=dict(served_requests=served))
+            # Stop after the response has been sent, draining the open connections.
+            asyncio.get_event_loop().call_soon(app.stop)
+
+
+def serve_worker(  # pragma: no cover
+    app: Sanic,
+    slot: int,
+    host: str,
+    port: int,
+    max_requests: int,
+    cpu_affinity: bool,
+    graceful_timeout_seconds: float,
+) -> None:
+    """
+    Serve the application in the current worker process, with its own socket and event loop.
+    The application listeners initialize the managers, so that each worker owns its connections.
+
+    :param app: the Sanic application.
+    :param slot: the slot of the worker.
+    :param host: the host to bind to.
+    :param port: the port to bind to.
+    :param max_requests: the number of requests after which the worker is recycled, 0 for never.
+    :param cpu_affinity: whether to pin the worker to a single CPU.
+    :param graceful_timeout_seconds: the time given to the open connections to complete, once the
+      worker is stopped.
+    """
+    if cpu_affinity:
+        os.sched_setaffinity(0, {worker_cpu(slot, tuple(os.sched_getaffinity(0)))})
+    log_access(app)
+    if max_requests:
+        recycle_after(app, max_requests)
+    app.config.GRACEFUL_SHUTDOWN_TIMEOUT = graceful_timeout_seconds
+    # The access log of Sanic is replaced by the one of the service, in the JSON format.
+    app.run(sock=bind_socket(host, port), workers=1, access_log=False)
+
+
+class Supervisor:
+    """
+    Keep a fixed number of worker processes running, forked from the current process.
+
+    Exited workers (e.g., recycled, or crashed) are replaced. On SIGTERM or SIGINT, the workers
+    are asked to stop with SIGTERM, and killed if still running after the given timeout.
+    """
+
+    def __init__(
+        self, workers: int, target: Callable[[int], Any], kill_timeout_seconds: float
+    ) -> None:
+        """
+        :param workers: the number of worker processes.
+        :param target: the function run by each worker, receiving its slot.
+        :param kill_timeout_seconds: the time given to the workers to stop, before killing them.
+        """
+        self._workers = workers
+        self._target = target
+        self._kill_timeout_seconds = kill_timeout_seconds
+        # The slot of each running worker, and the time it has been spawned at.
+        self._slots: Dict[int, int] = {}
+        self._spawned_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        """
+        Spawn the workers, and supervise them until stopped by a signal.
+        Must be called from the main thread.
+        """
+        handlers = {
+            signum: signal.signal(signum, self._stop) for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        handlers[signal.SIGALRM] = signal.signal(signal.SIGALRM, self._kill)
+        try:
+            for slot in range(self._workers):
+                self._spawn(slot)
+            while self._slots:
+                pid, status = os.wait()
+                slot = self._slots.pop(pid)
+                lifetime = time.monotonic() - self._spawned_at.pop(pid)
+                _LOGGER.info(
+                    "Worker exited.", extra=dict(pid=pid, slot=slot, status=status),
+                )
+                if self._stopping:
+                    continue
+                if lifetime < _MIN_WORKER_SECONDS:
+                    time.sleep(_MIN_WORKER_SECONDS - lifetime)
+                if not self._stopping:
+                    self._spawn(slot)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def _spawn(self, slot: int) -> None:
+        """
+        Fork a worker in the given slot.
+
+        :param slot: the slot of the worker.
+        """
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            exit_code = 0
+            try:
+                for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                    signal.signal(signum, signal.SIG_DFL)
+                self._target(slot)
+            except BaseException:  # pylint: disable=broad-except
+                _LOGGER.exception("Worker failed.", extra=dict(slot=slot))
+                exit_code = 1
+            finally:
+                os._exit(exit_code)  # pylint: disable=protected-access
+        self._slots[pid] = slot
+        self._spawned_at[pid] = time.monotonic()
+        _LOGGER.info("Worker spawned.", extra=dict(pid=pid, slot=slot))
+
+    def _stop(self, signum: int, frame: Optional[FrameType]) -> None:
+        """
+        Ask the workers to stop gracefully, scheduling their kill after the timeout.
+
+        :param signum: the received signal.
+        :param frame: the interrupted frame.
+        """
+        if self._stopping:
+            return
+        _LOGGER.info("Stopping the workers.", extra=dict(signal=signum))
+        self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+        signal.setitimer(signal.ITIMER_REAL, self._kill_timeout_seconds)
+
+    def _kill(self, signum: int, frame: Optional[FrameType]) -> None:
+        """
+        Kill the workers still running after the timeout.
+
+        :param signum: the received signal.
+        :param frame: the interrupted frame.
+        """
+        _LOGGER.warning("Killing the workers still running.", extra=dict(pids=list(self._slots)))
+        self._signal_workers(signal.SIGKILL)
+
+    def _signal_workers(self, signum: int) -> None:
+        """
+        Send the given signal to all the running workers.
+
+        :param signum: the signal to send.
+        """
+        for pid in self._slots:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:  # pragma: no cover
+                pass
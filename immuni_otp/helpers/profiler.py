@@ -0,0 +1,157 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple
+
+# The root frame of the stacks running on the event loop thread, of the stacks of the event loop
+# thread waiting for I/O, and of the stacks of the tasks suspended in an await (e.g., waiting for
+# Redis), respectively.
+CPU_ROOT = "cpu"
+IDLE_ROOT = "idle"
+AWAIT_ROOT = "await"
+
+# The innermost frame of the asyncio event loop waiting for I/O. With uvloop, the wait happens in C
+# code, so that the idle samples end at the frame running the loop instead, rooted at CPU_ROOT.
+_IDLE_FRAME = "selectors:select"
+
+
+def _label(frame: FrameType) -> str:
+    """
+    Return the label of the given frame, in the collapsed stacks.
+
+    :param frame: the frame.
+    :return: the module and the function of the frame (e.g., "marshmallow.schema:_deserialize").
+    """
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def _thread_stack(frame: Optional[FrameType]) -> Tuple[str, ...]:
+    """
+    Return the stack of the given frame, outermost frame first.
+
+    :param frame: the innermost frame of a thread.
+    :return: the labels of the frames of the stack.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+def _await_stack(task: "asyncio.Task[Any]") -> Tuple[str, ...]:
+    """
+    Return the stack of coroutines the given suspended task is awaiting in, outermost first.
+
+    :param task: the task.
+    :return: the labels of the frames of the coroutines, empty if the task is running.
+    """
+    labels = []
+    awaitable: Any = task.get_coro()
+    if getattr(awaitable, "cr_running", False):
+        return ()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_label(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return tuple(labels)
+
+
+class StackSampler:
+    """
+    Statistical profiler of an event loop: a thread periodically samples the stack the loop thread
+    is running, and the stacks of the tasks suspended in an await, counting each distinct stack.
+    Sampling from a separate thread adds no overhead to the profiled code but the sampling itself,
+    holding the GIL for a few microseconds each interval.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        thread_id: int,
+        excluded_task: Optional["asyncio.Task[Any]"] = None,
+    ) -> None:
+        """
+        :param loop: the event loop to sample the suspended tasks of.
+        :param thread_id: the identifier of the thread running the event loop.
+        :param excluded_task: the task not to sample, if any (e.g., the one waiting for the
+          profiling to complete).
+        """
+        self._loop = loop
+        self._thread_id = thread_id
+        self._excluded_task = excluded_task
+        self._samples: Dict[Tuple[str, ...], int] = Counter()
+
+    def sample(self) -> None:
+        """
+        Take a sample of the event loop thread, and of the suspended tasks.
+        """
+        frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+        if frame is not None:
+            stack = _thread_stack(frame)
+            self._samples[(IDLE_ROOT if stack[-1] == _IDLE_FRAME else CPU_ROOT, *stack)] += 1
+        for task in asyncio.all_tasks(self._loop):
+            if task is self._excluded_task:
+                continue
+            stack = _await_stack(task)
+            if stack:
+                self._samples[(AWAIT_ROOT, *stack)] += 1
+
+    def run(self, seconds: float, interval_seconds: float) -> None:
+        """
+        Take a sample at each interval, for the given duration. To be run in a separate thread.
+
+        :param seconds: the duration of the sampling.
+        :param interval_seconds: the interval between samples.
+        """
+        ends_at = time.monotonic() + seconds
+        while time.monotonic() < ends_at:
+            self.sample()
+            time.sleep(interval_seconds)
+
+    def collapsed(self) -> str:
+        """
+        Return the samples as collapsed stacks, ready for flame graph tools (e.g., flamegraph.pl or
+        speedscope): one line per distinct stack, its frames separated by semicolons, followed by
+        the number of samples, the most frequent first.
+
+        :return: the collapsed stacks.
+        """
+        lines: List[str] = [
+            f"{';'.join(stack)} {count}"
+            for stack, count in sorted(self._samples.items(), key=lambda item: -item[1])
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+async def profile(seconds: float, interval_seconds: float) -> str:
+    """
+    Profile the current event loop for the given duration, sampling it from a separate thread.
+    The task calling this function is excluded from the samples.
+
+    :param seconds: the duration of the profiling.
+    :param interval_seconds: the interval between samples.
+    :return: the collapsed stacks.
+    """
+    loop = asyncio.get_event_loop()
+    sampler = StackSampler(loop, threading.get_ident(), excluded_task=asyncio.current_task())
+    await loop.run_in_executor(None, sampler.run, seconds, interval_seconds)
+    return sampler.collapsed()
@@ -0,0 +1,122 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import deque
+from typing import Callable, Deque, Hashable, Set
+
+
+class _Bucket:
+    """
+    The keys added within the same time slot.
+    """
+
+    __slots__ = ("started_at", "keys")
+
+    def __init__(self, started_at: float) -> None:
+        """
+        :param started_at: the time of the earliest key in the bucket.
+        """
+        self.started_at = started_at
+        self.keys: Set[Hashable] = set()
+
+
+class RecentKeys:
+    """
+    Exact, time-bucketed set of the keys added within the last ttl_seconds.
+
+    Keys are grouped in buckets spanning bucket_seconds each, and a bucket is discarded as a whole
+    as soon as its earliest key is older than ttl_seconds. Hence, a key is reported as present only
+    while it is certainly younger than ttl_seconds, and membership answers are never false
+    positives. When full, the oldest buckets are discarded early, which may only cause false
+    negatives.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        bucket_seconds: float,
+        max_size: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param ttl_seconds: the time after which a key is no longer reported as present.
+        :param bucket_seconds: the time span of each bucket.
+        :param max_size: the maximum number of keys to keep.
+        :param clock: the monotonic clock to measure time with.
+        """
+        self._ttl_seconds = ttl_seconds
+        self._bucket_seconds = bucket_seconds
+        self._max_size = max_size
+        self._clock = clock
+        self._buckets: Deque[_Bucket] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        self._expire(self._clock())
+        return self._size
+
+    def __contains__(self, key: Hashable) -> bool:
+        now = self._clock()
+        self._expire(now)
+        return any(
+            key in bucket.keys and bucket.started_at + self._ttl_seconds > now
+            for bucket in self._buckets
+        )
+
+    def add(self, key: Hashable, added_at: float) -> None:
+        """
+        Add the given key.
+
+        :param key: the key to add.
+        :param added_at: the clock time the key's lifetime started at, which may be slightly in the
+          past (e.g., before the round trip writing it to the database).
+        """
+        now = self._clock()
+        self._expire(now)
+        while self._size >= self._max_size and self._buckets:
+            self._size -= len(self._buckets.popleft().keys)
+        if not self._buckets or now >= self._buckets[-1].started_at + self._bucket_seconds:
+            self._buckets.append(_Bucket(started_at=added_at))
+        bucket = self._buckets[-1]
+        bucket.started_at = min(bucket.started_at, added_at)
+        if key not in bucket.keys:
+            bucket.keys.add(key)
+            self._size += 1
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Remove the given key, if present.
+
+        :param key: the key to remove.
+        """
+        for bucket in self._buckets:
+            if key in bucket.keys:
+                bucket.keys.remove(key)
+                self._size -= 1
+
+    def clear(self) -> None:
+        """
+        Remove all the keys.
+        """
+        self._buckets.clear()
+        self._size = 0
+
+    def _expire(self, now: float) -> None:
+        """
+        Discard the buckets whose earliest key is older than the ttl.
+
+        :param now: the current clock time.
+        """
+        while self._buckets and self._buckets[0].started_at + self._ttl_seconds <= now:
+            self._size -= len(self._buckets.popleft().keys)
@@ -0,0 +1,233 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import fcntl
+import logging
+import mmap
+import os
+from itertools import count
+from struct import Struct
+from typing import Optional
+from zlib import crc32
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAGIC = b"OTPB"
+_VERSION = 1
+# Magic, version, logical offsets of the first and past the last records, and CRC-32 of the
+# preceding fields.
+_HEADER = Struct(">4sB3xQQI")
+# Length and CRC-32 of the payload.
+_RECORD_HEADER = Struct(">II")
+
+
+class RingBuffer:
+    """
+    Bounded FIFO of binary records, persisted in a memory-mapped, append-only ring file.
+
+    Records are written and flushed to disk before the header referencing them, and every change
+    is flushed before returning, so that the acknowledged records survive a crash. Only the pages
+    changed are flushed (i.e., the header, and the pages of the record appended, if any), so that
+    the cost of each change does not grow with the capacity of the buffer. On opening, the records
+    are checked against their CRC-32, and the buffer is truncated at the first corrupted one
+    (e.g., torn by a crash while being written).
+    The file is locked for exclusive use, so that each process owns its own buffer.
+    """
+
+    def __init__(self, path: str, capacity_bytes: int) -> None:
+        """
+        :param path: the path of the ring file, created if missing.
+        :param capacity_bytes: the capacity of a new ring file, records included. Existing files
+          retain their capacity.
+        :raise: BlockingIOError if the file is locked by another process.
+        """
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._fd)
+            raise
+        size = os.fstat(self._fd).st_size
+        if size <= _HEADER.size:
+            size = _HEADER.size + capacity_bytes
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._capacity = size - _HEADER.size
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+        self._recover()
+
+    @classmethod
+    def open_slot(cls, directory: str, capacity_bytes: int) -> "RingBuffer":
+        """
+        Open the first ring file of the given directory which is not in use by another process,
+        creating a new one if all are in use. The records left by a crashed process are thus
+        adopted by the next process opening the same slot.
+
+        :param directory: the directory of the ring files, created if missing.
+        :param capacity_bytes: the capacity of a new ring file.
+        :return: the buffer of the first free slot.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for slot in count():
+            try:
+                return cls(os.path.join(directory, f"buffer-{slot}.bin"), capacity_bytes)
+            except BlockingIOError:
+                continue
+        raise AssertionError("Unreachable.")  # pragma: no cover
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        The number of bytes used by the records in the buffer.
+        """
+        return self._tail - self._head
+
+    def append(self, payload: bytes) -> bool:
+        """
+        Append the given record to the buffer, durably.
+
+        :param payload: the record to append.
+        :return: True if appended, False if the buffer is full.
+        """
+        record = _RECORD_HEADER.pack(len(payload), crc32(payload)) + payload
+        if self.size_bytes + len(record) > self._capacity:
+            return False
+        self._write(self._tail, record)
+        self._tail += len(record)
+        self._count += 1
+        self._commit()
+        return True
+
+    def peek(self) -> Optional[bytes]:
+        """
+        Return the oldest record in the buffer, without removing it.
+
+        :return: the oldest record, None if the buffer is empty.
+        """
+        if not self._count:
+            return None
+        length, _ = _RECORD_HEADER.unpack(self._read(self._head, _RECORD_HEADER.size))
+        return self._read(self._head + _RECORD_HEADER.size, length)
+
+    def pop(self) -> None:
+        """
+        Remove the oldest record from the buffer, durably, if any.
+        """
+        if not self._count:
+            return
+        length, _ = _RECORD_HEADER.unpack(self._read(self._head, _RECORD_HEADER.size))
+        self._head += _RECORD_HEADER.size + length
+        self._count -= 1
+        if not self._count:
+            self._head = self._tail = 0
+        self._commit()
+
+    def close(self) -> None:
+        """
+        Close the ring file, releasing its lock.
+        """
+        self._map.close()
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+    def _recover(self) -> None:
+        """
+        Load the header, and check the records it references, truncating the buffer at the first
+        corrupted one. Invalid headers reset the buffer.
+        """
+        magic, version, head, tail, checksum = _HEADER.unpack_from(self._map)
+        if (
+            magic != _MAGIC
+            or version != _VERSION
+            or checksum != crc32(self._map[: _HEADER.size - 4])
+        ):
+            if any(self._map[: _HEADER.size]):
+                _LOGGER.warning(
+                    "Discarding the buffer with an invalid header.", extra=dict(path=self.path)
+                )
+            head = tail = 0
+
+        offset = head
+        while offset + _RECORD_HEADER.size <= tail:
+            length, checksum = _RECORD_HEADER.unpack(self._read(offset, _RECORD_HEADER.size))
+            if length > tail - offset - _RECORD_HEADER.size or checksum != crc32(
+                self._read(offset + _RECORD_HEADER.size, length)
+            ):
+                break
+            offset += _RECORD_HEADER.size + length
+            self._count += 1
+        if offset != tail:
+            _LOGGER.warning(
+                "Truncating the buffer at a corrupted record.",
+                extra=dict(path=self.path, discarded_bytes=tail - offset),
+            )
+        self._head = head
+        self._tail = offset
+        self._commit()
+
+    def _commit(self) -> None:
+        """
+        Write the header, and flush it to disk.
+        """
+        fields = _HEADER.pack(_MAGIC, _VERSION, self._head, self._tail, 0)[:-4]
+        self._map[: _HEADER.size] = fields + crc32(fields).to_bytes(4, "big")
+        self._flush(0, _HEADER.size)
+
+    def _write(self, offset: int, data: bytes) -> None:
+        """
+        Write the given data at the given logical offset, wrapping around the end of the ring, and
+        flush it to disk.
+
+        :param offset: the logical offset to write at.
+        :param data: the data to write.
+        """
+        position = offset % self._capacity
+        first = min(len(data), self._capacity - position)
+        start = _HEADER.size + position
+        self._map[start : start + first] = data[:first]
+        self._flush(start, first)
+        self._map[_HEADER.size : _HEADER.size + len(data) - first] = data[first:]
+        self._flush(_HEADER.size, len(data) - first)
+
+    def _flush(self, start: int, size: int) -> None:
+        """
+        Flush to disk the pages of the file holding the given range, if not empty.
+
+        :param start: the offset of the range in the file.
+        :param size: the size of the range.
+        """
+        if size:
+            page_start = start - start % mmap.PAGESIZE
+            self._map.flush(page_start, start + size - page_start)
+
+    def _read(self, offset: int, size: int) -> bytes:
+        """
+        Read the given number of bytes at the given logical offset, wrapping around the end of the
+        ring.
+
+        :param offset: the logical offset to read at.
+        :param size: the number of bytes to read.
+        :return: the bytes read.
+        """
+        position = offset % self._capacity
+        first = min(size, self._capacity - position)
+        start = _HEADER.size + position
+        return (
+            self._map[start : start + first] + self._map[_HEADER.size : _HEADER.size + size - first]
+        )
@@ -0,0 +1,79 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from bisect import bisect
+from hashlib import blake2b
+from typing import List, Sequence
+
+
+def _hash(value: str) -> int:
+    """
+    Return a 64-bit hash of the given value, stable across processes.
+
+    :param value: the value to hash.
+    :return: the 64-bit hash of the value.
+    """
+    return int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shard_nodes(count: int) -> List[str]:
+    """
+    Return the identifiers of the given number of shards on the ring: their position in the
+    configuration, rather than their URL, so that changing the credentials or the host of a shard
+    does not remap its keys. Hence, new shards must be appended, and existing ones never reordered.
+
+    :param count: the number of shards.
+    :return: the identifiers of the shards, in configuration order.
+    """
+    return [f"shard-{index}" for index in range(count)]
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys to nodes.
+
+    Each node is placed on the ring multiple times (virtual nodes), according to its identifier,
+    so that keys are evenly spread, and adding or removing a node only remaps the keys falling in
+    its own ring segments.
+    """
+
+    def __init__(self, nodes: Sequence[str], virtual_nodes: int) -> None:
+        """
+        :param nodes: the identifiers of the nodes (e.g., from shard_nodes), which must be unique.
+        :param virtual_nodes: the number of points of each node on the ring.
+        :raise: ValueError if no nodes are given, or their identifiers are not unique.
+        """
+        if not nodes:
+            raise ValueError("Cannot build a hash ring without nodes.")
+        if len(set(nodes)) != len(nodes):
+            raise ValueError("Cannot build a hash ring with duplicated nodes.")
+        points = sorted(
+            (_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(nodes)
+            for replica in range(virtual_nodes)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._indexes: List[int] = [index for _, index in points]
+        self._single = len(nodes) == 1
+
+    def node_for(self, key: str) -> int:
+        """
+        Return the index of the node the given key is assigned to.
+
+        :param key: the key to assign.
+        :return: the index of the node, within the nodes the ring has been built with.
+        """
+        if self._single:
+            return 0
+        position = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._indexes[position]
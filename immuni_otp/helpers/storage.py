@@ -0,0 +1,442 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aioredis import ConnectionClosedError, ConnectionsPool, PoolClosedError, Redis
+from aioredis.commands import Pipeline
+
+from immuni_common.helpers.otp import key_for_otp_sha
+from immuni_common.models.dataclasses import OtpData
+from immuni_otp.core import config
+from immuni_otp.helpers.encoding import decode_otp_data, encode_key, encode_otp_data
+from immuni_otp.helpers.lua import LuaScript
+from immuni_otp.helpers.pool import observe_pool
+from immuni_otp.helpers.sharding import HashRing
+from immuni_otp.helpers.timer_wheel import TimerWheel
+from immuni_otp.models.enums import AuthorizationOutcome, StorageFormat
+from immuni_otp.monitoring.api import (
+    OTP_REDIS_POOL_WAIT_SECONDS,
+    OTP_REDIS_POOL_WAITERS,
+    OTP_REDIS_SECONDS,
+    OTP_SERIALIZATION_SECONDS,
+)
+
+# Set the first key unless the OTP has already been stored, with any of the formats, after taking
+# a token from the rate limiting bucket of the client, if any.
+# KEYS are the keys of the OTP in each format, starting from the one to set, followed by the key of
+# the bucket if rate limited. ARGV[1] is the value to set, ARGV[2] its expiration in seconds,
+# ARGV[3] the tokens added to the bucket each millisecond (0 if not rate limited), ARGV[4] the
+# capacity of the bucket, ARGV[5] the current Unix time in milliseconds, and ARGV[4 + index] the
+# value in the format of KEYS[index], for each other format.
+# The script returns 1 if the value has been set, 2 if an identical value was already stored, 0 if
+# a different value was already stored, and 3 if the bucket is empty.
+_STORE = LuaScript(
+    """
+    local formats = #KEYS
+    if ARGV[3] ~= "0" then
+        formats = formats - 1
+        local rate = tonumber(ARGV[3])
+        local capacity = tonumber(ARGV[4])
+        local now = tonumber(ARGV[5])
+        local bucket = redis.call("HMGET", KEYS[#KEYS], "tokens", "updated_at")
+        local tokens = capacity
+        if bucket[1] then
+            local elapsed = math.max(now - tonumber(bucket[2]), 0)
+            tokens = math.min(capacity, tonumber(bucket[1]) + elapsed * rate)
+        end
+        if tokens < 1 then
+            return 3
+        end
+        redis.call("HMSET", KEYS[#KEYS], "tokens", tokens - 1, "updated_at", now)
+        -- A bucket left untouched until full is equivalent to a missing one.
+        redis.call("PEXPIRE", KEYS[#KEYS], math.ceil(capacity / rate))
+    end
+    for index = 2, formats do
+        local existing = redis.call("GET", KEYS[index])
+        if existing then
+            if existing == ARGV[index + 4] then
+                return 2
+            end
+            return 0
+        end
+    end
+    if redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2], "NX") then
+        return 1
+    end
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return 2
+    end
+    return 0
+    """
+)
+# Get and delete the first of the keys which is set, if any.
+# KEYS are the keys of the OTP in each format.
+# The script returns the value of the deleted key, or nil if none of the keys is set.
+_CONSUME = LuaScript(
+    """
+    for index = 1, #KEYS do
+        local value = redis.call("GET", KEYS[index])
+        if value then
+            redis.call("DEL", KEYS[index])
+            return value
+        end
+    end
+    return false
+    """,
+    decode=False,
+)
+# The errors raised when the storage is unreachable (e.g., connection refused, or closed).
+STORAGE_UNAVAILABLE_ERRORS = (OSError, asyncio.TimeoutError, ConnectionClosedError, PoolClosedError)
+_STORE_OUTCOMES = {
+    0: AuthorizationOutcome.COLLISION,
+    1: AuthorizationOutcome.STORED,
+    2: AuthorizationOutcome.DUPLICATE,
+    3: AuthorizationOutcome.RATE_LIMITED,
+}
+# The prefix of the keys of the rate limiting buckets, one per client.
+_RATE_LIMIT_KEY_PREFIX = "~otp-rate:"
+
+
+class OtpStorage(ABC):
+    """
+    The storage of the OtpData associated with each authorised OTP, until their expiration.
+    OTPs are identified by their hex SHA-256 (i.e., the CUN).
+    """
+
+    @abstractmethod
+    async def store(
+        self,
+        otp_sha: str,
+        otp_data: OtpData,
+        expiration_seconds: Optional[int] = None,
+        client: Optional[str] = None,
+    ) -> AuthorizationOutcome:
+        """
+        Store the OtpData associated with the OTP until its expiration, unless the OTP is already
+        stored.
+
+        :param otp_sha: the hex SHA-256 of the OTP.
+        :param otp_data: the OtpData to store.
+        :param expiration_seconds: the number of seconds the OtpData expires in, defaulting to
+          OTP_EXPIRATION_SECONDS.
+        :param client: the identity of the client to rate limit, None if not rate limited.
+        :return: STORED if stored, DUPLICATE if already stored with the same OtpData, COLLISION if
+          already stored with a different one, RATE_LIMITED if the client exceeded its rate limit.
+        """
+
+    @abstractmethod
+    async def store_many(
+        self, otps: Sequence[Tuple[str, OtpData]], client: Optional[str] = None
+    ) -> List[AuthorizationOutcome]:
+        """
+        Store the OtpData associated with each OTP, as store() does, in as few operations as
+        possible.
+
+        :param otps: the sequence of hex SHA-256 of the OTPs, each one with its OtpData.
+        :param client: the identity of the client to rate limit, None if not rate limited.
+        :return: the outcome of each OTP, in the given order.
+        """
+
+    @abstractmethod
+    async def consume(self, otp_sha: str) -> Optional[OtpData]:
+        """
+        Retrieve and delete the OtpData associated with the OTP, atomically.
+
+        :param otp_sha: the hex SHA-256 of the OTP.
+        :return: the OtpData associated with the OTP, None if not stored (or expired).
+        """
+
+    @abstractmethod
+    async def flush(self) -> None:
+        """
+        Delete all the stored OtpData.
+        """
+
+
+def _storage_formats() -> List[StorageFormat]:
+    """
+    Return the formats to check to store an OTP, the first one being the configured format.
+
+    :return: the configured format, followed by the other formats if the dual read is enabled.
+    """
+    formats = [config.OTP_STORAGE_FORMAT]
+    if config.OTP_STORAGE_DUAL_READ:
+        formats.extend(
+            storage_format
+            for storage_format in StorageFormat
+            if storage_format != config.OTP_STORAGE_FORMAT
+        )
+    return formats
+
+
+def _store_command(  # pylint: disable=too-many-arguments
+    redis: Union[Redis, Pipeline],
+    otp_sha: str,
+    otp_data: OtpData,
+    expiration_seconds: Optional[int] = None,
+    client: Optional[str] = None,
+    shards: int = 1,
+) -> Awaitable[Any]:
+    """
+    Issue the command storing the OtpData associated with the OTP, unless already stored.
+
+    :param redis: the Redis manager, or the pipeline, to issue the command with.
+    :param otp_sha: the hex SHA-256 of the OTP associated with the database entry.
+    :param otp_data: the OtpData to store.
+    :param expiration_seconds: the number of seconds the OtpData expires in, defaulting to
+      OTP_EXPIRATION_SECONDS.
+    :param client: the identity of the client to rate limit, None if not rate limited.
+    :param shards: the number of shards the rate limit of the client is split across, since each
+      shard has its own bucket for the client.
+    :return: the awaitable resolved with the outcome code of the _STORE script.
+    """
+    storage_formats = _storage_formats()
+    keys = [encode_key(otp_sha, storage_format) for storage_format in storage_formats]
+    with OTP_SERIALIZATION_SECONDS.time():
+        values = [encode_otp_data(otp_data, storage_format) for storage_format in storage_formats]
+    if expiration_seconds is None:
+        expiration_seconds = config.OTP_EXPIRATION_SECONDS
+    rate_limit: List[Any] = [0, 0, 0]
+    if client is not None:
+        keys.append(_RATE_LIMIT_KEY_PREFIX + client)
+        rate_limit = [
+            config.OTP_RATE_LIMIT_PER_SECOND / shards / 1000,
+            max(config.OTP_RATE_LIMIT_BURST / shards, 1),
+            int(time.time() * 1000),
+        ]
+    return _STORE(redis, keys=keys, args=[values[0], expiration_seconds, *rate_limit, *values[1:]])
+
+
+class RedisStorage(OtpStorage):
+    """
+    Store OtpData on Redis, sharded across the given Redis managers by means of consistent
+    hashing of the hex key of each OTP, so that the keys of an OTP in every format are on the same
+    shard.
+    """
+
+    def __init__(self, shards: Sequence[Redis], ring: HashRing, label_prefix: str = "") -> None:
+        """
+        :param shards: the Redis managers of the shards.
+        :param ring: the consistent hashing ring, mapping keys to the index of their shard.
+        :param label_prefix: the prefix of the index of each shard, in the monitoring labels, to
+          tell apart the shards of different storages.
+        """
+        self._shards = tuple(shards)
+        self._ring = ring
+        self._labels = tuple(f"{label_prefix}{shard}" for shard in range(len(self._shards)))
+
+    @property
+    def pools(self) -> Tuple[Tuple[str, ConnectionsPool], ...]:
+        """
+        The pool of connections of each shard, with the label of the shard in the monitoring.
+        """
+        return tuple((label, shard.connection) for label, shard in zip(self._labels, self._shards))
+
+    def _shard_index(self, otp_sha: str) -> int:
+        """
+        Return the index of the shard the given OTP is stored on.
+
+        :param otp_sha: the hex SHA-256 of the OTP.
+        :return: the index of the shard.
+        """
+        return self._ring.node_for(key_for_otp_sha(otp_sha))
+
+    def redis_for(self, otp_sha: str) -> Redis:
+        """
+        Return the Redis manager of the shard the given OTP is stored on.
+
+        :param otp_sha: the hex SHA-256 of the OTP.
+        :return: the Redis manager of the shard.
+        """
+        return self._shards[self._shard_index(otp_sha)]
+
+    async def store(
+        self,
+        otp_sha: str,
+        otp_data: OtpData,
+        expiration_seconds: Optional[int] = None,
+        client: Optional[str] = None,
+    ) -> AuthorizationOutcome:
+        """
+        Store the OtpData with a single script, enforcing the rate limit of the client within the
+        same script, and monitoring the connection pool, the time spent waiting for a free
+        connection, and the latency of the command.
+        """
+        shard = self._shard_index(otp_sha)
+        redis = self._shards[shard]
+        pool = redis.connection
+        observe_pool(self._labels[shard], pool)
+        if pool.freesize:
+            OTP_REDIS_POOL_WAIT_SECONDS.observe(0)
+            with OTP_REDIS_SECONDS.labels("store").time():
+                return _STORE_OUTCOMES[
+                    await _store_command(
+                        redis, otp_sha, otp_data, expiration_seconds, client, len(self._shards)
+                    )
+                ]
+
+        # All the connections are in exclusive use (e.g., by pipelines), wait for one explicitly,
+        # so that the time spent waiting is accounted for.
+        started_at = time.perf_counter()
+        with OTP_REDIS_POOL_WAITERS.labels(self._labels[shard]).track_inprogress():
+            connection = await pool.acquire()
+        OTP_REDIS_POOL_WAIT_SECONDS.observe(time.perf_counter() - started_at)
+        try:
+            with OTP_REDIS_SECONDS.labels("store").time():
+                return _STORE_OUTCOMES[
+                    await _store_command(
+                        Redis(connection),
+                        otp_sha,
+                        otp_data,
+                        expiration_seconds,
+                        client,
+                        len(self._shards),
+                    )
+                ]
+        finally:
+            pool.release(connection)
+
+    async def store_many(
+        self, otps: Sequence[Tuple[str, OtpData]], client: Optional[str] = None
+    ) -> List[AuthorizationOutcome]:
+        """
+        Store the OtpData pipelining all the writes in a single round trip per shard, all the
+        shards being written to concurrently. Each OTP takes a token from the bucket of the client.
+        """
+        positions_by_shard: Dict[int, List[int]] = defaultdict(list)
+        for position, (otp_sha, _) in enumerate(otps):
+            positions_by_shard[self._shard_index(otp_sha)].append(position)
+
+        async def _store_on_shard(shard: int, positions: List[int]) -> List[AuthorizationOutcome]:
+            observe_pool(self._labels[shard], self._shards[shard].connection)
+            pipeline = self._shards[shard].pipeline()
+            for position in positions:
+                otp_sha, otp_data = otps[position]
+                _store_command(pipeline, otp_sha, otp_data, client=client, shards=len(self._shards))
+            with OTP_REDIS_SECONDS.labels("pipeline").time():
+                codes = await pipeline.execute()
+            return [_STORE_OUTCOMES[code] for code in codes]
+
+        results = await asyncio.gather(
+            *(_store_on_shard(shard, positions) for shard, positions in positions_by_shard.items())
+        )
+        outcome_by_position: Dict[int, AuthorizationOutcome] = {}
+        for positions, outcomes in zip(positions_by_shard.values(), results):
+            outcome_by_position.update(zip(positions, outcomes))
+        return [outcome_by_position[position] for position in range(len(otps))]
+
+    async def consume(self, otp_sha: str) -> Optional[OtpData]:
+        """
+        Retrieve and delete the OtpData with a single script, whatever the format it is stored
+        with.
+        """
+        keys = [encode_key(otp_sha, storage_format) for storage_format in _storage_formats()]
+        value = await _CONSUME(self.redis_for(otp_sha), keys=keys, args=[])
+        if value is None:
+            return None
+        return decode_otp_data(value)
+
+    async def flush(self) -> None:
+        """
+        Delete all the keys of the database of each shard.
+        """
+        for redis in self._shards:
+            await redis.flushdb()
+
+
+class MemoryStorage(OtpStorage):
+    """
+    Store OtpData in the memory of the current process, e.g., for single-node deployments and
+    tests.
+    Expired OtpData are never returned, and their memory is reclaimed as the timer wheel turns.
+    """
+
+    def __init__(self, tick_seconds: float, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param tick_seconds: the resolution the memory of expired OtpData is reclaimed with.
+        :param clock: the monotonic clock, in seconds.
+        """
+        self._clock = clock
+        # The OtpData associated with each OTP, with the time it expires at.
+        self._otps: Dict[str, Tuple[OtpData, float]] = {}
+        self._expirations: TimerWheel[str] = TimerWheel(tick_seconds=tick_seconds, clock=clock)
+
+    def __len__(self) -> int:
+        return len(self._otps)
+
+    def _get(self, otp_sha: str) -> Optional[OtpData]:
+        """
+        Return the OtpData associated with the OTP, unless expired.
+
+        :param otp_sha: the hex SHA-256 of the OTP.
+        :return: the OtpData associated with the OTP, None if not stored (or expired).
+        """
+        for expired in self._expirations.advance():
+            del self._otps[expired]
+        otp_data, expires_at = self._otps.get(otp_sha, (None, 0.0))
+        if otp_data is None or expires_at <= self._clock():
+            return None
+        return otp_data
+
+    async def store(  # pylint: disable=unused-argument
+        self,
+        otp_sha: str,
+        otp_data: OtpData,
+        expiration_seconds: Optional[int] = None,
+        client: Optional[str] = None,
+    ) -> AuthorizationOutcome:
+        """
+        Store the OtpData, scheduling its expiration on the timer wheel.
+        Clients are not rate limited by this storage.
+        """
+        if expiration_seconds is None:
+            expiration_seconds = config.OTP_EXPIRATION_SECONDS
+        existing = self._get(otp_sha)
+        if existing is not None:
+            if existing == otp_data:
+                return AuthorizationOutcome.DUPLICATE
+            return AuthorizationOutcome.COLLISION
+        self._otps[otp_sha] = (otp_data, self._clock() + expiration_seconds)
+        self._expirations.schedule(otp_sha, delay_seconds=expiration_seconds)
+        return AuthorizationOutcome.STORED
+
+    async def store_many(  # pylint: disable=unused-argument
+        self, otps: Sequence[Tuple[str, OtpData]], client: Optional[str] = None
+    ) -> List[AuthorizationOutcome]:
+        """
+        Store the OtpData one at a time, since there are no round trips to save.
+        """
+        return [await self.store(otp_sha, otp_data) for otp_sha, otp_data in otps]
+
+    async def consume(self, otp_sha: str) -> Optional[OtpData]:
+        """
+        Retrieve and delete the OtpData, cancelling its expiration.
+        """
+        otp_data = self._get(otp_sha)
+        if otp_data is not None:
+            del self._otps[otp_sha]
+            self._expirations.cancel(otp_sha)
+        return otp_data
+
+    async def flush(self) -> None:
+        """
+        Delete all the OtpData, cancelling their expiration.
+        """
+        for otp_sha in self._otps:
+            self._expirations.cancel(otp_sha)
+        self._otps.clear()
@@ -0,0 +1,36 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from sanic import Sanic
+
+# The name of the blueprint serving the API documentation, as registered by create_app().
+_SWAGGER_BLUEPRINT = "swagger"
+
+
+def disable_api_docs(app: Sanic) -> None:
+    """
+    Remove the API documentation from the given application: the routes serving it, and the
+    listener building its spec at each start, are unregistered.
+
+    :param app: the Sanic application, with the swagger blueprint registered.
+    """
+    blueprint = app.blueprints.pop(_SWAGGER_BLUEPRINT, None)
+    if blueprint is None:
+        return
+    app._blueprint_order.remove(blueprint)  # pylint: disable=protected-access
+    for uri, route in list(app.router.routes_all.items()):
+        if route.name and route.name.startswith(f"{_SWAGGER_BLUEPRINT}."):
+            app.remove_route(uri)
+    for event, listeners in blueprint.listeners.items():
+        for listener in listeners:
+            app.listeners[event].remove(listener)
@@ -0,0 +1,143 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from math import ceil, floor
+from typing import Callable, Dict, Generic, Hashable, List, Set, TypeVar
+
+_Key = TypeVar("_Key", bound=Hashable)
+
+
+class TimerWheel(Generic[_Key]):
+    """
+    Hierarchical timing wheel, keeping the expiration of keys at a given tick resolution.
+
+    Each level is a ring of slots, each slot of a level spanning as many ticks as a whole ring of
+    the level below. Keys are scheduled in the lowest level able to hold their expiration, and are
+    cascaded down as the wheel turns, so that scheduling, cancelling and expiring a key all cost
+    O(1), and each tick only touches the keys expiring on it (plus the ones cascading down).
+    Keys expire on the first tick at or after their expiration, never before.
+    """
+
+    def __init__(
+        self,
+        tick_seconds: float,
+        slots: int = 64,
+        levels: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param tick_seconds: the resolution of the wheel.
+        :param slots: the number of slots of each level.
+        :param levels: the number of levels. Expirations farther than slots ** levels ticks are
+          held in the farthest slot, and rescheduled when it cascades down.
+        :param clock: the monotonic clock, in seconds.
+        """
+        self._tick_seconds = tick_seconds
+        self._slots = slots
+        self._levels = levels
+        self._clock = clock
+        self._origin = clock()
+        self._current = 0
+        self._wheels: List[List[Set[_Key]]] = [[set() for _ in range(slots)] for _ in range(levels)]
+        # The tick each key expires on, and the slot it is currently held in.
+        self._expirations: Dict[_Key, int] = {}
+        self._positions: Dict[_Key, Set[_Key]] = {}
+
+    def __len__(self) -> int:
+        return len(self._expirations)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._expirations
+
+    def schedule(self, key: _Key, delay_seconds: float) -> None:
+        """
+        Schedule the given key to expire after the given delay, replacing its previous schedule.
+
+        :param key: the key to schedule.
+        :param delay_seconds: the number of seconds after which the key expires.
+        """
+        self.cancel(key)
+        expiration = ceil((self._clock() - self._origin + delay_seconds) / self._tick_seconds)
+        self._expirations[key] = max(expiration, self._current + 1)
+        self._place(key)
+
+    def cancel(self, key: _Key) -> None:
+        """
+        Remove the given key from the wheel, if scheduled.
+
+        :param key: the key to remove.
+        """
+        if key in self._expirations:
+            del self._expirations[key]
+            self._positions.pop(key).discard(key)
+
+    def advance(self) -> List[_Key]:
+        """
+        Turn the wheel up to the current time.
+
+        :return: the keys expired since the last advance.
+        """
+        target = floor((self._clock() - self._origin) / self._tick_seconds)
+        expired: List[_Key] = []
+        while self._current < target:
+            if not self._expirations:
+                # Nothing to expire, jump straight to the target.
+                self._current = target
+                break
+            expired.extend(self._tick())
+        return expired
+
+    def _tick(self) -> Set[_Key]:
+        """
+        Advance the wheel by a single tick, cascading the keys of the higher levels down.
+
+        :return: the keys expiring on the new tick.
+        """
+        self._current += 1
+        for level in range(1, self._levels):
+            span = self._slots ** level
+            if self._current % span:
+                break
+            slot = self._wheels[level][(self._current // span) % self._slots]
+            cascading = list(slot)
+            slot.clear()
+            for key in cascading:
+                self._place(key)
+
+        slot = self._wheels[0][self._current % self._slots]
+        expired = set(slot)
+        slot.clear()
+        for key in expired:
+            del self._expirations[key]
+            del self._positions[key]
+        return expired
+
+    def _place(self, key: _Key) -> None:
+        """
+        Hold the given key in the slot of the lowest level able to hold its expiration.
+
+        :param key: the scheduled key.
+        """
+        expiration = self._expirations[key]
+        delta = expiration - self._current
+        for level in range(self._levels):
+            span = self._slots ** level
+            if delta < span * self._slots:
+                break
+        else:
+            # Too far to be held, park the key in the farthest slot, to be rescheduled from there.
+            expiration = self._current + span * self._slots - 1
+        slot = self._wheels[level][(expiration // span) % self._slots]
+        slot.add(key)
+        self._positions[key] = slot
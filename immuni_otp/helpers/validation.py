@@ -0,0 +1,152 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from datetime import date
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sanic.exceptions import InvalidUsage
+from sanic.request import Request
+
+from immuni_common.models.marshmallow.validators import OTP_LENGTH
+from immuni_otp.core import config
+
+_Handler = Callable[..., Awaitable[Any]]
+
+OTP_CHARACTERS = "AEFHIJKLQRSUWXYZ123456789"
+_OTP_CHARACTER_SET = frozenset(OTP_CHARACTERS)
+
+# Values of each character at odd (1-based) positions, for the check digit computation.
+_ODD_VALUES = {
+    **dict(zip("0123456789", (1, 0, 5, 7, 9, 13, 15, 17, 19, 21))),
+    **dict(
+        zip(
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            (1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25)
+            + (24, 23),
+        )
+    ),
+}
+# Values of each character at even (1-based) positions, for the check digit computation.
+_EVEN_VALUES = {
+    **{str(digit): digit for digit in range(10)},
+    **{letter: index for index, letter in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ")},
+}
+# The table of values to use at each position of the OTP without its check digit.
+_POSITION_VALUES = tuple(
+    _ODD_VALUES if position % 2 else _EVEN_VALUES for position in range(1, OTP_LENGTH)
+)
+
+# Only the canonical forms are matched, anything else is left to the generic validation.
+_CUN_PATTERN = re.compile(r"[0-9a-f]{64}")
+_ISO_DATE_PATTERN = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+_UUID4_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}")
+
+_AUTHORIZATION_FIELDS = frozenset(("otp", "symptoms_started_on", "id_test_verification"))
+
+
+def check_digit(otp_body: str) -> str:
+    """
+    Return the check digit of the given OTP without its last character.
+
+    :param otp_body: the first 9 characters of the OTP.
+    :return: the check digit completing the OTP.
+    """
+    total = sum(values[character] for values, character in zip(_POSITION_VALUES, otp_body))
+    return OTP_CHARACTERS[total % len(OTP_CHARACTERS)]
+
+
+def is_valid_otp(otp: str) -> bool:
+    """
+    Check whether the given string is an OTP, made of the allowed characters and ending with its
+    check digit.
+
+    :param otp: the string to check.
+    :return: True if the string is a valid OTP, False otherwise.
+    """
+    return (
+        len(otp) == OTP_LENGTH
+        and _OTP_CHARACTER_SET.issuperset(otp)
+        and check_digit(otp[:-1]) == otp[-1]
+    )
+
+
+def parse_authorization(body: Any) -> Optional[Dict[str, Any]]:
+    """
+    Parse the JSON body of an OTP authorization, accepting only its canonical forms: an OTP or a
+    lowercase hex CUN, a YYYY-MM-DD date and a lowercase UUID4, or null, as the id of the test.
+
+    :param body: the decoded JSON body of the request.
+    :return: the otp, symptoms_started_on and id_test_verification arguments of the handler if the
+      body is certainly valid, None if it must go through the generic validation.
+    """
+    if not isinstance(body, dict) or not _AUTHORIZATION_FIELDS.issuperset(body):
+        return None
+
+    otp = body.get("otp")
+    if not isinstance(otp, str) or not (is_valid_otp(otp) or _CUN_PATTERN.fullmatch(otp)):
+        return None
+
+    symptoms_started_on = body.get("symptoms_started_on")
+    if not isinstance(symptoms_started_on, str) or not _ISO_DATE_PATTERN.fullmatch(
+        symptoms_started_on
+    ):
+        return None
+    try:
+        parsed_date = date.fromisoformat(symptoms_started_on)
+    except ValueError:
+        return None
+
+    id_test_verification = body.get("id_test_verification")
+    if id_test_verification is not None and (
+        not isinstance(id_test_verification, str)
+        or not _UUID4_PATTERN.fullmatch(id_test_verification)
+    ):
+        return None
+
+    return dict(otp=otp, symptoms_started_on=parsed_date, id_test_verification=id_test_verification)
+
+
+def fast_validation(
+    parse: Callable[[Any], Optional[Dict[str, Any]]], validator: Callable[[_Handler], _Handler]
+) -> Callable[[_Handler], _Handler]:
+    """
+    Decorator validating the JSON body of the request with the given specialized parser, if
+    enabled in the configuration, falling back to the given generic validator for whatever the
+    parser does not accept.
+    The fallback makes responses to invalid requests identical to the generic validator ones.
+
+    :param parse: the parser of the JSON body, returning the handler arguments if valid, None
+      otherwise.
+    :param validator: the generic validation decorator (e.g., validate(...)).
+    :return: the decorator validating the handler.
+    """
+
+    def _decorator(handler: _Handler) -> _Handler:
+        validated = validator(handler)
+
+        @wraps(handler)
+        async def _wrapper(request: Request, *args: Any, **kwargs: Any) -> Any:
+            if config.OTP_FAST_VALIDATION_ENABLED:
+                try:
+                    parsed = parse(request.json)
+                except InvalidUsage:
+                    parsed = None
+                if parsed is not None:
+                    return await handler(request, *args, **parsed, **kwargs)
+            return await validated(request, *args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
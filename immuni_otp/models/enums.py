@@ -0,0 +1,66 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum
+
+
+class AuthorizationOutcome(Enum):
+    """
+    Enumeration of the possible outcomes of an OTP authorization.
+    """
+
+    STORED = "stored"
+    # The OTP was already authorized, with the same data (e.g., a retry).
+    DUPLICATE = "duplicate"
+    # The OTP was already authorized, with different data.
+    COLLISION = "collision"
+    INVALID = "invalid"
+    # The OTP could not be stored because the database is unreachable, and has been buffered
+    # locally, to be stored later.
+    BUFFERED = "buffered"
+    # The OTP has not been stored, because the client exceeded its rate limit.
+    RATE_LIMITED = "rate_limited"
+
+
+class StorageFormat(Enum):
+    """
+    Enumeration of the formats OTP keys and OtpData can be stored with.
+    """
+
+    # Hex SHA-256 keys and JSON values.
+    JSON = "json"
+    # Raw SHA-256 keys and fixed-layout binary values.
+    BINARY = "binary"
+
+
+class StorageBackend(Enum):
+    """
+    Enumeration of the backends OtpData can be stored on.
+    """
+
+    REDIS = "redis"
+    # The memory of each process, for single-node deployments and tests.
+    MEMORY = "memory"
+
+
+class CircuitState(Enum):
+    """
+    Enumeration of the states of a circuit breaker.
+    """
+
+    # Calls are let through.
+    CLOSED = "closed"
+    # Calls are rejected, until the cool-down elapses.
+    OPEN = "open"
+    # A single probe call is let through, to decide whether to close the breaker again.
+    HALF_OPEN = "half_open"
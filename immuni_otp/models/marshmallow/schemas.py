@@ -0,0 +1,59 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Any, Dict
+
+from marshmallow import Schema, ValidationError, post_load, validates_schema
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_common.models.marshmallow.fields import IdTestVerification, IsoDate, OtpCode
+from immuni_common.models.marshmallow.validators import OTP_LENGTH
+
+
+class OtpAuthorizationSchema(Schema):
+    """
+    Validate a single OTP authorization, as received within a batch.
+    """
+
+    otp = OtpCode()
+    symptoms_started_on = IsoDate()
+    id_test_verification = IdTestVerification()
+
+    @validates_schema
+    def validate_id_test_verification(self, data: Dict[str, Any], **kwargs: Any) -> None:
+        """
+        Ensure the id of the test is provided whenever the OTP is a CUN.
+
+        :param data: the deserialized authorization.
+        :param kwargs: the additional keyword arguments provided by marshmallow.
+        :raise: ValidationError if a CUN comes without the id of the test.
+        """
+        if len(data["otp"]) > OTP_LENGTH and data.get("id_test_verification") is None:
+            raise ValidationError("The id of the test is mandatory for a CUN.")
+
+    @post_load
+    def make_otp_data(self, data: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        """
+        Wrap the deserialized payload into the OTP and its OtpData.
+
+        :param data: the deserialized authorization.
+        :param kwargs: the additional keyword arguments provided by marshmallow.
+        :return: a dictionary with the OTP and the OtpData to store.
+        """
+        return dict(
+            otp=data["otp"],
+            otp_data=OtpData(
+                symptoms_started_on=data["symptoms_started_on"],
+                id_test_verification=data.get("id_test_verification"),
+            ),
+        )
@@ -41,3 +41,32 @@ class OtpBody:
         "service after the request.",
         required=False,
     )
+
+
+class OtpBatchBody:
+    """
+    Documentation class for /v1/otp/batch body.
+    """
+
+    otps = doc.List(
+        OtpBody,
+        description="The OTPs to authorise, each one with the same fields accepted by /v1/otp. "
+        "At most OTP_BATCH_MAX_SIZE OTPs can be authorised with a single request.",
+        required=True,
+    )
+
+
+class OtpBatchResponse:
+    """
+    Documentation class for /v1/otp/batch response.
+    """
+
+    outcomes = doc.List(
+        doc.String(),
+        description="The outcome of each OTP authorisation, in the same order as the request: "
+        "`stored` if the OTP has been authorised, `duplicate` if it was already authorised with "
+        "the same payload, `collision` if it was already authorised with a different payload, "
+        "`invalid` if it is not compliant with the schema, `rate_limited` if the HIS exceeded its "
+        "rate limit, `buffered` if it has been accepted while the database is unreachable, to be "
+        "stored as soon as it is reachable again.",
+    )
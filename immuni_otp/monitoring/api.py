@@ -0,0 +1,178 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from prometheus_client.metrics import Counter, Gauge, Histogram
+
+from immuni_common.monitoring.core import NAMESPACE, Subsystem
+
+# Buckets for the in-process stages, taking from a few microseconds to a few milliseconds.
+_CPU_BUCKETS = (0.000002, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001)
+# Buckets for the stages involving the database, taking from a fraction of a millisecond to a few
+# seconds.
+_IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+OTP_AUTHORIZATIONS = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_authorizations",
+    labelnames=("otp_type", "outcome"),
+    documentation="Number of OTP authorizations, by OTP type (otp or cun) and outcome.",
+)
+
+OTP_VALIDATION_SECONDS = Histogram(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_validation_seconds",
+    buckets=_CPU_BUCKETS + _IO_BUCKETS[3:],
+    documentation="Time spent validating the OTP authorization requests.",
+)
+
+OTP_KEY_DERIVATION_SECONDS = Histogram(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_key_derivation_seconds",
+    buckets=_CPU_BUCKETS,
+    documentation="Time spent hashing OTPs and deriving their database keys.",
+)
+
+OTP_SERIALIZATION_SECONDS = Histogram(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_serialization_seconds",
+    buckets=_CPU_BUCKETS,
+    documentation="Time spent serializing OtpData.",
+)
+
+OTP_REDIS_POOL_WAIT_SECONDS = Histogram(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_redis_pool_wait_seconds",
+    buckets=(0.0,) + _IO_BUCKETS,
+    documentation="Time spent waiting for a free Redis connection before storing an OTP.",
+)
+
+OTP_REDIS_POOL_SIZE = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_redis_pool_size",
+    labelnames=("shard",),
+    multiprocess_mode="livesum",
+    documentation="Number of open Redis connections, by shard.",
+)
+
+OTP_REDIS_POOL_FREE = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_redis_pool_free",
+    labelnames=("shard",),
+    multiprocess_mode="livesum",
+    documentation="Number of open Redis connections not in exclusive use, by shard.",
+)
+
+OTP_REDIS_POOL_WAITERS = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_redis_pool_waiters",
+    labelnames=("shard",),
+    multiprocess_mode="livesum",
+    documentation="Number of OTP stores waiting for a free Redis connection, by shard.",
+)
+
+OTP_REDIS_SECONDS = Histogram(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_redis_seconds",
+    labelnames=("command",),
+    buckets=_IO_BUCKETS,
+    documentation="Latency of the Redis commands storing OTPs, by command (store or pipeline).",
+)
+
+OTP_SHED_REQUESTS = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_shed_requests",
+    labelnames=("reason",),
+    documentation="Number of Redis calls rejected by the admission control, by reason "
+    "(in_flight or circuit_open).",
+)
+
+OTP_CIRCUIT_STATE = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_circuit_state",
+    labelnames=("state",),
+    documentation="Whether the Redis circuit breaker is in the given state (1) or not (0).",
+)
+
+OTP_BUFFERED_AUTHORIZATIONS = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_buffered_authorizations",
+    multiprocess_mode="livesum",
+    documentation="Number of authorizations buffered locally, waiting to be replayed into Redis.",
+)
+
+OTP_BUFFERED_BYTES = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_buffered_bytes",
+    multiprocess_mode="livesum",
+    documentation="Number of bytes used by the authorizations buffered locally.",
+)
+
+OTP_BUFFER_REPLAYS = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_buffer_replays",
+    labelnames=("outcome",),
+    documentation="Number of buffered authorizations replayed into Redis, by outcome (stored, "
+    "duplicate, collision, or expired).",
+)
+
+OTP_MIGRATION_MIRRORED = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_migration_mirrored",
+    labelnames=("outcome",),
+    documentation="Number of OTPs stored on the migration target Redis by the dual write, by "
+    "outcome (stored, duplicate, collision, or failed).",
+)
+
+OTP_DEADLINE_EXCEEDED = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_deadline_exceeded",
+    documentation="Number of Redis calls cancelled because the deadline of their request passed.",
+)
+
+OTP_AUDIT_QUEUED = Gauge(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_audit_queued",
+    multiprocess_mode="livesum",
+    documentation="Number of audit records waiting to be written.",
+)
+
+OTP_AUDIT_WRITTEN = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_audit_written",
+    documentation="Number of audit records written.",
+)
+
+OTP_AUDIT_DROPPED = Counter(
+    namespace=NAMESPACE,
+    subsystem=Subsystem.API.value,
+    name="otp_audit_dropped",
+    documentation="Number of audit records dropped, because the queue is full or the write failed.",
+)
@@ -11,9 +11,39 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import random
+from asyncio import AbstractEventLoop
+from typing import List, Tuple
+
+from sanic import Blueprint, Sanic
+
 from immuni_common.sanic import create_app, run_app
-from immuni_otp.apis import otp
+from immuni_otp.apis import admin, health, otp
+from immuni_otp.core import config
 from immuni_otp.core.managers import managers
+from immuni_otp.helpers.health import probe_forever, redis_health
+from immuni_otp.helpers.otp import close_store_coalescer, replay_buffered_forever
+from immuni_otp.helpers.pool import observe_pools_forever
+from immuni_otp.helpers.prefork import Supervisor, serve_worker
+from immuni_otp.helpers.storage import RedisStorage
+from immuni_otp.helpers.swagger import disable_api_docs
+from immuni_otp.models.enums import StorageBackend
+
+
+def blueprints() -> Tuple[Blueprint, ...]:
+    """
+    Return the blueprints of the application, the internal ones only if enabled in the
+    configuration, so that their routes do not exist otherwise.
+
+    :return: the blueprints to register.
+    """
+    app_blueprints: List[Blueprint] = [otp.bp]
+    if config.OTP_PROFILER_ENABLED:
+        app_blueprints.append(admin.bp)
+    if config.OTP_HEALTH_ENABLED:
+        app_blueprints.append(health.bp)
+    return tuple(app_blueprints)
+
 
 sanic_app = create_app(
     api_title="OTP Service",
@@ -28,9 +58,214 @@ sanic_app = create_app(
     "The OTP automatically expires after a defined interval. "
     "If the data has not been uploaded by the time the OTP expires, the user will have to start "
     "the process from the beginning with a new OTP.",
-    blueprints=(otp.bp,),
+    blueprints=blueprints(),
     managers=managers,
 )
+if not config.OTP_API_DOCS_ENABLED:
+    disable_api_docs(sanic_app)
+
+
+@sanic_app.listener("before_server_start")
+async def check_rate_limit(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Refuse to start with a rate limit that no client could ever comply with, if enabled in the
+    configuration.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    :raise ValueError: if rate limiting is enabled, and its rate is not positive.
+    """
+    if config.OTP_RATE_LIMIT_ENABLED and config.OTP_RATE_LIMIT_PER_SECOND <= 0:
+        raise ValueError("OTP_RATE_LIMIT_PER_SECOND must be positive if rate limiting is enabled.")
+
+
+@sanic_app.listener("after_server_start")
+async def start_buffer_replay(app: Sanic, loop: AbstractEventLoop) -> None:
+    """
+    Start replaying the authorizations buffered while the database was unreachable, including the
+    ones left by a previous process, if enabled in the configuration.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    if config.OTP_BUFFER_ENABLED:
+        app.buffer_replay = loop.create_task(
+            replay_buffered_forever(config.OTP_BUFFER_REPLAY_INTERVAL_MILLISECONDS / 1000)
+        )
+
+
+@sanic_app.listener("before_server_stop")
+async def stop_buffer_replay(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Stop replaying the buffered authorizations, if started.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    buffer_replay = getattr(app, "buffer_replay", None)
+    if buffer_replay is not None:
+        buffer_replay.cancel()
+        app.buffer_replay = None
+
+
+@sanic_app.listener("before_server_stop")
+async def stop_store_coalescing(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Flush the authorizations waiting to be coalesced, and wait for the flushes in progress.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    await close_store_coalescer()
+
+
+@sanic_app.listener("after_server_start")
+async def start_audit_flush(app: Sanic, loop: AbstractEventLoop) -> None:
+    """
+    Start writing the queued audit records in the background, if enabled in the configuration.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    audit_log = managers.otp_audit_log
+    if audit_log is not None:
+        app.audit_flush = loop.create_task(
+            audit_log.flush_forever(config.OTP_AUDIT_FLUSH_INTERVAL_MILLISECONDS / 1000)
+        )
+
+
+@sanic_app.listener("before_server_stop")
+async def stop_audit_flush(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Stop writing the audit records in the background, if started, after writing the ones queued.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    audit_flush = getattr(app, "audit_flush", None)
+    audit_log = managers.otp_audit_log
+    if audit_flush is not None and audit_log is not None:
+        audit_log.stop()
+        await audit_flush
+        app.audit_flush = None
+
+
+@sanic_app.listener("after_server_start")
+async def start_health_probe(app: Sanic, loop: AbstractEventLoop) -> None:
+    """
+    Start probing the database in the background, for the health checks, if enabled in the
+    configuration.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    if config.OTP_HEALTH_ENABLED and config.OTP_STORAGE_BACKEND == StorageBackend.REDIS:
+        app.health_probe = loop.create_task(
+            probe_forever(
+                redis_health,
+                managers.otp_redis_shards,
+                interval_seconds=config.OTP_HEALTH_PROBE_INTERVAL_MILLISECONDS / 1000,
+                timeout_seconds=config.OTP_HEALTH_PROBE_TIMEOUT_MILLISECONDS / 1000,
+            )
+        )
+
+
+@sanic_app.listener("before_server_stop")
+async def stop_health_probe(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Stop probing the database, if started, forgetting the outcome of the probes so that the worker
+    is no longer reported ready.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    health_probe = getattr(app, "health_probe", None)
+    if health_probe is not None:
+        health_probe.cancel()
+        app.health_probe = None
+        redis_health.clear()
+
+
+@sanic_app.listener("after_server_start")
+async def start_pool_sampling(app: Sanic, loop: AbstractEventLoop) -> None:
+    """
+    Start sampling the Redis connection pools in the background, if enabled in the configuration.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    if not config.OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS:
+        return
+    pools = [
+        pool
+        for storage in (managers.otp_storage, managers.otp_migration_storage)
+        if isinstance(storage, RedisStorage)
+        for pool in storage.pools
+    ]
+    if pools:
+        app.pool_sampling = loop.create_task(
+            observe_pools_forever(pools, config.OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS / 1000)
+        )
+
+
+@sanic_app.listener("before_server_stop")
+async def stop_pool_sampling(
+    app: Sanic, loop: AbstractEventLoop  # pylint: disable=unused-argument
+) -> None:
+    """
+    Stop sampling the Redis connection pools, if started.
+
+    :param app: the Sanic application.
+    :param loop: the event loop.
+    """
+    pool_sampling = getattr(app, "pool_sampling", None)
+    if pool_sampling is not None:
+        pool_sampling.cancel()
+        app.pool_sampling = None
+
+
+def run_prefork() -> None:  # pragma: no cover
+    """
+    Run the application on OTP_PREFORK_WORKERS shared-nothing worker processes, each one with its
+    own socket, event loop and database connections, replacing each worker after it has served
+    OTP_PREFORK_MAX_REQUESTS requests.
+    """
+
+    def _serve(slot: int) -> None:
+        max_requests = 0
+        if config.OTP_PREFORK_MAX_REQUESTS:
+            max_requests = config.OTP_PREFORK_MAX_REQUESTS + random.randint(  # nosec
+                0, config.OTP_PREFORK_MAX_REQUESTS_JITTER
+            )
+        serve_worker(
+            sanic_app,
+            slot=slot,
+            host=config.OTP_PREFORK_HOST,
+            port=config.OTP_PREFORK_PORT,
+            max_requests=max_requests,
+            cpu_affinity=config.OTP_PREFORK_CPU_AFFINITY,
+            graceful_timeout_seconds=config.OTP_PREFORK_GRACEFUL_TIMEOUT_SECONDS,
+        )
+
+    Supervisor(
+        workers=config.OTP_PREFORK_WORKERS,
+        target=_serve,
+        kill_timeout_seconds=config.OTP_PREFORK_GRACEFUL_TIMEOUT_SECONDS + 5,
+    ).run()
+
 
 if __name__ == "__main__":  # pragma: no cover
-    run_app(sanic_app)
+    if config.OTP_PREFORK_WORKERS:
+        run_prefork()
+    else:
+        run_app(sanic_app)
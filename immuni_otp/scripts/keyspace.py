@@ -0,0 +1,84 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Analyze the OTP keyspace of the configured Redis, without blocking it, and report as JSON the
+number of live OTP keys by storage format, the distribution of their TTLs, and the memory they use.
+
+Usage example:
+    poetry run otp-keyspace --scan-count 1000 --pause-milliseconds 10 --output keyspace.json
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.keyspace import KeyspaceReport, analyze_keyspace
+from immuni_otp.models.enums import StorageBackend
+
+
+def _default_ttl_buckets() -> List[int]:
+    """
+    Return the default TTL buckets, splitting the OTP expiration in ten.
+
+    :return: the upper bounds of the TTL buckets, in seconds.
+    """
+    return [config.OTP_EXPIRATION_SECONDS * tenth // 10 for tenth in range(1, 11)]
+
+
+async def _analyze(arguments: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Analyze the keyspace of each shard, one at a time.
+
+    :param arguments: the command line arguments.
+    :return: the report, summed across the shards.
+    """
+    report = KeyspaceReport(
+        ttl_buckets=sorted(set(arguments.ttl_buckets or _default_ttl_buckets()))
+    )
+    await managers.initialize()
+    try:
+        for redis in managers.otp_redis_shards:
+            await analyze_keyspace(
+                redis,
+                report,
+                scan_count=arguments.scan_count,
+                pause_seconds=arguments.pause_milliseconds / 1000,
+            )
+    finally:
+        await managers.teardown()
+    return dict(shards=len(config.OTP_CACHE_REDIS_URLS), **report.as_dict())
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Parse the command line arguments, analyze the keyspace and write the JSON report.
+
+    :param argv: the command line arguments, defaulting to the ones of the process.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scan-count", type=int, default=1000)
+    parser.add_argument("--pause-milliseconds", type=int, default=0)
+    parser.add_argument("--ttl-buckets", type=int, nargs="+")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    arguments = parser.parse_args(argv)
+    if config.OTP_STORAGE_BACKEND != StorageBackend.REDIS:
+        parser.error("The keyspace can only be analyzed with the redis storage backend.")
+
+    report = asyncio.get_event_loop().run_until_complete(_analyze(arguments))
+    json.dump(report, arguments.output, indent=2)
+    arguments.output.write("\n")
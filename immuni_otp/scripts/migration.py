@@ -0,0 +1,108 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+Migrate the live OTPs of the configured Redis to the Redis configured with
+OTP_MIGRATION_REDIS_URLS, without downtime.
+
+The cutover is performed as follows:
+    1. Set OTP_MIGRATION_REDIS_URLS on every process storing or consuming OTPs, so that each OTP
+       is also stored on (and consumed from) the target Redis. The OTPs consumed leave a
+       tombstone on the target.
+    2. Once step 1 is complete, export the OTPs stored before, and import them, never
+       overwriting the dual-written ones, nor restoring the ones consumed since the export:
+        poetry run otp-migration export --output otps.bin
+        poetry run otp-migration import --input otps.bin
+    3. Point OTP_CACHE_REDIS_URLS to the target Redis, and unset OTP_MIGRATION_REDIS_URLS.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import Dict, Optional, Sequence, cast
+
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.migration import export_keys, import_records, read_records, write_header
+from immuni_otp.helpers.storage import RedisStorage
+from immuni_otp.models.enums import StorageBackend
+
+
+async def _export(arguments: argparse.Namespace) -> Dict[str, int]:
+    """
+    Export the OTPs of each shard, one at a time.
+
+    :param arguments: the command line arguments.
+    :return: the number of exported OTPs.
+    """
+    await managers.initialize()
+    try:
+        with arguments.output:
+            write_header(arguments.output)
+            exported = 0
+            for redis in managers.otp_redis_shards:
+                exported += await export_keys(
+                    redis,
+                    arguments.output,
+                    scan_count=arguments.scan_count,
+                    pause_seconds=arguments.pause_milliseconds / 1000,
+                )
+    finally:
+        await managers.teardown()
+    return dict(exported=exported)
+
+
+async def _import(arguments: argparse.Namespace) -> Dict[str, int]:
+    """
+    Import the exported OTPs into the migration target.
+
+    :param arguments: the command line arguments.
+    :return: the number of OTPs restored, existing, consumed and expired.
+    """
+    await managers.initialize()
+    try:
+        # The target is always configured, as checked before initializing the managers.
+        storage = cast(RedisStorage, managers.otp_migration_storage)
+        with arguments.input:
+            return await import_records(
+                storage, read_records(arguments.input), batch_size=arguments.batch_size
+            )
+    finally:
+        await managers.teardown()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Parse the command line arguments, run the export or the import, and write the JSON summary.
+
+    :param argv: the command line arguments, defaulting to the ones of the process.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--output", type=argparse.FileType("wb"), required=True)
+    export_parser.add_argument("--scan-count", type=int, default=1000)
+    export_parser.add_argument("--pause-milliseconds", type=int, default=0)
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("--input", type=argparse.FileType("rb"), required=True)
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    arguments = parser.parse_args(argv)
+    if config.OTP_STORAGE_BACKEND != StorageBackend.REDIS:
+        parser.error("The OTPs can only be migrated with the redis storage backend.")
+    if arguments.command == "import" and not config.OTP_MIGRATION_REDIS_URLS:
+        parser.error("The OTPs can only be imported with OTP_MIGRATION_REDIS_URLS set.")
+
+    run = _export if arguments.command == "export" else _import
+    summary = asyncio.get_event_loop().run_until_complete(run(arguments))
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
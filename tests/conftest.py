@@ -11,8 +11,14 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+from typing import List
+
+from _pytest.nodes import Item
+from pytest import mark
+
 from immuni_common.helpers.tests import check_environment, check_redis_url
 from immuni_otp.core import config
+from immuni_otp.models.enums import StorageBackend
 
 # noinspection PyUnresolvedReferences
 from tests.fixtures.core import *  # noqa isort:skip
@@ -21,4 +27,19 @@ from tests.fixtures.core import *  # noqa isort:skip
 from immuni_common.helpers.tests import monitoring_setup  # noqa isort:skip
 
 check_environment()
-check_redis_url(config.OTP_CACHE_REDIS_URL, "OTP_CACHE_REDIS_URL")
+if config.OTP_STORAGE_BACKEND == StorageBackend.REDIS:
+    check_redis_url(config.OTP_CACHE_REDIS_URL, "OTP_CACHE_REDIS_URL")
+    for url in config.OTP_CACHE_REDIS_URLS:
+        check_redis_url(url, "OTP_CACHE_REDIS_URLS")
+
+
+def pytest_collection_modifyitems(items: List[Item]) -> None:
+    """
+    Skip the tests relying on Redis if OtpData are stored on a different backend.
+    """
+    if config.OTP_STORAGE_BACKEND == StorageBackend.REDIS:
+        return
+    skip_redis = mark.skip(reason="OtpData are not stored on Redis.")
+    for item in items:
+        if item.get_closest_marker("redis"):
+            item.add_marker(skip_redis)
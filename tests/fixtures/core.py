@@ -19,12 +19,16 @@ from pytest_sanic.utils import TestClient
 from sanic import Sanic
 
 from immuni_common.helpers.tests import create_no_expired_keys_fixture
+from immuni_otp.core import config
 from immuni_otp.core.managers import managers
+from immuni_otp.helpers.otp import _recent_otps
+from immuni_otp.models.enums import StorageBackend
 
 
 @fixture(autouse=True)
 async def cleanup(client: TestClient, ensure_no_unexpired_keys: AsyncGenerator[None, None]) -> None:
-    await managers.otp_redis.flushall()
+    await managers.otp_storage.flush()
+    _recent_otps.clear()
 
 
 @fixture
@@ -50,4 +54,5 @@ def client(
 
 @fixture(autouse=True)
 def ensure_no_unexpired_keys(sanic: Sanic) -> None:
-    create_no_expired_keys_fixture(managers.otp_redis)
+    if config.OTP_STORAGE_BACKEND == StorageBackend.REDIS:
+        create_no_expired_keys_fixture(managers.otp_redis)
@@ -0,0 +1,58 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from asyncio import AbstractEventLoop
+from http import HTTPStatus
+from typing import Awaitable, Callable
+from unittest.mock import patch
+
+from pytest import fixture, mark
+from pytest_sanic.utils import TestClient
+from sanic import Sanic
+
+from immuni_otp.apis import admin
+from immuni_otp.core import config
+
+_URI = "/v1/admin/profile"
+
+
+@fixture
+def admin_client(
+    loop: AbstractEventLoop, sanic_custom_client: Callable[[Sanic], Awaitable]
+) -> TestClient:
+    # The blueprint is only registered on the application if the profiler is enabled.
+    app = Sanic("test_admin")
+    app.blueprint(admin.bp)
+    return loop.run_until_complete(sanic_custom_client(app))
+
+
+async def test_profile_disabled(client: TestClient) -> None:
+    response = await client.get(_URI)
+    assert response.status == HTTPStatus.NOT_FOUND.value
+
+
+async def test_profile(admin_client: TestClient) -> None:
+    response = await admin_client.get(_URI, params={"seconds": "1"})
+    assert response.status == HTTPStatus.OK.value
+    assert response.headers.get("X-Worker-Pid") == str(os.getpid())
+    assert response.headers.get("Cache-Control") == "no-store"
+    collapsed = await response.text()
+    assert collapsed.startswith(("cpu;", "idle;", "await;"))
+
+
+@mark.parametrize("seconds", ["0", "-1", "1.5", "invalid", "61"])
+async def test_profile_invalid_seconds(admin_client: TestClient, seconds: str) -> None:
+    with patch.object(config, "OTP_PROFILER_MAX_SECONDS", 60):
+        response = await admin_client.get(_URI, params={"seconds": seconds})
+    assert response.status == HTTPStatus.BAD_REQUEST.value
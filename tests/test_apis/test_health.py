@@ -0,0 +1,98 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from asyncio import AbstractEventLoop
+from http import HTTPStatus
+from typing import Awaitable, Callable
+from unittest.mock import patch
+
+from pytest import fixture, mark
+from pytest_sanic.utils import TestClient
+from sanic import Sanic
+
+from immuni_otp.apis import health
+from immuni_otp.core import config
+from immuni_otp.helpers.health import HealthState, ProbeResult
+from immuni_otp.models.enums import StorageBackend
+
+
+def _health(failed: bool) -> HealthState:
+    state = HealthState(
+        window_size=1, max_latency_seconds=0.1, max_failure_rate=0.5, max_age_seconds=3
+    )
+    state.record(
+        ProbeResult(
+            probed_at=time.monotonic(),
+            latency_seconds=0.01,
+            failed=failed,
+            pool_size=2,
+            pool_free=2,
+        )
+    )
+    return state
+
+
+@fixture
+def health_client(
+    loop: AbstractEventLoop, sanic_custom_client: Callable[[Sanic], Awaitable]
+) -> TestClient:
+    # The blueprint is only registered on the application if the health checks are enabled.
+    app = Sanic("test_health")
+    app.blueprint(health.bp)
+    return loop.run_until_complete(sanic_custom_client(app))
+
+
+@mark.parametrize("uri", ["/health/live", "/health/ready"])
+async def test_health_disabled(client: TestClient, uri: str) -> None:
+    response = await client.get(uri)
+    assert response.status == HTTPStatus.NOT_FOUND.value
+
+
+async def test_live(health_client: TestClient) -> None:
+    response = await health_client.get("/health/live")
+    assert response.status == HTTPStatus.OK.value
+    assert response.headers.get("Cache-Control") == "no-store"
+    assert await response.json() == dict(alive=True)
+
+
+@mark.parametrize(
+    "failed, status", [(False, HTTPStatus.OK), (True, HTTPStatus.SERVICE_UNAVAILABLE)]
+)
+async def test_ready(health_client: TestClient, failed: bool, status: HTTPStatus) -> None:
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.REDIS), patch(
+        "immuni_otp.apis.health.redis_health", _health(failed)
+    ):
+        response = await health_client.get("/health/ready")
+    assert response.status == status.value
+    assert response.headers.get("Cache-Control") == "no-store"
+    report = await response.json()
+    assert report["ready"] is not failed
+    assert report["reason"] == ("failing" if failed else None)
+
+
+async def test_ready_not_probed(health_client: TestClient) -> None:
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.REDIS), patch(
+        "immuni_otp.apis.health.redis_health", _health(False)
+    ) as redis_health:
+        redis_health.clear()
+        response = await health_client.get("/health/ready")
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE.value
+    assert await response.json() == dict(ready=False, reason="not_probed")
+
+
+async def test_ready_memory(health_client: TestClient) -> None:
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.MEMORY):
+        response = await health_client.get("/health/ready")
+    assert response.status == HTTPStatus.OK.value
+    assert await response.json() == dict(ready=True, reason=None)
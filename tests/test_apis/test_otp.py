@@ -11,14 +11,31 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import json
 from datetime import date
+from hashlib import sha256
 from http import HTTPStatus
+from pathlib import Path
+from typing import Iterator, List, Optional
 from unittest.mock import patch
 
-from pytest import mark
+from pytest import fixture, mark
 from pytest_sanic.utils import TestClient
 
-from immuni_common.core.exceptions import ApiException, SchemaValidationException
+from immuni_common.core.exceptions import (
+    ApiException,
+    OtpCollisionException,
+    SchemaValidationException,
+)
+from immuni_otp.core import config
+from immuni_otp.core.exceptions import (
+    DeadlineExceededException,
+    ServiceUnavailableException,
+    TooManyRequestsException,
+)
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.audit import AuditLog
+from immuni_otp.models.enums import AuthorizationOutcome
 
 _URI = "/v1/otp"
 _VALID_JSON = {
@@ -100,6 +117,96 @@ async def test_otp_store_failure(client: TestClient, json_body: dict) -> None:
         manager_store.assert_called_once()
 
 
+@mark.parametrize("json_body", [_VALID_JSON, _VALID_JSON_SHA])
+async def test_otp_service_unavailable(client: TestClient, json_body: dict) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store",
+        side_effect=ServiceUnavailableException(retry_after=3),
+        autospec=True,
+        spec_set=True,
+    ):
+        response = await client.post(uri=_URI, json=json_body, headers=CONTENT_TYPE_HEADER)
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE.value
+    assert response.headers.get("Retry-After") == "3"
+    assert await response.json() == {
+        "error_code": ServiceUnavailableException.error_code,
+        "message": ServiceUnavailableException.error_message,
+    }
+
+
+async def test_otp_deadline_exceeded(client: TestClient) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store",
+        side_effect=DeadlineExceededException(),
+        autospec=True,
+        spec_set=True,
+    ) as manager_store:
+        response = await client.post(
+            uri=_URI,
+            json=_VALID_JSON,
+            headers={**CONTENT_TYPE_HEADER, config.OTP_REQUEST_TIMEOUT_HEADER: "100"},
+        )
+    assert manager_store.call_args.kwargs["deadline"] is not None
+    assert response.status == HTTPStatus.GATEWAY_TIMEOUT.value
+    assert response.headers.get("Retry-After") == "1"
+    assert await response.json() == {
+        "error_code": DeadlineExceededException.error_code,
+        "message": DeadlineExceededException.error_message,
+    }
+
+
+async def test_otp_rate_limited(client: TestClient) -> None:
+    with patch.object(config, "OTP_RATE_LIMIT_ENABLED", True), patch(
+        "immuni_otp.apis.otp.store",
+        side_effect=TooManyRequestsException(retry_after=2),
+        autospec=True,
+        spec_set=True,
+    ) as manager_store:
+        response = await client.post(
+            uri=_URI,
+            json=_VALID_JSON,
+            headers={**CONTENT_TYPE_HEADER, config.OTP_RATE_LIMIT_CLIENT_HEADER: "his-1"},
+        )
+    assert manager_store.call_args.kwargs["client"] == "his-1"
+    assert response.status == HTTPStatus.TOO_MANY_REQUESTS.value
+    assert response.headers.get("Retry-After") == "2"
+    assert await response.json() == {
+        "error_code": TooManyRequestsException.error_code,
+        "message": TooManyRequestsException.error_message,
+    }
+
+
+@mark.parametrize(
+    "body",
+    [
+        json.dumps(_VALID_JSON),
+        json.dumps(_VALID_JSON_SHA),
+        json.dumps({**_VALID_JSON_SHA, "otp": _VALID_JSON_SHA["otp"].upper()}),
+        json.dumps({**_VALID_JSON, "otp": "KJ23IWY5UA"}),
+        json.dumps({**_VALID_JSON, "symptoms_started_on": "2020-02-30"}),
+        json.dumps(_INVALID_JSON),
+        json.dumps({"invalid": "json"}),
+        "{",
+    ],
+)
+async def test_otp_fast_validation(client: TestClient, body: str) -> None:
+    responses = []
+    for enabled in (False, True):
+        with patch.object(config, "OTP_FAST_VALIDATION_ENABLED", enabled), patch(
+            "immuni_otp.apis.otp.store", autospec=True, spec_set=True
+        ) as manager_store:
+            response = await client.post(uri=_URI, data=body, headers=CONTENT_TYPE_HEADER)
+            responses.append(
+                (
+                    response.status,
+                    await response.read(),
+                    response.headers.get("Cache-Control"),
+                    manager_store.call_args,
+                )
+            )
+    assert responses[0] == responses[1]
+
+
 async def test_otp_invalid_length(client: TestClient) -> None:
     response = await client.post(uri=_URI, json=_INVALID_JSON, headers=CONTENT_TYPE_HEADER)
     assert response.status == HTTPStatus.BAD_REQUEST.value
@@ -107,3 +214,220 @@ async def test_otp_invalid_length(client: TestClient) -> None:
         "error_code": SchemaValidationException.error_code,
         "message": SchemaValidationException.error_message,
     }
+
+
+_BATCH_URI = "/v1/otp/batch"
+
+
+async def test_otp_batch_success(client: TestClient) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store_many",
+        autospec=True,
+        spec_set=True,
+        return_value=[AuthorizationOutcome.STORED, AuthorizationOutcome.COLLISION],
+    ) as manager_store_many:
+        response = await client.post(
+            uri=_BATCH_URI,
+            json={"otps": [_VALID_JSON, _INVALID_JSON, {"invalid": "json"}, _VALID_JSON_SHA]},
+            headers=CONTENT_TYPE_HEADER,
+        )
+        assert response.status == HTTPStatus.OK.value
+        assert response.headers.get("Cache-Control") == "no-store"
+        assert await response.json() == {"outcomes": ["stored", "invalid", "invalid", "collision"]}
+        manager_store_many.assert_called_once()
+        ((otps,), _) = manager_store_many.call_args
+        assert [otp for otp, _ in otps] == [_VALID_JSON["otp"], _VALID_JSON_SHA["otp"]]
+
+
+async def test_otp_batch_stores(client: TestClient) -> None:
+    other_json = {**_VALID_JSON, "symptoms_started_on": "2020-12-10"}
+    response = await client.post(
+        uri=_BATCH_URI,
+        json={"otps": [_VALID_JSON, _VALID_JSON, other_json]},
+        headers=CONTENT_TYPE_HEADER,
+    )
+    assert response.status == HTTPStatus.OK.value
+    assert await response.json() == {"outcomes": ["stored", "duplicate", "collision"]}
+
+
+@mark.parametrize("json_body", [{}, {"otps": []}, {"otps": _VALID_JSON}])
+async def test_otp_batch_invalid_json(client: TestClient, json_body: dict) -> None:
+    response = await client.post(uri=_BATCH_URI, json=json_body, headers=CONTENT_TYPE_HEADER)
+    assert response.status == HTTPStatus.BAD_REQUEST.value
+    assert await response.json() == {
+        "error_code": SchemaValidationException.error_code,
+        "message": SchemaValidationException.error_message,
+    }
+
+
+async def test_otp_batch_too_large(client: TestClient) -> None:
+    with patch("immuni_otp.apis.otp.store_many", autospec=True, spec_set=True) as store_many:
+        response = await client.post(
+            uri=_BATCH_URI,
+            json={"otps": [_VALID_JSON] * (config.OTP_BATCH_MAX_SIZE + 1)},
+            headers=CONTENT_TYPE_HEADER,
+        )
+        assert response.status == HTTPStatus.BAD_REQUEST.value
+        store_many.assert_not_called()
+
+
+async def test_otp_batch_service_unavailable(client: TestClient) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store_many",
+        side_effect=ServiceUnavailableException(),
+        autospec=True,
+        spec_set=True,
+    ):
+        response = await client.post(
+            uri=_BATCH_URI, json={"otps": [_VALID_JSON]}, headers=CONTENT_TYPE_HEADER
+        )
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE.value
+    assert response.headers.get("Retry-After") == "1"
+
+
+@mark.redis
+async def test_otp_batch_rate_limited(client: TestClient) -> None:
+    with patch.object(config, "OTP_RATE_LIMIT_ENABLED", True), patch.object(
+        config, "OTP_RATE_LIMIT_BURST", 1
+    ):
+        response = await client.post(
+            uri=_BATCH_URI,
+            json={"otps": [_VALID_JSON_SHA, _VALID_JSON]},
+            headers=CONTENT_TYPE_HEADER,
+        )
+    assert response.status == HTTPStatus.OK.value
+    assert await response.json() == {"outcomes": ["stored", "rate_limited"]}
+
+
+@fixture
+def audit_log(tmp_path: Path) -> Iterator[AuditLog]:
+    otp_audit_log = AuditLog(
+        str(tmp_path), queue_size=10, batch_size=10, max_file_bytes=1024 * 1024
+    )
+    with patch.object(managers, "_otp_audit_log", otp_audit_log):
+        yield otp_audit_log
+    otp_audit_log.close()
+
+
+async def _audited(audit_log: AuditLog, directory: Path) -> List[dict]:
+    await audit_log.flush()
+    return [
+        json.loads(line)
+        for path in sorted(directory.iterdir())
+        for line in path.read_text().splitlines()
+    ]
+
+
+@mark.parametrize(
+    "side_effect, outcome",
+    [
+        (None, "stored"),
+        (OtpCollisionException(), "collision"),
+        (ServiceUnavailableException(), "shed"),
+        (DeadlineExceededException(), "deadline_exceeded"),
+        (Exception(), "error"),
+    ],
+)
+async def test_otp_audited(
+    client: TestClient,
+    audit_log: AuditLog,
+    tmp_path: Path,
+    side_effect: Optional[Exception],
+    outcome: str,
+) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store",
+        autospec=True,
+        spec_set=True,
+        return_value=AuthorizationOutcome.STORED,
+        side_effect=side_effect,
+    ):
+        await client.post(
+            uri=_URI,
+            json=_VALID_JSON,
+            headers={**CONTENT_TYPE_HEADER, config.OTP_RATE_LIMIT_CLIENT_HEADER: "his"},
+        )
+    (record,) = await _audited(audit_log, tmp_path)
+    assert record["otp_sha"] == sha256(_VALID_JSON["otp"].encode("utf-8")).hexdigest()
+    assert record["client"] == "his"
+    assert record["outcome"] == outcome
+    assert record["validation_ms"] > 0
+    assert record["store_ms"] > 0
+
+
+async def test_otp_batch_audited(client: TestClient, audit_log: AuditLog, tmp_path: Path) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store_many",
+        autospec=True,
+        spec_set=True,
+        return_value=[AuthorizationOutcome.STORED, AuthorizationOutcome.DUPLICATE],
+    ):
+        await client.post(
+            uri=_BATCH_URI,
+            json={"otps": [_VALID_JSON, _INVALID_JSON, _VALID_JSON_SHA]},
+            headers=CONTENT_TYPE_HEADER,
+        )
+    records = await _audited(audit_log, tmp_path)
+    # The invalid authorizations are audited as soon as validated.
+    assert [record["otp_sha"] for record in records] == [
+        _INVALID_JSON["otp"],
+        sha256(_VALID_JSON["otp"].encode("utf-8")).hexdigest(),
+        _VALID_JSON_SHA["otp"],
+    ]
+    assert [record["outcome"] for record in records] == ["invalid", "stored", "duplicate"]
+    assert records[0]["store_ms"] == 0
+    assert all(record["client"] is None for record in records)
+
+
+@mark.parametrize(
+    "body, otp_sha",
+    [
+        (json.dumps(_INVALID_JSON), _INVALID_JSON["otp"]),
+        (
+            json.dumps({**_VALID_JSON, "otp": "KJ23IWY5UA"}),
+            sha256("KJ23IWY5UA".encode("utf-8")).hexdigest(),
+        ),
+        (
+            json.dumps({**_VALID_JSON, "otp": "KJ23IWY5UJ" * 100}),
+            sha256(("KJ23IWY5UJ" * 100).encode("utf-8")).hexdigest(),
+        ),
+        (json.dumps({**_VALID_JSON, "otp": 42}), ""),
+        (json.dumps({"invalid": "json"}), ""),
+        ("{", ""),
+    ],
+)
+async def test_otp_audited_invalid(
+    client: TestClient, audit_log: AuditLog, tmp_path: Path, body: str, otp_sha: str
+) -> None:
+    with patch("immuni_otp.apis.otp.store", autospec=True, spec_set=True) as manager_store:
+        response = await client.post(
+            uri=_URI,
+            data=body,
+            headers={**CONTENT_TYPE_HEADER, config.OTP_RATE_LIMIT_CLIENT_HEADER: "his"},
+        )
+    assert response.status == HTTPStatus.BAD_REQUEST.value
+    manager_store.assert_not_called()
+    (record,) = await _audited(audit_log, tmp_path)
+    assert record["otp_sha"] == otp_sha
+    assert record["client"] == "his"
+    assert record["outcome"] == "invalid"
+    assert record["validation_ms"] > 0
+    assert record["store_ms"] == 0
+
+
+async def test_otp_batch_audited_failure(
+    client: TestClient, audit_log: AuditLog, tmp_path: Path
+) -> None:
+    with patch(
+        "immuni_otp.apis.otp.store_many",
+        side_effect=DeadlineExceededException(),
+        autospec=True,
+        spec_set=True,
+    ):
+        await client.post(
+            uri=_BATCH_URI,
+            json={"otps": [_VALID_JSON, _VALID_JSON_SHA]},
+            headers=CONTENT_TYPE_HEADER,
+        )
+    records = await _audited(audit_log, tmp_path)
+    assert [record["outcome"] for record in records] == ["deadline_exceeded"] * 2
@@ -0,0 +1,301 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from pathlib import Path
+from random import Random
+from typing import AsyncIterator, Tuple
+from urllib.parse import urlsplit
+from unittest.mock import patch
+
+from aioredis import create_redis_pool
+from pytest import fixture, mark, raises
+from pytest_sanic.utils import TestClient
+
+from benchmarks.core import BenchmarkResult
+from benchmarks.faults import run_fault
+from benchmarks.proxy import Faults, FaultyRedisProxy, constant, lognormal
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.helpers.sharding import HashRing, shard_nodes
+from immuni_otp.helpers.storage import RedisStorage
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def _echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+@fixture
+async def echo_proxy() -> AsyncIterator[FaultyRedisProxy]:
+    server = await asyncio.start_server(_echo, host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    proxy = FaultyRedisProxy(f"redis://127.0.0.1:{port}/1", Random(0))
+    await proxy.start()
+    yield proxy
+    await proxy.close()
+    server.close()
+    await server.wait_closed()
+
+
+async def _connect(proxy: FaultyRedisProxy) -> _Connection:
+    return await asyncio.open_connection("127.0.0.1", urlsplit(proxy.url).port)
+
+
+async def _round_trip(connection: _Connection, data: bytes) -> bytes:
+    reader, writer = connection
+    writer.write(data)
+    received = b""
+    try:
+        while len(received) < len(data):
+            chunk = await reader.read(1024)
+            if not chunk:
+                break
+            received += chunk
+    except ConnectionError:
+        pass
+    return received
+
+
+def test_lognormal() -> None:
+    distribution = lognormal(0.001, sigma=1.5, random=Random(0))
+    latencies = sorted(distribution() for _ in range(1000))
+    assert latencies[0] > 0
+    assert latencies[990] > 10 * latencies[500]
+    assert constant(0.5)() == 0.5
+
+
+async def test_proxy_url(echo_proxy: FaultyRedisProxy) -> None:
+    assert echo_proxy.url.startswith("redis://127.0.0.1:")
+    assert echo_proxy.url.endswith("/1")
+    proxy = FaultyRedisProxy("redis://:secret@redis:6380/2?timeout=1")
+    with raises(RuntimeError):
+        proxy.url
+    await proxy.start()
+    assert proxy.url.startswith("redis://:secret@127.0.0.1:")
+    assert proxy.url.endswith("/2?timeout=1")
+    await proxy.close()
+    await proxy.close()
+
+
+async def test_proxy_forwards(echo_proxy: FaultyRedisProxy) -> None:
+    connection = await _connect(echo_proxy)
+    assert await _round_trip(connection, b"PING") == b"PING"
+    assert await _round_trip(connection, b"PONG") == b"PONG"
+    connection[1].close()
+
+
+async def test_proxy_latency(echo_proxy: FaultyRedisProxy) -> None:
+    echo_proxy.faults = Faults(latency=constant(0.05))
+    connection = await _connect(echo_proxy)
+    started_at = time.perf_counter()
+    assert await _round_trip(connection, b"PING") == b"PING"
+    assert time.perf_counter() - started_at >= 0.05
+    connection[1].close()
+
+
+async def test_proxy_reset(echo_proxy: FaultyRedisProxy) -> None:
+    echo_proxy.faults = Faults(reset_probability=1)
+    assert await _round_trip(await _connect(echo_proxy), b"PING") == b""
+
+
+async def test_proxy_slow_reads(echo_proxy: FaultyRedisProxy) -> None:
+    echo_proxy.faults = Faults(read_bytes_per_second=200)
+    connection = await _connect(echo_proxy)
+    started_at = time.perf_counter()
+    assert await _round_trip(connection, b"0123456789") == b"0123456789"
+    assert time.perf_counter() - started_at >= 0.04
+    connection[1].close()
+
+
+async def test_proxy_outage(echo_proxy: FaultyRedisProxy) -> None:
+    connection = await _connect(echo_proxy)
+    assert await _round_trip(connection, b"PING") == b"PING"
+    echo_proxy.start_outage()
+    assert await _round_trip(connection, b"PING") == b""
+    assert await _round_trip(await _connect(echo_proxy), b"PING") == b""
+    echo_proxy.end_outage()
+    assert await _round_trip(await _connect(echo_proxy), b"PING") == b"PING"
+    await echo_proxy.outage(0.01)
+    assert await _round_trip(await _connect(echo_proxy), b"PING") == b"PING"
+
+
+async def test_proxy_upstream_unreachable() -> None:
+    server = await asyncio.start_server(_echo, host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    proxy = FaultyRedisProxy(f"redis://127.0.0.1:{port}")
+    await proxy.start()
+    assert await _round_trip(await _connect(proxy), b"PING") == b""
+    await proxy.close()
+
+
+@fixture
+async def redis_proxy(client: TestClient) -> AsyncIterator[FaultyRedisProxy]:
+    proxy = FaultyRedisProxy(config.OTP_CACHE_REDIS_URLS[0], Random(0))
+    await proxy.start()
+    redis = await create_redis_pool(
+        address=proxy.url,
+        encoding="utf-8",
+        minsize=config.OTP_CACHE_REDIS_MIN_CONNECTIONS,
+        maxsize=config.OTP_CACHE_REDIS_MAX_CONNECTIONS,
+    )
+    storage = RedisStorage(
+        shards=(redis,),
+        ring=HashRing(nodes=shard_nodes(1), virtual_nodes=config.OTP_CACHE_REDIS_VIRTUAL_NODES),
+    )
+    with patch.object(managers, "_otp_redis", redis), patch.object(
+        managers, "_otp_redis_shards", (redis,)
+    ), patch.object(managers, "_otp_storage", storage):
+        yield proxy
+    redis.close()
+    await redis.wait_closed()
+    await proxy.close()
+
+
+_CONCURRENCY = 10
+# The slowdown tolerated compared to the healthy baseline, and the margin added to the latencies:
+# generous, so that only the regressions by an order of magnitude are caught, rather than the
+# noise of the machine running the tests.
+_SLOWDOWN = 10
+_MARGIN_MS = 100.0
+
+
+async def _run(
+    name: str, proxy: FaultyRedisProxy, client: TestClient, operations: int = 200
+) -> BenchmarkResult:
+    return await run_fault(
+        name, proxy, client, operations, _CONCURRENCY, cun_ratio=0.1, random=Random(0)
+    )
+
+
+@fixture
+async def baseline(client: TestClient, redis_proxy: FaultyRedisProxy) -> BenchmarkResult:
+    return await _run("healthy", redis_proxy, client)
+
+
+def _assert_close_to(
+    result: BenchmarkResult, baseline: BenchmarkResult, added_ms: float = 0.0
+) -> None:
+    # Each request waits for the latency added to its round trips to Redis, at most added_ms, so
+    # that the throughput cannot exceed the concurrency over it.
+    expected_throughput = baseline.throughput
+    if added_ms:
+        expected_throughput = min(expected_throughput, _CONCURRENCY * 1000 / added_ms)
+    assert result.throughput > expected_throughput / _SLOWDOWN
+    assert result.p99 < (baseline.p99 + added_ms) * _SLOWDOWN + _MARGIN_MS
+
+
+@mark.redis
+async def test_healthy(baseline: BenchmarkResult) -> None:
+    assert baseline.errors == 0
+    assert baseline.throughput > 0
+    assert baseline.p99 < 500
+
+
+@mark.redis
+async def test_latency(
+    client: TestClient, redis_proxy: FaultyRedisProxy, baseline: BenchmarkResult
+) -> None:
+    result = await _run("latency", redis_proxy, client)
+    assert result.errors == 0
+    assert result.p50 >= 5
+    _assert_close_to(result, baseline, added_ms=5)
+    # The faults are removed afterwards.
+    assert redis_proxy.faults.latency() == 0
+
+
+@mark.redis
+async def test_long_tail(
+    client: TestClient, redis_proxy: FaultyRedisProxy, baseline: BenchmarkResult
+) -> None:
+    result = await _run("long_tail", redis_proxy, client)
+    assert result.errors == 0
+    assert result.p99 > result.p50
+    # The 99th percentile of the added latency is about 33 ms.
+    _assert_close_to(result, baseline, added_ms=33)
+
+
+@mark.redis
+async def test_resets(
+    client: TestClient, redis_proxy: FaultyRedisProxy, baseline: BenchmarkResult
+) -> None:
+    result = await _run("resets", redis_proxy, client)
+    assert result.errors < result.operations / 2
+    # Resetting every round trip, rather than a random share, fails all the requests.
+    redis_proxy.faults = Faults(reset_probability=1)
+    result = await _run("healthy", redis_proxy, client, operations=20)
+    assert result.errors == result.operations
+    redis_proxy.faults = Faults()
+    # The pool reconnects as soon as the resets stop.
+    recovered = await _run("healthy", redis_proxy, client)
+    assert recovered.errors == 0
+    _assert_close_to(recovered, baseline)
+
+
+@mark.redis
+async def test_slow_reads(
+    client: TestClient, redis_proxy: FaultyRedisProxy, baseline: BenchmarkResult
+) -> None:
+    result = await _run("slow_reads", redis_proxy, client)
+    assert result.errors == 0
+    assert result.p50 >= 3
+    # The replies of a few bytes each, possibly pipelined on the same connection, are read in
+    # tens of milliseconds.
+    _assert_close_to(result, baseline, added_ms=50)
+
+
+@mark.redis
+async def test_failover(
+    client: TestClient, redis_proxy: FaultyRedisProxy, baseline: BenchmarkResult
+) -> None:
+    # The outage is driven directly, rather than by the failover scenario, so that it is ongoing
+    # for the whole run, whatever the speed of the machine running the tests.
+    redis_proxy.start_outage()
+    # The requests fail while the outage is still ongoing, rather than waiting for it to end,
+    # which would otherwise never happen: the timeout only keeps a regression from hanging.
+    result = await asyncio.wait_for(_run("healthy", redis_proxy, client, operations=20), timeout=60)
+    assert result.errors == result.operations
+    redis_proxy.end_outage()
+    # The pool reconnects as soon as the outage ends.
+    recovered = await _run("healthy", redis_proxy, client)
+    assert recovered.errors == 0
+    _assert_close_to(recovered, baseline)
+
+
+@mark.redis
+async def test_failover_buffered(
+    client: TestClient, redis_proxy: FaultyRedisProxy, tmp_path: Path
+) -> None:
+    buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=1024 * 1024)
+    redis_proxy.start_outage()
+    with patch.object(managers, "_otp_buffer", buffer):
+        result = await asyncio.wait_for(
+            _run("healthy", redis_proxy, client, operations=20), timeout=60
+        )
+    redis_proxy.end_outage()
+    buffer.close()
+    assert result.errors == 0
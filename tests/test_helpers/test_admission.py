@@ -0,0 +1,225 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import List
+
+from pytest import fixture, raises
+
+from immuni_otp.core.exceptions import ServiceUnavailableException
+from immuni_otp.helpers.admission import Admission, CircuitBreaker, InFlightLimiter
+from immuni_otp.models.enums import CircuitState
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@fixture
+def clock() -> _Clock:
+    return _Clock()
+
+
+@fixture
+def breaker(clock: _Clock) -> CircuitBreaker:
+    return CircuitBreaker(
+        window_size=10,
+        min_calls=4,
+        failure_rate_threshold=0.5,
+        slow_call_seconds=0.1,
+        slow_call_rate_threshold=0.75,
+        open_seconds=5,
+        clock=clock,
+    )
+
+
+def test_limiter() -> None:
+    limiter = InFlightLimiter(max_in_flight=2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.in_flight == 2
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+def _call(breaker: CircuitBreaker, seconds: float, failed: bool) -> None:
+    call = breaker.allow()
+    assert call is not None
+    breaker.record(call, seconds=seconds, failed=failed)
+
+
+def test_breaker_stays_closed_below_min_calls(breaker: CircuitBreaker) -> None:
+    for _ in range(3):
+        _call(breaker, seconds=0.01, failed=True)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_breaker_opens_on_failures(breaker: CircuitBreaker, clock: _Clock) -> None:
+    for failed in (False, True, False, True):
+        _call(breaker, seconds=0.01, failed=failed)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.allow() is None
+    clock.now += 1.5
+    assert breaker.retry_after == 4
+
+
+def test_breaker_opens_on_slow_calls(breaker: CircuitBreaker) -> None:
+    for seconds in (0.01, 0.2, 0.2, 0.2):
+        _call(breaker, seconds=seconds, failed=False)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_breaker_sliding_window(breaker: CircuitBreaker) -> None:
+    for _ in range(10):
+        _call(breaker, seconds=0.01, failed=False)
+    for _ in range(4):
+        _call(breaker, seconds=0.01, failed=True)
+    # Only the last 10 calls are considered, 4 of them being failures.
+    assert breaker.state == CircuitState.CLOSED
+    _call(breaker, seconds=0.01, failed=True)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_breaker_probe_closes(breaker: CircuitBreaker, clock: _Clock) -> None:
+    for _ in range(4):
+        _call(breaker, seconds=0.01, failed=True)
+    clock.now += 5
+    assert breaker.state == CircuitState.HALF_OPEN
+    probe = breaker.allow()
+    assert probe is not None
+    # A single probe at a time.
+    assert breaker.allow() is None
+    breaker.record(probe, seconds=0.01, failed=False)
+    assert breaker.state == CircuitState.CLOSED
+    # The failures before the breaker opened are forgotten.
+    _call(breaker, seconds=0.01, failed=True)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_breaker_probe_reopens(breaker: CircuitBreaker, clock: _Clock) -> None:
+    for _ in range(4):
+        _call(breaker, seconds=0.01, failed=True)
+    clock.now += 5
+    probe = breaker.allow()
+    assert probe is not None
+    breaker.record(probe, seconds=0.2, failed=False)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.retry_after == 5
+
+
+def test_breaker_ignores_stale_calls(breaker: CircuitBreaker, clock: _Clock) -> None:
+    stale = breaker.allow()
+    assert stale is not None
+    for _ in range(4):
+        _call(breaker, seconds=0.01, failed=True)
+    clock.now += 5
+    probe = breaker.allow()
+    assert probe is not None
+    # A call started before the breaker opened neither reopens nor closes it.
+    breaker.record(stale, seconds=0.01, failed=True)
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.record(stale, seconds=0.01, failed=False)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow() is None
+    breaker.record(probe, seconds=0.01, failed=False)
+    assert breaker.state == CircuitState.CLOSED
+    # Nor does it count once the breaker closed again.
+    for _ in range(4):
+        breaker.record(stale, seconds=0.01, failed=True)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_breaker_abandoned_probe(breaker: CircuitBreaker, clock: _Clock) -> None:
+    for _ in range(4):
+        _call(breaker, seconds=0.01, failed=True)
+    clock.now += 5
+    probe = breaker.allow()
+    assert probe is not None
+    # A fast abandoned probe lets another one through.
+    breaker.abandon(probe, seconds=0.01)
+    assert breaker.state == CircuitState.HALF_OPEN
+    probe = breaker.allow()
+    assert probe is not None
+    # A slow abandoned probe reopens the breaker.
+    breaker.abandon(probe, seconds=0.2)
+    assert breaker.state == CircuitState.OPEN
+
+
+async def test_admission_guard(breaker: CircuitBreaker) -> None:
+    admission = Admission(
+        limiter=InFlightLimiter(max_in_flight=1), breaker=breaker, retry_after_seconds=2
+    )
+    entered = asyncio.Event()
+    release = asyncio.Event()
+
+    async def _call() -> None:
+        async with admission.guard():
+            entered.set()
+            await release.wait()
+
+    task = asyncio.ensure_future(_call())
+    await entered.wait()
+    with raises(ServiceUnavailableException) as exception:
+        async with admission.guard():
+            pass  # pragma: no cover
+    assert exception.value.retry_after == 2
+    release.set()
+    await task
+    assert admission.limiter.in_flight == 0
+
+    for _ in range(3):
+        with raises(ConnectionError):
+            async with admission.guard():
+                raise ConnectionError()
+    assert breaker.state == CircuitState.OPEN
+    with raises(ServiceUnavailableException) as exception:
+        async with admission.guard():
+            pass  # pragma: no cover
+    assert exception.value.retry_after == 5
+    assert admission.limiter.in_flight == 0
+
+
+async def test_admission_guard_records_latency(breaker: CircuitBreaker) -> None:
+    admission = Admission(
+        limiter=InFlightLimiter(max_in_flight=1), breaker=breaker, retry_after_seconds=2
+    )
+    latencies: List[float] = []
+    breaker.record = lambda call, seconds, failed: latencies.append(seconds)  # type: ignore
+    async with admission.guard():
+        await asyncio.sleep(0.01)
+    assert latencies[0] >= 0.01
+
+
+async def test_admission_guard_cancelled(breaker: CircuitBreaker) -> None:
+    admission = Admission(
+        limiter=InFlightLimiter(max_in_flight=10), breaker=breaker, retry_after_seconds=2
+    )
+
+    async def _call() -> None:
+        async with admission.guard():
+            await asyncio.sleep(1)
+
+    # Cancelled calls are not failures of the dependency.
+    for _ in range(4):
+        task = asyncio.ensure_future(_call())
+        await asyncio.sleep(0)
+        task.cancel()
+        with raises(asyncio.CancelledError):
+            await task
+    assert breaker.state == CircuitState.CLOSED
+    assert admission.limiter.in_flight == 0
@@ -0,0 +1,120 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+from dataclasses import asdict
+from pathlib import Path
+from typing import List
+from unittest.mock import patch
+
+from immuni_otp.helpers.audit import AuditLog, AuditRecord
+
+
+def _record(index: int) -> AuditRecord:
+    return AuditRecord(
+        timestamp=1600000000.0 + index,
+        otp_sha=f"{index:064x}",
+        client="his" if index % 2 else None,
+        outcome="stored",
+        validation_ms=0.1,
+        store_ms=1.5,
+    )
+
+
+def _written(directory: Path) -> List[dict]:
+    return [
+        json.loads(line)
+        for path in sorted(directory.iterdir())
+        for line in path.read_text().splitlines()
+    ]
+
+
+async def test_flush(tmp_path: Path) -> None:
+    audit_log = AuditLog(str(tmp_path), queue_size=10, batch_size=2, max_file_bytes=1024 * 1024)
+    records = [_record(index) for index in range(5)]
+    with patch("immuni_otp.helpers.audit.OTP_AUDIT_WRITTEN") as written:
+        for record in records:
+            assert audit_log.push(record)
+        assert len(audit_log) == 5
+        await audit_log.flush()
+    assert len(audit_log) == 0
+    assert [call.args for call in written.inc.call_args_list] == [(2,), (2,), (1,)]
+    audit_log.close()
+    audit_log.close()
+    assert len(list(tmp_path.iterdir())) == 1
+    assert _written(tmp_path) == [asdict(record) for record in records]
+
+
+async def test_push_drops_when_full(tmp_path: Path) -> None:
+    audit_log = AuditLog(str(tmp_path), queue_size=2, batch_size=10, max_file_bytes=1024)
+    with patch("immuni_otp.helpers.audit.OTP_AUDIT_DROPPED") as dropped:
+        assert audit_log.push(_record(0))
+        assert audit_log.push(_record(1))
+        assert not audit_log.push(_record(2))
+    dropped.inc.assert_called_once_with()
+    assert len(audit_log) == 2
+
+
+async def test_rotation(tmp_path: Path) -> None:
+    record_bytes = len(_record(0).encode())
+    audit_log = AuditLog(
+        str(tmp_path), queue_size=10, batch_size=2, max_file_bytes=2 * record_bytes
+    )
+    for index in range(5):
+        audit_log.push(_record(index))
+    await audit_log.flush()
+    audit_log.close()
+    assert len(list(tmp_path.iterdir())) == 3
+    assert [record["timestamp"] for record in _written(tmp_path)] == [
+        _record(index).timestamp for index in range(5)
+    ]
+
+
+async def test_write_failure(tmp_path: Path) -> None:
+    audit_log = AuditLog(str(tmp_path), queue_size=10, batch_size=10, max_file_bytes=1024)
+    audit_log.push(_record(0))
+    with patch.object(audit_log, "_write", side_effect=OSError()), patch(
+        "immuni_otp.helpers.audit.OTP_AUDIT_DROPPED"
+    ) as dropped:
+        await audit_log.flush()
+    dropped.inc.assert_called_once_with(1)
+    assert len(audit_log) == 0
+
+
+async def test_flush_forever_on_batch_size(tmp_path: Path) -> None:
+    audit_log = AuditLog(str(tmp_path), queue_size=10, batch_size=2, max_file_bytes=1024)
+    task = asyncio.ensure_future(audit_log.flush_forever(interval_seconds=60))
+    audit_log.push(_record(0))
+    await asyncio.sleep(0.05)
+    assert len(audit_log) == 1
+    audit_log.push(_record(1))
+    await asyncio.sleep(0.05)
+    assert len(audit_log) == 0
+    audit_log.push(_record(2))
+    audit_log.stop()
+    await task
+    audit_log.close()
+    assert len(_written(tmp_path)) == 3
+
+
+async def test_flush_forever_on_interval(tmp_path: Path) -> None:
+    audit_log = AuditLog(str(tmp_path), queue_size=10, batch_size=10, max_file_bytes=1024)
+    task = asyncio.ensure_future(audit_log.flush_forever(interval_seconds=0.01))
+    audit_log.push(_record(0))
+    await asyncio.sleep(0.1)
+    assert len(audit_log) == 0
+    audit_log.stop()
+    await task
+    audit_log.close()
+    assert len(_written(tmp_path)) == 1
@@ -0,0 +1,113 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import gc
+from typing import List, Sequence
+from unittest.mock import patch
+
+from pytest import raises
+
+from immuni_common.core.exceptions import OtpCollisionException
+from immuni_otp.core import config
+from immuni_otp.helpers.coalescing import WriteCoalescer
+from immuni_otp.helpers.otp import store
+from immuni_otp.models.enums import AuthorizationOutcome
+from tests.test_helpers.test_otp import _CUN, _CUN_DATA, _OTHER_DATA, _OTP, _OTP_DATA
+
+
+class _Flusher:
+    def __init__(self) -> None:
+        self.batches: List[List[int]] = []
+
+    async def __call__(self, items: Sequence[int]) -> List[int]:
+        self.batches.append(list(items))
+        return [item * 2 for item in items]
+
+
+async def test_flush_on_max_items() -> None:
+    flusher = _Flusher()
+    coalescer = WriteCoalescer(flush=flusher, max_items=3, window_seconds=60)
+    results = await asyncio.gather(*(coalescer.submit(item) for item in range(6)))
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert flusher.batches == [[0, 1, 2], [3, 4, 5]]
+
+
+async def test_flush_on_window() -> None:
+    flusher = _Flusher()
+    coalescer = WriteCoalescer(flush=flusher, max_items=100, window_seconds=0.01)
+    results = await asyncio.gather(*(coalescer.submit(item) for item in range(5)))
+    assert results == [0, 2, 4, 6, 8]
+    assert flusher.batches == [[0, 1, 2, 3, 4]]
+
+
+async def test_flush_failure_propagated() -> None:
+    async def _flush(items: Sequence[int]) -> List[int]:
+        raise ValueError()
+
+    coalescer = WriteCoalescer(flush=_flush, max_items=2, window_seconds=60)
+    results = await asyncio.gather(
+        *(coalescer.submit(item) for item in range(2)), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_flush_survives_garbage_collection() -> None:
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def _flush(items: Sequence[int]) -> List[int]:
+        started.set()
+        await release.wait()
+        return list(items)
+
+    coalescer = WriteCoalescer(flush=_flush, max_items=1, window_seconds=60)
+    submitted = asyncio.ensure_future(coalescer.submit(1))
+    await started.wait()
+    gc.collect()
+    release.set()
+    assert await asyncio.wait_for(submitted, timeout=1) == 1
+
+
+async def test_close() -> None:
+    flusher = _Flusher()
+    coalescer = WriteCoalescer(flush=flusher, max_items=100, window_seconds=60)
+    submitted = asyncio.gather(*(coalescer.submit(item) for item in range(3)))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(coalescer.close(), timeout=1)
+    assert flusher.batches == [[0, 1, 2]]
+    assert submitted.done()
+    assert submitted.result() == [0, 2, 4]
+    await coalescer.close()
+    assert flusher.batches == [[0, 1, 2]]
+
+
+async def test_store_coalesced() -> None:
+    with patch.object(config, "OTP_STORE_COALESCING_ENABLED", True):
+        results = await asyncio.gather(
+            store(otp=_OTP, otp_data=_OTP_DATA),
+            store(otp=_CUN, otp_data=_CUN_DATA),
+            store(otp=_OTP, otp_data=_OTP_DATA),
+            store(otp=_OTP, otp_data=_OTHER_DATA),
+            return_exceptions=True,
+        )
+    assert results[:3] == [
+        AuthorizationOutcome.STORED,
+        AuthorizationOutcome.STORED,
+        AuthorizationOutcome.DUPLICATE,
+    ]
+    assert isinstance(results[3], OtpCollisionException)
+
+    with patch.object(config, "OTP_STORE_COALESCING_ENABLED", True):
+        with raises(OtpCollisionException):
+            await store(otp=_CUN, otp_data=_OTHER_DATA)
@@ -0,0 +1,67 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import time
+from typing import Dict, Optional
+from unittest.mock import MagicMock, patch
+
+from pytest import approx, mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.core.exceptions import DeadlineExceededException
+from immuni_otp.helpers.deadline import request_deadline, within_deadline
+
+
+@mark.parametrize(
+    "configured, headers, timeout",
+    [
+        (0, {}, None),
+        (0, {"X-Request-Timeout": "invalid"}, None),
+        (0, {"X-Request-Timeout": "0"}, None),
+        (0, {"X-Request-Timeout": "200"}, 0.2),
+        (500, {}, 0.5),
+        (500, {"X-Request-Timeout": "200"}, 0.2),
+        (500, {"X-Request-Timeout": "2000"}, 0.5),
+    ],
+)
+def test_request_deadline(
+    configured: int, headers: Dict[str, str], timeout: Optional[float]
+) -> None:
+    with patch.object(config, "OTP_REQUEST_TIMEOUT_MILLISECONDS", configured):
+        deadline = request_deadline(MagicMock(headers=headers))
+    if timeout is None:
+        assert deadline is None
+    else:
+        assert deadline == approx(time.monotonic() + timeout, abs=0.05)
+
+
+async def test_within_deadline() -> None:
+    assert await within_deadline(asyncio.sleep(0, result=1), deadline=None) == 1
+    assert await within_deadline(asyncio.sleep(0, result=2), time.monotonic() + 1) == 2
+
+
+async def test_deadline_exceeded() -> None:
+    with patch("immuni_otp.helpers.deadline.OTP_DEADLINE_EXCEEDED") as deadline_exceeded:
+        with raises(DeadlineExceededException):
+            await within_deadline(asyncio.sleep(1), time.monotonic() + 0.01)
+        with raises(DeadlineExceededException):
+            await within_deadline(asyncio.sleep(0), time.monotonic() - 1)
+    assert deadline_exceeded.inc.call_count == 2
+
+
+async def test_timeout_before_deadline() -> None:
+    async def _timeout() -> None:
+        raise asyncio.TimeoutError()
+
+    with raises(asyncio.TimeoutError):
+        await within_deadline(_timeout(), time.monotonic() + 1)
@@ -0,0 +1,94 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+
+from pytest import mark, raises
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_otp.helpers.encoding import (
+    decode_key,
+    decode_otp_data,
+    encode_key,
+    encode_otp_data,
+    key_format,
+)
+from immuni_otp.models.enums import StorageFormat
+from tests.test_helpers.test_otp import _CUN, _CUN_DATA, _OTP_DATA
+
+_RAW_DATA = OtpData(
+    id_test_verification="not-a-uuid", symptoms_started_on=date(year=2020, month=12, day=10),
+)
+
+
+def test_encode_key() -> None:
+    assert encode_key(_CUN, StorageFormat.JSON) == f"~otp:{_CUN}"
+    assert encode_key(_CUN, StorageFormat.BINARY) == b"~otp:" + bytes.fromhex(_CUN)
+
+
+@mark.parametrize("storage_format", list(StorageFormat))
+def test_decode_key(storage_format: StorageFormat) -> None:
+    key = encode_key(_CUN, storage_format)
+    assert decode_key(key if isinstance(key, bytes) else key.encode("utf-8")) == _CUN
+
+
+@mark.parametrize("storage_format", list(StorageFormat))
+def test_key_format(storage_format: StorageFormat) -> None:
+    key = encode_key(_CUN, storage_format)
+    assert key_format(key if isinstance(key, bytes) else key.encode("utf-8")) == storage_format
+
+
+@mark.parametrize("key", [b"other:" + bytes(32), b"~otp:" + bytes(16), b"~otp:" + b"0" * 62])
+def test_decode_invalid_key(key: bytes) -> None:
+    with raises(ValueError):
+        decode_key(key)
+    with raises(ValueError):
+        key_format(key)
+
+
+@mark.parametrize("otp_data", [_OTP_DATA, _CUN_DATA, _RAW_DATA])
+@mark.parametrize("storage_format", list(StorageFormat))
+def test_round_trip(otp_data: OtpData, storage_format: StorageFormat) -> None:
+    encoded = encode_otp_data(otp_data, storage_format)
+    assert decode_otp_data(encoded) == otp_data
+    if isinstance(encoded, str):
+        assert decode_otp_data(encoded.encode("utf-8")) == otp_data
+
+
+def test_binary_is_compact() -> None:
+    assert len(encode_otp_data(_OTP_DATA, StorageFormat.BINARY)) == 4
+    assert len(encode_otp_data(_CUN_DATA, StorageFormat.BINARY)) == 20
+
+
+@mark.parametrize(
+    "otp_data, binary",
+    [
+        (OtpData(id_test_verification=None, symptoms_started_on=date(1970, 1, 1)), True),
+        (OtpData(id_test_verification=None, symptoms_started_on=date(1969, 12, 31)), False),
+        (OtpData(id_test_verification=None, symptoms_started_on=date(2149, 6, 6)), True),
+        (OtpData(id_test_verification=None, symptoms_started_on=date(2149, 6, 7)), False),
+        (OtpData(id_test_verification="x" * 255, symptoms_started_on=date(2020, 12, 10)), True),
+        (OtpData(id_test_verification="x" * 256, symptoms_started_on=date(2020, 12, 10)), False),
+        (OtpData(id_test_verification="è" * 128, symptoms_started_on=date(2020, 12, 10)), False),
+    ],
+)
+def test_binary_out_of_range(otp_data: OtpData, binary: bool) -> None:
+    encoded = encode_otp_data(otp_data, StorageFormat.BINARY)
+    assert isinstance(encoded, bytes)
+    assert encoded.startswith(b"{") != binary
+    assert decode_otp_data(encoded) == otp_data
+
+
+def test_decode_unknown_kind() -> None:
+    with raises(ValueError):
+        decode_otp_data(bytes((1, 9, 0, 0)))
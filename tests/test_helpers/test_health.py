@@ -0,0 +1,191 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from types import SimpleNamespace
+from typing import List, Optional
+
+from aioredis import ReplyError, create_redis_pool
+from pytest import approx, mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.helpers.health import HealthState, ProbeResult, probe_forever, probe_redis
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _Shard:
+    def __init__(self, delay: float = 0, error: Optional[Exception] = None) -> None:
+        self._delay = delay
+        self._error = error
+        self.pings = 0
+        self.connection = SimpleNamespace(size=2, freesize=1)
+
+    async def ping(self) -> bytes:
+        self.pings += 1
+        await asyncio.sleep(self._delay)
+        if self._error is not None:
+            raise self._error
+        return b"PONG"
+
+
+def _state(clock: _Clock) -> HealthState:
+    return HealthState(
+        window_size=4,
+        max_latency_seconds=0.1,
+        max_failure_rate=0.5,
+        max_age_seconds=3,
+        clock=clock,
+    )
+
+
+def _record(
+    state: HealthState, clock: _Clock, latencies: List[float], failed: bool = False
+) -> None:
+    for latency_seconds in latencies:
+        state.record(
+            ProbeResult(
+                probed_at=clock.now,
+                latency_seconds=latency_seconds,
+                failed=failed,
+                pool_size=4,
+                pool_free=3,
+            )
+        )
+
+
+def test_readiness_not_probed() -> None:
+    assert _state(_Clock()).readiness() == dict(ready=False, reason="not_probed")
+
+
+def test_readiness_ready() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.02, 0.04, 0.06])
+    _record(state, clock, [1], failed=True)
+    clock.now += 1
+    assert state.readiness() == dict(
+        ready=True,
+        reason=None,
+        probes=4,
+        failure_rate=0.25,
+        mean_latency_ms=approx(40),
+        last_latency_ms=1000,
+        last_failed=True,
+        last_probe_age_ms=1000,
+        pool_size=4,
+        pool_free=3,
+    )
+
+
+def test_readiness_window() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.01] * 2, failed=True)
+    assert state.readiness()["reason"] == "failing"
+    _record(state, clock, [0.01] * 4)
+    assert state.readiness()["ready"]
+
+
+def test_readiness_stale() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.01])
+    clock.now += 3.5
+    assert state.readiness()["reason"] == "stale"
+
+
+def test_readiness_failing() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.01, 0.01])
+    _record(state, clock, [0.5, 0.5], failed=True)
+    report = state.readiness()
+    assert not report["ready"]
+    assert report["reason"] == "failing"
+    assert report["failure_rate"] == 0.5
+
+
+def test_readiness_slow() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.05, 0.2])
+    report = state.readiness()
+    assert not report["ready"]
+    assert report["reason"] == "slow"
+    assert report["mean_latency_ms"] == approx(125)
+
+
+def test_clear() -> None:
+    clock = _Clock()
+    state = _state(clock)
+    _record(state, clock, [0.01])
+    state.clear()
+    assert state.readiness()["reason"] == "not_probed"
+
+
+async def test_probe_redis() -> None:
+    shards = [_Shard(delay=0.01), _Shard()]
+    result = await probe_redis(shards, timeout_seconds=1)  # type: ignore
+    assert not result.failed
+    assert 0.01 <= result.latency_seconds < 1
+    assert result.pool_size == 4
+    assert result.pool_free == 2
+    assert [shard.pings for shard in shards] == [1, 1]
+
+
+@mark.parametrize(
+    "shard", [_Shard(error=ConnectionRefusedError()), _Shard(error=ReplyError()), _Shard(delay=1)]
+)
+async def test_probe_redis_failed(shard: _Shard) -> None:
+    result = await probe_redis([_Shard(), shard], timeout_seconds=0.05)  # type: ignore
+    assert result.failed
+    assert result.latency_seconds < 1
+
+
+async def test_probe_redis_unexpected_error() -> None:
+    with raises(ValueError):
+        await probe_redis([_Shard(error=ValueError())], timeout_seconds=1)  # type: ignore
+
+
+async def test_probe_forever() -> None:
+    state = HealthState(
+        window_size=4, max_latency_seconds=0.1, max_failure_rate=0.5, max_age_seconds=3
+    )
+    shard = _Shard(error=ConnectionRefusedError())
+    task = asyncio.ensure_future(
+        probe_forever(state, [shard], interval_seconds=0.01, timeout_seconds=1)  # type: ignore
+    )
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert shard.pings >= 2
+    assert state.readiness()["reason"] == "failing"
+
+
+@mark.redis
+async def test_probe_redis_pool() -> None:
+    redis = await create_redis_pool(config.OTP_CACHE_REDIS_URL, minsize=2, maxsize=4)
+    try:
+        result = await probe_redis([redis], timeout_seconds=1)
+        assert not result.failed
+        assert result.pool_size == 2
+        assert result.pool_free == 2
+    finally:
+        redis.close()
+        await redis.wait_closed()
@@ -0,0 +1,86 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+from typing import List
+from unittest.mock import patch
+
+from pytest import mark, raises
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.keyspace import KeyspaceReport, analyze_keyspace
+from immuni_otp.helpers.otp import store
+from immuni_otp.models.enums import StorageFormat
+
+_OTP_DATA = OtpData(id_test_verification=None, symptoms_started_on=date(2020, 12, 10))
+_CUN_DATA = OtpData(
+    id_test_verification="2d8af3b9-2c0a-4efc-9e15-72454f994e1f",
+    symptoms_started_on=date(2020, 12, 10),
+)
+
+
+def test_report() -> None:
+    report = KeyspaceReport(ttl_buckets=[60, 120])
+    report.add(key=b"~otp:" + b"0" * 64, pttl=30000, memory_usage=100, key_type=b"string")
+    report.add(key=b"~otp:" + bytes(32), pttl=60000, memory_usage=50, key_type=b"string")
+    report.add(key=b"~otp:other", pttl=-1, memory_usage=150, key_type=b"hash")
+    assert report.as_dict() == dict(
+        keys=3,
+        json_keys=1,
+        binary_keys=1,
+        invalid_keys=1,
+        non_string=1,
+        persistent=1,
+        total_bytes=300,
+        max_key_bytes=150,
+        mean_key_bytes=100.0,
+        ttl_distribution={"le_60s": 2, "le_120s": 0, "inf": 0},
+    )
+    assert KeyspaceReport(ttl_buckets=[]).as_dict()["mean_key_bytes"] == 0.0
+
+
+@mark.parametrize("ttl_buckets", [[120, 60], [60, 60]])
+def test_report_unsorted_ttl_buckets(ttl_buckets: List[int]) -> None:
+    with raises(ValueError):
+        KeyspaceReport(ttl_buckets=ttl_buckets)
+
+
+@mark.redis
+async def test_analyze_keyspace() -> None:
+    await store(otp="59FU36KR46", otp_data=_OTP_DATA)
+    await store(otp="2FJ2QXAU9R", otp_data=_OTP_DATA)
+    await store(
+        otp="b39e0733843b1b5d7c558f52f117a824dc41216e0c2bb671b3d79ba82105dd94", otp_data=_CUN_DATA
+    )
+    with patch.object(config, "OTP_STORAGE_FORMAT", StorageFormat.BINARY):
+        await store(otp="EUHQWL3KKA", otp_data=_CUN_DATA)
+    await managers.otp_redis.set("unrelated", "value", expire=60)
+
+    report = KeyspaceReport(ttl_buckets=[config.OTP_EXPIRATION_SECONDS])
+    await analyze_keyspace(managers.otp_redis, report, scan_count=2, pause_seconds=0.001)
+    result = report.as_dict()
+    assert result["keys"] == 4
+    assert result["json_keys"] == 3
+    assert result["binary_keys"] == 1
+    assert result["invalid_keys"] == result["non_string"] == result["persistent"] == 0
+    assert result["ttl_distribution"] == {f"le_{config.OTP_EXPIRATION_SECONDS}s": 4, "inf": 0}
+    assert 0 < result["max_key_bytes"] <= result["total_bytes"]
+
+
+@mark.redis
+async def test_analyze_empty_keyspace() -> None:
+    report = KeyspaceReport(ttl_buckets=[60])
+    await analyze_keyspace(managers.otp_redis, report)
+    assert report.keys == 0
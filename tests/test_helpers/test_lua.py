@@ -0,0 +1,51 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from aioredis import ReplyError
+from pytest import mark, raises
+
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.lua import LuaScript
+
+
+pytestmark = mark.redis
+
+_ECHO = LuaScript("return {KEYS[1], ARGV[1]}")
+_RAW_ECHO = LuaScript("return ARGV[1]", decode=False)
+_FAILING = LuaScript('return redis.error_reply("FAILED")')
+
+
+async def test_script_loaded_on_demand() -> None:
+    await managers.otp_redis.script_flush()
+    assert await _ECHO(managers.otp_redis, keys=["key"], args=["value"]) == ["key", "value"]
+    # The script is now cached by Redis, and executed by its SHA-1.
+    assert await managers.otp_redis.script_exists(_ECHO.sha) == [1]
+    assert await _ECHO(managers.otp_redis, keys=["key"], args=["other"]) == ["key", "other"]
+
+
+async def test_script_in_pipeline() -> None:
+    pipeline = managers.otp_redis.pipeline()
+    _ECHO(pipeline, keys=["key"], args=["first"])
+    _ECHO(pipeline, keys=["key"], args=["second"])
+    assert await pipeline.execute() == [["key", "first"], ["key", "second"]]
+
+
+async def test_script_error() -> None:
+    with raises(ReplyError):
+        await _FAILING(managers.otp_redis, keys=[], args=[])
+
+
+async def test_script_raw_result() -> None:
+    await managers.otp_redis.script_flush()
+    for _ in range(2):
+        assert await _RAW_ECHO(managers.otp_redis, keys=[], args=[b"\xff\x00"]) == b"\xff\x00"
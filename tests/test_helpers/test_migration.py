@@ -0,0 +1,212 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterator
+from unittest.mock import patch
+
+from pytest import fixture, mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.core.managers import Managers
+from immuni_otp.helpers.encoding import encode_key, encode_otp_data
+from immuni_otp.helpers.migration import (
+    MigrationRecord,
+    consume_on_target,
+    export_keys,
+    import_records,
+    read_records,
+    write_header,
+    write_record,
+)
+from immuni_otp.helpers.otp import _buffer, _otp_sha, consume, replay_buffered, store, store_many
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.models.enums import AuthorizationOutcome, StorageFormat
+from tests.test_helpers.test_otp import _CUN, _CUN_DATA, _OTP, _OTP_DATA
+
+_RECORDS = [
+    MigrationRecord(key=b"~otp:" + bytes(32), payload=b"payload", expires_at=1600000000000),
+    MigrationRecord(key=b"~otp:" + b"0" * 64, payload=b"", expires_at=0),
+]
+
+
+@fixture
+async def migration_managers() -> AsyncIterator[Managers]:
+    base_url = config.OTP_CACHE_REDIS_URL.rsplit("/", 1)[0]
+    target_managers = Managers()
+    with patch.object(config, "OTP_MIGRATION_REDIS_URLS", [f"{base_url}/1", f"{base_url}/2"]):
+        await target_managers.initialize()
+    try:
+        yield target_managers
+    finally:
+        await target_managers.otp_storage.flush()
+        await target_managers.otp_migration_storage.flush()
+        await target_managers.teardown()
+
+
+def _stream(*records: MigrationRecord) -> BytesIO:
+    stream = BytesIO()
+    write_header(stream)
+    for record in records:
+        write_record(stream, record)
+    stream.seek(0)
+    return stream
+
+
+def test_stream_round_trip() -> None:
+    assert list(read_records(_stream(*_RECORDS))) == _RECORDS
+
+
+def test_read_invalid_stream() -> None:
+    with raises(ValueError):
+        list(read_records(BytesIO(b"not an export")))
+    stream = _stream(*_RECORDS).getvalue()
+    # Truncated within the header of the last record, and within its key.
+    for truncated in (stream[:-75], stream[:-40]):
+        with raises(ValueError):
+            list(read_records(BytesIO(truncated)))
+
+
+@mark.redis
+async def test_export_import(migration_managers: Managers) -> None:
+    with patch("immuni_otp.helpers.otp.managers", migration_managers), patch.object(
+        migration_managers, "_otp_migration_storage", None
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+    stream = BytesIO()
+    write_header(stream)
+    assert await export_keys(migration_managers.otp_redis, stream, scan_count=1) == 2
+    stream.seek(0)
+    records = list(read_records(stream))
+    assert {record.key.decode() for record in records} == {
+        encode_key(_otp_sha(otp), StorageFormat.JSON) for otp in (_OTP, _CUN)
+    }
+
+    target = migration_managers.otp_migration_storage
+    # A fresher write on the target, with a different format, is not overwritten.
+    await target.redis_for(_otp_sha(_CUN)).set(
+        encode_key(_otp_sha(_CUN), StorageFormat.BINARY),
+        encode_otp_data(_CUN_DATA, StorageFormat.BINARY),
+        expire=60,
+    )
+    expired = MigrationRecord(
+        key=encode_key(_otp_sha("12345ABCDE"), StorageFormat.BINARY),
+        payload=records[0].payload,
+        expires_at=int(time.time() * 1000) - 1,
+    )
+    counts = await import_records(target, [*records, expired], batch_size=2)
+    assert counts == dict(restored=1, existing=1, consumed=0, expired=1)
+
+    otp_key = encode_key(_otp_sha(_OTP), StorageFormat.JSON)
+    otp_redis = target.redis_for(_otp_sha(_OTP))
+    assert 0 < await otp_redis.pttl(otp_key) <= config.OTP_EXPIRATION_SECONDS * 1000
+    assert await target.consume(_otp_sha(_OTP)) == _OTP_DATA
+    assert await target.consume(_otp_sha(_CUN)) == _CUN_DATA
+
+
+@mark.redis
+async def test_import_persistent(migration_managers: Managers) -> None:
+    await migration_managers.otp_redis.set("~otp:" + "0" * 64, "value")
+    payload = await migration_managers.otp_redis.execute(b"DUMP", "~otp:" + "0" * 64, encoding=None)
+    await migration_managers.otp_redis.delete("~otp:" + "0" * 64)
+    target = migration_managers.otp_migration_storage
+    record = MigrationRecord(key=b"~otp:" + b"0" * 64, payload=payload, expires_at=0)
+    assert await import_records(target, [record]) == dict(
+        restored=1, existing=0, consumed=0, expired=0
+    )
+    assert await target.redis_for("0" * 64).pttl("~otp:" + "0" * 64) == -1
+
+
+@mark.redis
+async def test_dual_write(migration_managers: Managers) -> None:
+    target = migration_managers.otp_migration_storage
+    with patch("immuni_otp.helpers.otp.managers", migration_managers), patch(
+        "immuni_otp.helpers.otp.OTP_MIGRATION_MIRRORED"
+    ) as mirrored:
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)]) == [
+            AuthorizationOutcome.DUPLICATE,
+            AuthorizationOutcome.STORED,
+        ]
+        assert mirrored.labels.call_count == 2
+        mirrored.labels.assert_called_with(AuthorizationOutcome.STORED.value)
+        assert await target.redis_for(_otp_sha(_CUN)).exists(
+            encode_key(_otp_sha(_CUN), StorageFormat.JSON)
+        )
+
+        assert await consume(_OTP) == _OTP_DATA
+        assert await target.consume(_otp_sha(_OTP)) is None
+
+
+@mark.redis
+async def test_import_skips_consumed(migration_managers: Managers) -> None:
+    with patch("immuni_otp.helpers.otp.managers", migration_managers), patch.object(
+        migration_managers, "_otp_migration_storage", None
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+    stream = BytesIO()
+    write_header(stream)
+    assert await export_keys(migration_managers.otp_redis, stream) == 1
+    # The OTP is consumed after the export, while the dual write is enabled.
+    with patch("immuni_otp.helpers.otp.managers", migration_managers):
+        assert await consume(_OTP) == _OTP_DATA
+    stream.seek(0)
+    target = migration_managers.otp_migration_storage
+    assert await import_records(target, read_records(stream)) == dict(
+        restored=0, existing=0, consumed=1, expired=0
+    )
+    assert await target.consume(_otp_sha(_OTP)) is None
+
+
+@mark.redis
+async def test_consume_on_target(migration_managers: Managers) -> None:
+    target = migration_managers.otp_migration_storage
+    otp_sha = _otp_sha(_CUN)
+    redis = target.redis_for(otp_sha)
+    for storage_format in StorageFormat:
+        await redis.set(encode_key(otp_sha, storage_format), "value")
+    await consume_on_target(target, otp_sha, tombstone_seconds=60)
+    for storage_format in StorageFormat:
+        assert not await redis.exists(encode_key(otp_sha, storage_format))
+    assert 0 < await redis.pttl(f"~otp-consumed:{otp_sha}") <= 60000
+
+
+@mark.redis
+async def test_dual_write_replay(migration_managers: Managers, tmp_path: Path) -> None:
+    ring_buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=1024)
+    with patch("immuni_otp.helpers.otp.managers", migration_managers), patch.object(
+        migration_managers, "_otp_buffer", ring_buffer
+    ):
+        assert _buffer(_otp_sha(_CUN), _CUN_DATA)
+        await replay_buffered()
+    ring_buffer.close()
+    target = migration_managers.otp_migration_storage
+    assert (
+        await target.redis_for(_otp_sha(_CUN)).ttl(encode_key(_otp_sha(_CUN), StorageFormat.JSON))
+        < config.OTP_EXPIRATION_SECONDS
+    )
+
+
+@mark.redis
+async def test_dual_write_failure(migration_managers: Managers) -> None:
+    target = migration_managers.otp_migration_storage
+    with patch("immuni_otp.helpers.otp.managers", migration_managers), patch(
+        "immuni_otp.helpers.otp.OTP_MIGRATION_MIRRORED"
+    ) as mirrored, patch.object(target, "store_many", side_effect=ConnectionRefusedError()), patch(
+        "immuni_otp.helpers.otp.consume_on_target", side_effect=ConnectionRefusedError()
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        mirrored.labels.assert_called_once_with("failed")
+        assert await consume(_OTP) == _OTP_DATA
@@ -0,0 +1,66 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Optional
+from unittest.mock import MagicMock
+
+from pytest import raises
+
+from immuni_otp.helpers.monitoring import timed_validation, validation_started_at
+
+
+def _validator(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    async def _validate(value: int) -> Any:
+        if value < 0:
+            raise ValueError()
+        return await handler(value=value * 2)
+
+    return _validate
+
+
+async def test_timed_validation() -> None:
+    histogram = MagicMock()
+
+    @timed_validation(histogram, _validator)
+    async def _handler(value: int) -> int:
+        return value
+
+    assert _handler.__name__ == "_handler"
+    assert await _handler(2) == 4
+    histogram.observe.assert_called_once()
+    ((elapsed,), _) = histogram.observe.call_args
+    assert elapsed >= 0
+
+
+async def test_validation_started_at() -> None:
+    @timed_validation(MagicMock(), _validator)
+    async def _handler(value: int) -> Optional[float]:  # pylint: disable=unused-argument
+        return validation_started_at()
+
+    before = perf_counter()
+    started_at = await _handler(1)
+    assert started_at is not None
+    assert before <= started_at <= perf_counter()
+
+
+async def test_timed_validation_failure() -> None:
+    histogram = MagicMock()
+
+    @timed_validation(histogram, _validator)
+    async def _handler(value: int) -> int:
+        return value
+
+    with raises(ValueError):
+        await _handler(-1)
+    histogram.observe.assert_not_called()
@@ -11,18 +11,43 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import json
+import time
 from datetime import date
 from hashlib import sha256
+from pathlib import Path
+from typing import Any, Iterator
+from unittest.mock import PropertyMock, patch
 
 from aioredis.commands import StringCommandsMixin
-from pytest import raises
+from pytest import fixture, mark, raises
 
 from immuni_common.core.exceptions import OtpCollisionException
 from immuni_common.models.dataclasses import OtpData
 from immuni_otp.core import config
+from immuni_otp.core.exceptions import (
+    DeadlineExceededException,
+    ServiceUnavailableException,
+    TooManyRequestsException,
+)
 from immuni_otp.core.managers import managers
-from immuni_otp.helpers.otp import store
+from immuni_otp.helpers.admission import Admission, CircuitBreaker, InFlightLimiter
+from immuni_otp.helpers.encoding import decode_otp_data
+from immuni_otp.helpers.otp import (
+    _encode_buffered,
+    consume,
+    replay_buffered,
+    replay_buffered_forever,
+    store,
+    store_many,
+)
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.helpers.storage import RedisStorage
+from immuni_otp.models.enums import AuthorizationOutcome, StorageFormat
+
+
+pytestmark = mark.redis
 
 _OTP = "59FU36KR46"
 _OTP_SHA = sha256(_OTP.encode("utf-8")).hexdigest()
@@ -32,6 +57,12 @@ _OTP_DATA = OtpData(
 _OTP_DATA_SERIALIZED = json.dumps(
     {"id_test_verification": None, "symptoms_started_on": "2020-12-10"}
 )
+_OTHER_DATA_SERIALIZED = json.dumps(
+    {"id_test_verification": None, "symptoms_started_on": "2020-12-11"}
+)
+_OTHER_DATA = OtpData(
+    id_test_verification=None, symptoms_started_on=date(year=2020, month=12, day=11),
+)
 _CUN = "b39e0733843b1b5d7c558f52f117a824dc41216e0c2bb671b3d79ba82105dd94"
 _CUN_DATA = OtpData(
     id_test_verification="2d8af3b9-2c0a-4efc-9e15-72454f994e1f",
@@ -70,7 +101,7 @@ async def test_cun_store_success() -> None:
 async def test_store_failure_on_existent_key() -> None:
     key = f"~otp:{_OTP_SHA}"
     did_set = await managers.otp_redis.set(
-        key=key, value=_OTP_DATA_SERIALIZED, exist=StringCommandsMixin.SET_IF_NOT_EXIST
+        key=key, value=_OTHER_DATA_SERIALIZED, exist=StringCommandsMixin.SET_IF_NOT_EXIST
     )
     assert did_set is True
     with raises(OtpCollisionException):
@@ -80,8 +111,395 @@ async def test_store_failure_on_existent_key() -> None:
 async def test_cun_store_failure_on_existent_key() -> None:
     key = f"~otp:{_CUN}"
     did_set = await managers.otp_redis.set(
-        key=key, value=_CUN_DATA_SERIALIZED, exist=StringCommandsMixin.SET_IF_NOT_EXIST
+        key=key, value=_OTHER_DATA_SERIALIZED, exist=StringCommandsMixin.SET_IF_NOT_EXIST
     )
     assert did_set is True
     with raises(OtpCollisionException):
         await store(otp=_CUN, otp_data=_CUN_DATA)
+
+
+@mark.parametrize("otp, otp_data", [(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)])
+async def test_store_duplicate(otp: str, otp_data: OtpData) -> None:
+    assert await store(otp=otp, otp_data=otp_data) == AuthorizationOutcome.STORED
+    assert await store(otp=otp, otp_data=otp_data) == AuthorizationOutcome.DUPLICATE
+    with raises(OtpCollisionException):
+        await store(otp=otp, otp_data=_OTHER_DATA)
+
+
+async def test_store_many_success() -> None:
+    assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)]) == [
+        AuthorizationOutcome.STORED,
+        AuthorizationOutcome.STORED,
+    ]
+    for key, expected in (
+        (f"~otp:{_OTP_SHA}", _OTP_DATA_SERIALIZED),
+        (f"~otp:{_CUN}", _CUN_DATA_SERIALIZED),
+    ):
+        actual = await managers.otp_redis.get(key=key)
+        assert json.loads(actual).items() == json.loads(expected).items()
+        ttl = await managers.otp_redis.ttl(key=key)
+        assert 0 < ttl <= config.OTP_EXPIRATION_SECONDS
+
+
+async def test_store_many_collisions() -> None:
+    await store(otp=_OTP, otp_data=_OTP_DATA)
+    assert await store_many(
+        [(_OTP, _OTP_DATA), (_CUN, _CUN_DATA), (_CUN, _CUN_DATA), (_CUN, _OTHER_DATA)]
+    ) == [
+        AuthorizationOutcome.DUPLICATE,
+        AuthorizationOutcome.STORED,
+        AuthorizationOutcome.DUPLICATE,
+        AuthorizationOutcome.COLLISION,
+    ]
+
+
+async def test_store_many_empty() -> None:
+    assert await store_many([]) == []
+
+
+async def test_store_binary_format() -> None:
+    key = b"~otp:" + bytes.fromhex(_CUN)
+    with patch.object(config, "OTP_STORAGE_FORMAT", StorageFormat.BINARY):
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+        with raises(OtpCollisionException):
+            await store(otp=_CUN, otp_data=_OTHER_DATA)
+    assert await managers.otp_redis.get(key=f"~otp:{_CUN}") is None
+    actual = await managers.otp_redis.get(key=key, encoding=None)
+    assert len(actual) == 20
+    assert decode_otp_data(actual) == _CUN_DATA
+    ttl = await managers.otp_redis.ttl(key=key)
+    assert 0 < ttl <= config.OTP_EXPIRATION_SECONDS
+
+
+@mark.parametrize("dual_read", [True, False])
+async def test_store_dual_read(dual_read: bool) -> None:
+    await store(otp=_OTP, otp_data=_OTP_DATA)
+    with patch.object(config, "OTP_STORAGE_FORMAT", StorageFormat.BINARY), patch.object(
+        config, "OTP_STORAGE_DUAL_READ", dual_read
+    ):
+        if dual_read:
+            with raises(OtpCollisionException):
+                await store(otp=_OTP, otp_data=_OTHER_DATA)
+            assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)]) == [
+                AuthorizationOutcome.DUPLICATE,
+                AuthorizationOutcome.STORED,
+            ]
+        else:
+            await store(otp=_OTP, otp_data=_OTHER_DATA)
+
+
+async def test_store_recent_filter() -> None:
+    key = f"~otp:{_OTP_SHA}"
+    with patch.object(config, "OTP_RECENT_FILTER_ENABLED", True):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        assert await store_many([(_CUN, _CUN_DATA)]) == [AuthorizationOutcome.STORED]
+        # The OTPs are answered by the filter, without reaching the database.
+        await managers.otp_redis.delete(key, f"~otp:{_CUN}")
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        with raises(OtpCollisionException):
+            await store(otp=_OTP, otp_data=_OTHER_DATA)
+        assert await store_many([(_OTP, _OTHER_DATA), (_CUN, _CUN_DATA)]) == [
+            AuthorizationOutcome.COLLISION,
+            AuthorizationOutcome.DUPLICATE,
+        ]
+        assert await managers.otp_redis.get(key=key) is None
+    await store(otp=_OTP, otp_data=_OTHER_DATA)
+
+
+async def test_store_recent_filter_after_consume() -> None:
+    with patch.object(config, "OTP_RECENT_FILTER_ENABLED", True):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        assert await consume(_OTP) == _OTP_DATA
+        # The consumed OTP is forgotten by the filter, and can be authorised again.
+        assert await store(otp=_OTP, otp_data=_OTP_DATA) == AuthorizationOutcome.STORED
+        assert await consume(_OTP) == _OTP_DATA
+        assert await store(otp=_OTP, otp_data=_OTHER_DATA) == AuthorizationOutcome.STORED
+        assert await consume(_OTP) == _OTHER_DATA
+
+
+async def test_store_monitoring() -> None:
+    with patch("immuni_otp.helpers.otp.OTP_AUTHORIZATIONS") as authorizations, patch(
+        "immuni_otp.helpers.storage.OTP_REDIS_SECONDS"
+    ) as redis_seconds, patch(
+        "immuni_otp.helpers.storage.OTP_REDIS_POOL_WAIT_SECONDS"
+    ) as pool_wait:
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+        with raises(OtpCollisionException):
+            await store(otp=_CUN, otp_data=_OTHER_DATA)
+    assert [call.args for call in authorizations.labels.call_args_list] == [
+        ("otp", "stored"),
+        ("cun", "stored"),
+        ("cun", "collision"),
+    ]
+    assert redis_seconds.labels.call_count == 3
+    assert pool_wait.observe.call_count == 3
+
+
+async def test_store_waits_for_free_connection() -> None:
+    pool = managers.otp_redis.connection
+    with patch.object(type(pool), "freesize", new_callable=PropertyMock) as freesize, patch(
+        "immuni_otp.helpers.storage.OTP_REDIS_POOL_WAIT_SECONDS"
+    ) as pool_wait, patch("immuni_otp.helpers.storage.OTP_REDIS_POOL_WAITERS") as pool_waiters:
+        freesize.return_value = 0
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        with raises(OtpCollisionException):
+            await store(otp=_OTP, otp_data=_OTHER_DATA)
+    assert pool_wait.observe.call_count == 2
+    pool_waiters.labels.assert_called_with("0")
+    assert pool_waiters.labels.return_value.track_inprogress.call_count == 2
+    assert await managers.otp_redis.exists(f"~otp:{_OTP_SHA}")
+
+
+@mark.parametrize(
+    "otp, otp_data, storage_format",
+    [
+        (otp, otp_data, storage_format)
+        for otp, otp_data in ((_OTP, _OTP_DATA), (_CUN, _CUN_DATA))
+        for storage_format in StorageFormat
+    ],
+)
+async def test_consume(otp: str, otp_data: OtpData, storage_format: StorageFormat) -> None:
+    with patch.object(config, "OTP_STORAGE_FORMAT", storage_format):
+        await store(otp=otp, otp_data=otp_data)
+        assert await consume(otp) == otp_data
+        assert not await managers.otp_redis.keys("~otp:*")
+        assert await consume(otp) is None
+        # The consumed OTP can be authorised again.
+        await store(otp=otp, otp_data=_OTHER_DATA)
+        assert await consume(otp) == _OTHER_DATA
+
+
+async def test_consume_missing() -> None:
+    assert await consume(_OTP) is None
+
+
+@mark.parametrize("dual_read", [True, False])
+async def test_consume_dual_read(dual_read: bool) -> None:
+    await store(otp=_OTP, otp_data=_OTP_DATA)
+    with patch.object(config, "OTP_STORAGE_FORMAT", StorageFormat.BINARY), patch.object(
+        config, "OTP_STORAGE_DUAL_READ", dual_read
+    ):
+        assert await consume(_OTP) == (_OTP_DATA if dual_read else None)
+
+
+def _admission(max_in_flight: int) -> Admission:
+    return Admission(
+        limiter=InFlightLimiter(max_in_flight=max_in_flight),
+        breaker=CircuitBreaker(
+            window_size=1,
+            min_calls=1,
+            failure_rate_threshold=1,
+            slow_call_seconds=1,
+            slow_call_rate_threshold=1,
+            open_seconds=10,
+        ),
+        retry_after_seconds=1,
+    )
+
+
+async def test_store_admission_control() -> None:
+    with patch.object(config, "OTP_ADMISSION_CONTROL_ENABLED", True), patch(
+        "immuni_otp.helpers.otp._redis_admission", _admission(max_in_flight=1)
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        assert await store_many([(_CUN, _CUN_DATA)]) == [AuthorizationOutcome.STORED]
+        with patch.object(RedisStorage, "store", side_effect=ConnectionError()):
+            with raises(ConnectionError):
+                await store(otp=_OTP, otp_data=_OTHER_DATA)
+        # The breaker is now open.
+        with raises(ServiceUnavailableException) as exception:
+            await store(otp=_OTP, otp_data=_OTHER_DATA)
+        assert exception.value.retry_after == 10
+        with raises(ServiceUnavailableException):
+            await store_many([(_OTP, _OTHER_DATA)])
+
+
+async def test_store_admission_control_limit() -> None:
+    with patch.object(config, "OTP_ADMISSION_CONTROL_ENABLED", True), patch(
+        "immuni_otp.helpers.otp._redis_admission", _admission(max_in_flight=0)
+    ):
+        with raises(ServiceUnavailableException):
+            await store(otp=_OTP, otp_data=_OTP_DATA)
+    assert not await managers.otp_redis.exists(f"~otp:{_OTP_SHA}")
+
+
+@fixture
+def buffer(tmp_path: Path) -> Iterator[RingBuffer]:
+    ring_buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=1024)
+    with patch.object(managers, "_otp_buffer", ring_buffer):
+        yield ring_buffer
+    ring_buffer.close()
+
+
+async def test_store_buffered_when_unreachable(buffer: RingBuffer) -> None:
+    with patch.object(RedisStorage, "store", side_effect=ConnectionRefusedError()), patch(
+        "immuni_otp.helpers.otp.OTP_AUTHORIZATIONS"
+    ) as authorizations:
+        await store(otp=_OTP, otp_data=_OTP_DATA)
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+    authorizations.labels.assert_called_with("cun", AuthorizationOutcome.BUFFERED.value)
+    assert len(buffer) == 2
+
+    await replay_buffered()
+    assert len(buffer) == 0
+    assert await managers.otp_redis.get(f"~otp:{_OTP_SHA}") == _OTP_DATA_SERIALIZED
+    assert await managers.otp_redis.get(f"~otp:{_CUN}") == _CUN_DATA_SERIALIZED
+    assert 0 < await managers.otp_redis.ttl(f"~otp:{_OTP_SHA}") < config.OTP_EXPIRATION_SECONDS
+    with raises(OtpCollisionException):
+        await store(otp=_OTP, otp_data=_OTHER_DATA)
+
+
+async def test_store_buffered_when_coalesced(buffer: RingBuffer) -> None:
+    with patch.object(config, "OTP_STORE_COALESCING_ENABLED", True), patch.object(
+        RedisStorage, "store_many", side_effect=ConnectionResetError()
+    ):
+        await asyncio.gather(
+            store(otp=_OTP, otp_data=_OTP_DATA), store(otp=_CUN, otp_data=_CUN_DATA)
+        )
+    assert len(buffer) == 2
+
+
+async def test_store_buffered_out_of_binary_range(buffer: RingBuffer) -> None:
+    otp_data = OtpData(id_test_verification="x" * 256, symptoms_started_on=date(1969, 12, 31))
+    with patch.object(RedisStorage, "store", side_effect=ConnectionRefusedError()):
+        assert await store(otp=_OTP, otp_data=otp_data) == AuthorizationOutcome.BUFFERED
+    await replay_buffered()
+    assert decode_otp_data(await managers.otp_redis.get(f"~otp:{_OTP_SHA}")) == otp_data
+
+
+async def test_store_many_buffered_when_unreachable(buffer: RingBuffer) -> None:
+    with patch.object(RedisStorage, "store_many", side_effect=ConnectionRefusedError()):
+        assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)]) == [
+            AuthorizationOutcome.BUFFERED,
+            AuthorizationOutcome.BUFFERED,
+        ]
+    assert len(buffer) == 2
+
+    await replay_buffered()
+    assert await managers.otp_redis.get(f"~otp:{_OTP_SHA}") == _OTP_DATA_SERIALIZED
+    assert await managers.otp_redis.get(f"~otp:{_CUN}") == _CUN_DATA_SERIALIZED
+
+
+async def test_store_many_not_buffered() -> None:
+    with patch.object(RedisStorage, "store_many", side_effect=ConnectionRefusedError()):
+        with raises(ConnectionRefusedError):
+            await store_many([(_OTP, _OTP_DATA)])
+
+
+async def test_store_not_buffered() -> None:
+    with patch.object(RedisStorage, "store", side_effect=ConnectionRefusedError()):
+        with raises(ConnectionRefusedError):
+            await store(otp=_OTP, otp_data=_OTP_DATA)
+    await replay_buffered()
+
+
+async def test_store_not_buffered_when_full(tmp_path: Path) -> None:
+    full_buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=16)
+    with patch.object(managers, "_otp_buffer", full_buffer), patch.object(
+        RedisStorage, "store", side_effect=ConnectionRefusedError()
+    ):
+        with raises(ConnectionRefusedError):
+            await store(otp=_OTP, otp_data=_OTP_DATA)
+    full_buffer.close()
+
+
+async def test_replay_discards_expired_and_colliding(buffer: RingBuffer) -> None:
+    await store(otp=_OTP, otp_data=_OTP_DATA)
+    buffer.append(_encode_buffered(_OTP_SHA, _OTHER_DATA, expires_at=time.time() + 60))
+    buffer.append(_encode_buffered(_CUN, _CUN_DATA, expires_at=time.time() - 1))
+    with patch("immuni_otp.helpers.otp.OTP_BUFFER_REPLAYS") as replays:
+        await replay_buffered()
+    assert [call.args for call in replays.labels.call_args_list] == [
+        (AuthorizationOutcome.COLLISION.value,),
+        ("expired",),
+    ]
+    assert len(buffer) == 0
+    assert await managers.otp_redis.get(f"~otp:{_OTP_SHA}") == _OTP_DATA_SERIALIZED
+    assert not await managers.otp_redis.exists(f"~otp:{_CUN}")
+
+
+async def test_replay_retries_while_unreachable(buffer: RingBuffer) -> None:
+    buffer.append(_encode_buffered(_OTP_SHA, _OTP_DATA, expires_at=time.time() + 60))
+    with patch.object(RedisStorage, "store", side_effect=ConnectionRefusedError()):
+        replay = asyncio.ensure_future(replay_buffered_forever(interval_seconds=0.01))
+        await asyncio.sleep(0.05)
+        assert len(buffer) == 1
+    await asyncio.sleep(0.05)
+    replay.cancel()
+    assert len(buffer) == 0
+    assert await managers.otp_redis.get(f"~otp:{_OTP_SHA}") == _OTP_DATA_SERIALIZED
+
+
+async def test_store_rate_limited() -> None:
+    with patch.object(config, "OTP_RATE_LIMIT_PER_SECOND", 0.001), patch.object(
+        config, "OTP_RATE_LIMIT_BURST", 2
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA, client="his-1")
+        # Retries take a token as well.
+        await store(otp=_OTP, otp_data=_OTP_DATA, client="his-1")
+        with raises(TooManyRequestsException) as exception:
+            await store(otp=_CUN, otp_data=_CUN_DATA, client="his-1")
+        assert exception.value.retry_after >= 1
+
+        # Each client has its own bucket, while unidentified callers are not rate limited.
+        await store(otp=_CUN, otp_data=_CUN_DATA, client="his-2")
+        assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)], client="his-2") == [
+            AuthorizationOutcome.DUPLICATE,
+            AuthorizationOutcome.RATE_LIMITED,
+        ]
+        await store(otp=_CUN, otp_data=_CUN_DATA)
+
+    # The bucket expires once it would be full again.
+    assert 0 < await managers.otp_redis.pttl("~otp-rate:his-1") <= 2 * 1000 * 1000
+
+
+async def test_store_rate_limit_refills() -> None:
+    with patch.object(config, "OTP_RATE_LIMIT_PER_SECOND", 50), patch.object(
+        config, "OTP_RATE_LIMIT_BURST", 1
+    ):
+        await store(otp=_OTP, otp_data=_OTP_DATA, client="his-1")
+        with raises(TooManyRequestsException):
+            await store(otp=_CUN, otp_data=_CUN_DATA, client="his-1")
+        await asyncio.sleep(0.05)
+        await store(otp=_CUN, otp_data=_CUN_DATA, client="his-1")
+
+
+async def test_store_rate_limited_when_coalesced() -> None:
+    with patch.object(config, "OTP_STORE_COALESCING_ENABLED", True), patch.object(
+        config, "OTP_RATE_LIMIT_PER_SECOND", 0.001
+    ), patch.object(config, "OTP_RATE_LIMIT_BURST", 1):
+        results = await asyncio.gather(
+            store(otp=_OTP, otp_data=_OTP_DATA, client="his-1"),
+            store(otp=_CUN, otp_data=_CUN_DATA, client="his-1"),
+            store(otp="ABCDE12345", otp_data=_OTP_DATA, client="his-2"),
+            return_exceptions=True,
+        )
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], TooManyRequestsException)
+
+
+async def _slow_store(*args: Any, **kwargs: Any) -> AuthorizationOutcome:
+    await asyncio.sleep(0.1)
+    return AuthorizationOutcome.STORED
+
+
+@mark.parametrize("coalescing", [True, False])
+async def test_store_deadline_exceeded(buffer: RingBuffer, coalescing: bool) -> None:
+    with patch.object(config, "OTP_STORE_COALESCING_ENABLED", coalescing), patch.object(
+        RedisStorage, "store", side_effect=_slow_store
+    ), patch.object(RedisStorage, "store_many", side_effect=_slow_store):
+        with raises(DeadlineExceededException):
+            await store(otp=_OTP, otp_data=_OTP_DATA, deadline=time.monotonic() + 0.01)
+    # The authorization is not buffered, the request failing instead.
+    assert len(buffer) == 0
+
+
+async def test_store_many_deadline_exceeded() -> None:
+    with patch.object(RedisStorage, "store_many", side_effect=_slow_store):
+        with raises(DeadlineExceededException):
+            await store_many([(_OTP, _OTP_DATA)], deadline=time.monotonic() + 0.01)
+    assert await store_many([(_OTP, _OTP_DATA)], deadline=time.monotonic() + 1) == [
+        AuthorizationOutcome.STORED
+    ]
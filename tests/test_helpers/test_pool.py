@@ -0,0 +1,89 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from unittest.mock import patch
+
+from aioredis import RedisConnection, create_redis_pool
+from pytest import mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.helpers.pool import observe_pool, observe_pools_forever, warm_up
+
+pytestmark = mark.redis
+
+
+async def test_warm_up() -> None:
+    redis = await create_redis_pool(config.OTP_CACHE_REDIS_URL, minsize=2, maxsize=4)
+    try:
+        with patch.object(
+            RedisConnection, "execute", side_effect=RedisConnection.execute, autospec=True
+        ) as execute:
+            await warm_up(redis)
+        assert [call.args[1] for call in execute.call_args_list] == [b"PING", b"PING"]
+        assert len({call.args[0] for call in execute.call_args_list}) == 2
+        assert redis.connection.size == redis.connection.freesize == 2
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+async def test_warm_up_releases_connections_on_failure() -> None:
+    redis = await create_redis_pool(config.OTP_CACHE_REDIS_URL, minsize=2, maxsize=4)
+    try:
+        with patch.object(RedisConnection, "execute", side_effect=ConnectionResetError()):
+            with raises(ConnectionResetError):
+                await warm_up(redis)
+        assert redis.connection.freesize == 2
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+async def test_observe_pool() -> None:
+    redis = await create_redis_pool(config.OTP_CACHE_REDIS_URL, minsize=2, maxsize=4)
+    try:
+        with patch("immuni_otp.helpers.pool.OTP_REDIS_POOL_SIZE") as pool_size, patch(
+            "immuni_otp.helpers.pool.OTP_REDIS_POOL_FREE"
+        ) as pool_free:
+            connection = await redis.connection.acquire()
+            observe_pool(1, redis.connection)
+            redis.connection.release(connection)
+        pool_size.labels.assert_called_once_with("1")
+        pool_size.labels.return_value.set.assert_called_once_with(2)
+        pool_free.labels.return_value.set.assert_called_once_with(1)
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+async def test_observe_pools_forever() -> None:
+    redis = await create_redis_pool(config.OTP_CACHE_REDIS_URL, minsize=2, maxsize=4)
+    try:
+        with patch("immuni_otp.helpers.pool.OTP_REDIS_POOL_FREE") as pool_free:
+            sampling = asyncio.ensure_future(
+                observe_pools_forever([("0", redis.connection)], interval_seconds=0.01)
+            )
+            await asyncio.sleep(0.005)
+            connection = await redis.connection.acquire()
+            # The gauges follow the pool without any OTP being stored.
+            await asyncio.sleep(0.02)
+            redis.connection.release(connection)
+            sampling.cancel()
+        assert [call.args for call in pool_free.labels.return_value.set.call_args_list][:2] == [
+            (2,),
+            (1,),
+        ]
+    finally:
+        redis.close()
+        await redis.wait_closed()
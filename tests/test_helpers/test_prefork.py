@@ -0,0 +1,130 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, List
+from unittest.mock import Mock, patch
+
+from immuni_otp.helpers import prefork
+from immuni_otp.helpers.prefork import (
+    Supervisor,
+    bind_socket,
+    log_access,
+    recycle_after,
+    worker_cpu,
+)
+
+
+def test_bind_socket_reuse_port() -> None:
+    first = bind_socket("127.0.0.1", 0)
+    second = bind_socket("127.0.0.1", first.getsockname()[1])
+    try:
+        assert first.getsockname() == second.getsockname()
+    finally:
+        first.close()
+        second.close()
+
+
+def test_worker_cpu() -> None:
+    assert [worker_cpu(slot, cpus=[6, 2, 4]) for slot in range(5)] == [2, 4, 6, 2, 4]
+
+
+async def test_recycle_after() -> None:
+    middlewares: List[Callable[..., Any]] = []
+    app = Mock()
+    app.middleware.return_value = middlewares.append
+    recycle_after(app, max_requests=2)
+    app.middleware.assert_called_once_with("response")
+
+    await middlewares[0](Mock(), Mock())
+    await asyncio.sleep(0)
+    app.stop.assert_not_called()
+    await middlewares[0](Mock(), Mock())
+    await asyncio.sleep(0)
+    app.stop.assert_called_once_with()
+
+
+async def test_log_access() -> None:
+    middlewares: List[Callable[..., Any]] = []
+    app = Mock()
+    app.middleware.return_value = middlewares.append
+    log_access(app)
+    assert [call.args for call in app.middleware.call_args_list] == [("request",), ("response",)]
+
+    request = Mock(method="POST", path="/v1/otp", ip="10.0.0.1")
+    with patch.object(prefork.time, "time", side_effect=[100.0, 100.25]), patch.object(
+        prefork, "_ACCESS_LOGGER"
+    ) as logger:
+        await middlewares[0](request)
+        await middlewares[1](request, Mock(status=200))
+
+    logger.info.assert_called_once_with(
+        "Request served.",
+        extra=dict(
+            timestamp=100.0,
+            request_method="POST",
+            request_path="/v1/otp",
+            status=200,
+            duration_ms=250.0,
+            remote_addr="10.0.0.1",
+        ),
+    )
+
+
+def _stop_after(seconds: float) -> None:
+    threading.Timer(seconds, lambda: os.kill(os.getpid(), signal.SIGTERM)).start()
+
+
+def test_supervisor_replaces_exited_workers(tmp_path: Path) -> None:
+    def _target(slot: int) -> None:
+        (tmp_path / f"{slot}-{os.getpid()}").touch()
+        time.sleep(0.1)
+
+    handler = signal.getsignal(signal.SIGTERM)
+    _stop_after(0.6)
+    with patch("immuni_otp.helpers.prefork._MIN_WORKER_SECONDS", 0.05):
+        Supervisor(workers=2, target=_target, kill_timeout_seconds=1).run()
+    spawned = [path.name.split("-")[0] for path in tmp_path.iterdir()]
+    assert spawned.count("0") >= 2
+    assert spawned.count("1") >= 2
+    assert signal.getsignal(signal.SIGTERM) == handler
+
+
+def test_supervisor_kills_stuck_workers() -> None:
+    def _target(slot: int) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        time.sleep(30)
+
+    _stop_after(0.3)
+    _stop_after(0.4)
+    started_at = time.monotonic()
+    Supervisor(workers=2, target=_target, kill_timeout_seconds=0.3).run()
+    assert time.monotonic() - started_at < 5
+
+
+def test_supervisor_delays_failing_workers(tmp_path: Path) -> None:
+    def _target(slot: int) -> None:
+        (tmp_path / str(os.getpid())).touch()
+        raise RuntimeError()
+
+    _stop_after(0.3)
+    started_at = time.monotonic()
+    Supervisor(workers=1, target=_target, kill_timeout_seconds=1).run()
+    # The failed worker is not replaced while stopping, after the respawn delay.
+    assert time.monotonic() - started_at >= 1
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,91 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import selectors
+import threading
+import time
+from datetime import date
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_common.models.marshmallow.schemas import OtpDataSchema
+from immuni_otp.helpers.profiler import AWAIT_ROOT, CPU_ROOT, IDLE_ROOT, StackSampler, profile
+
+_OTP_DATA = OtpData(symptoms_started_on=date(2020, 12, 10), id_test_verification=None)
+
+
+async def _serialize_forever() -> None:
+    schema = OtpDataSchema()
+    while True:
+        for _ in range(1000):
+            schema.dumps(_OTP_DATA)
+        await asyncio.sleep(0.001)
+
+
+async def test_profile() -> None:
+    task = asyncio.ensure_future(_serialize_forever())
+    try:
+        collapsed = await profile(seconds=0.3, interval_seconds=0.001)
+    finally:
+        task.cancel()
+    stacks = [line.rsplit(" ", 1) for line in collapsed.splitlines()]
+    assert all(int(count) > 0 for _, count in stacks)
+    assert [int(count) for _, count in stacks] == sorted(
+        (int(count) for _, count in stacks), reverse=True
+    )
+    assert any(
+        stack.startswith(f"{CPU_ROOT};")
+        and f"{__name__}:_serialize_forever" in stack
+        and "marshmallow." in stack
+        for stack, _ in stacks
+    )
+    assert any(
+        stack.startswith(f"{AWAIT_ROOT};{__name__}:_serialize_forever;asyncio.tasks:sleep")
+        for stack, _ in stacks
+    )
+    assert not any(
+        stack.startswith(AWAIT_ROOT) and "immuni_otp.helpers.profiler" in stack
+        for stack, _ in stacks
+    )
+
+
+async def test_sampler_without_samples() -> None:
+    sampler = StackSampler(asyncio.get_event_loop(), thread_id=-1)
+    assert sampler.collapsed() == ""
+    sampler.sample()
+    assert not any(line.startswith(f"{CPU_ROOT};") for line in sampler.collapsed().splitlines())
+
+
+async def test_sampler_skips_running_task() -> None:
+    sampler = StackSampler(asyncio.get_event_loop(), threading.get_ident())
+    sampler.sample()
+    collapsed = sampler.collapsed()
+    assert f"{__name__}:test_sampler_skips_running_task" in collapsed
+    assert not any(
+        line.startswith(AWAIT_ROOT) and f"{__name__}:test_sampler_skips_running_task" in line
+        for line in collapsed.splitlines()
+    )
+
+
+async def test_sampler_idle() -> None:
+    selector = selectors.DefaultSelector()
+    thread = threading.Thread(target=selector.select, args=(0.5,))
+    thread.start()
+    time.sleep(0.1)
+    sampler = StackSampler(asyncio.get_event_loop(), thread.ident or -1)
+    sampler.sample()
+    thread.join()
+    selector.close()
+    (line,) = sampler.collapsed().splitlines()
+    assert line.startswith(f"{IDLE_ROOT};threading:")
+    assert line.endswith(";selectors:select 1")
@@ -0,0 +1,88 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from typing import List
+
+from immuni_otp.helpers.recent import RecentKeys
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_contains_until_ttl() -> None:
+    clock = _Clock()
+    recent = RecentKeys(ttl_seconds=150, bucket_seconds=10, max_size=100, clock=clock)
+    recent.add("key", added_at=clock.now)
+    assert "key" in recent
+    assert "other" not in recent
+    clock.now += 149.9
+    assert "key" in recent
+    clock.now += 0.1
+    assert "key" not in recent
+    assert len(recent) == 0
+
+
+def test_bucket_expires_with_earliest_key() -> None:
+    clock = _Clock()
+    recent = RecentKeys(ttl_seconds=150, bucket_seconds=10, max_size=100, clock=clock)
+    recent.add("first", added_at=clock.now - 1)
+    clock.now += 5
+    recent.add("second", added_at=clock.now)
+    clock.now += 144
+    # Both keys share the bucket of the earliest one, so they expire together, conservatively.
+    assert "second" not in recent
+
+
+def test_buckets_expire_independently() -> None:
+    clock = _Clock()
+    recent = RecentKeys(ttl_seconds=150, bucket_seconds=10, max_size=100, clock=clock)
+    keys: List[str] = []
+    for index in range(20):
+        keys.append(f"key-{index}")
+        recent.add(keys[-1], added_at=clock.now)
+        clock.now += 10
+    clock.now -= 10
+    assert len(recent) == 15
+    assert keys[4] not in recent
+    assert all(key in recent for key in keys[5:])
+
+
+def test_max_size() -> None:
+    clock = _Clock()
+    recent = RecentKeys(ttl_seconds=150, bucket_seconds=10, max_size=3, clock=clock)
+    for index in range(3):
+        recent.add(f"key-{index}", added_at=clock.now)
+        clock.now += 10
+    recent.add("key-3", added_at=clock.now)
+    assert len(recent) == 3
+    assert "key-0" not in recent
+    assert "key-3" in recent
+    recent.clear()
+    assert len(recent) == 0
+
+
+def test_discard() -> None:
+    clock = _Clock()
+    recent = RecentKeys(ttl_seconds=150, bucket_seconds=10, max_size=100, clock=clock)
+    recent.add("key", added_at=clock.now)
+    recent.add("other", added_at=clock.now)
+    recent.discard("key")
+    recent.discard("missing")
+    assert "key" not in recent
+    assert "other" in recent
+    assert len(recent) == 1
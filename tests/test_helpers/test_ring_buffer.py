@@ -0,0 +1,149 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import mmap
+from pathlib import Path
+from random import Random
+from typing import List, Tuple
+from unittest.mock import patch
+
+from pytest import raises
+
+from immuni_otp.helpers.ring_buffer import RingBuffer
+
+
+def test_fifo(tmp_path: Path) -> None:
+    buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=64)
+    assert len(buffer) == 0
+    assert buffer.peek() is None
+    buffer.pop()
+    assert buffer.append(b"first")
+    assert buffer.append(b"")
+    assert buffer.append(b"third")
+    assert len(buffer) == 3
+    assert buffer.size_bytes == 3 * 8 + 10
+    assert buffer.peek() == b"first"
+    buffer.pop()
+    assert buffer.peek() == b""
+    buffer.pop()
+    assert buffer.peek() == b"third"
+    buffer.pop()
+    assert len(buffer) == 0
+    assert buffer.size_bytes == 0
+    buffer.close()
+
+
+def test_full(tmp_path: Path) -> None:
+    buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=32)
+    assert buffer.append(b"x" * 8)
+    assert buffer.append(b"y" * 8)
+    assert not buffer.append(b"z")
+    buffer.pop()
+    assert buffer.append(b"z" * 8)
+    assert buffer.peek() == b"y" * 8
+    buffer.close()
+
+
+def test_wrap_around_and_recovery(tmp_path: Path) -> None:
+    path = str(tmp_path / "buffer.bin")
+    random = Random(0)
+    buffer = RingBuffer(path, capacity_bytes=100)
+    expected: List[bytes] = []
+    for operation in range(2000):
+        if random.random() < 0.55:
+            payload = bytes(random.getrandbits(8) for _ in range(random.randint(0, 30)))
+            if buffer.append(payload):
+                expected.append(payload)
+        elif expected:
+            assert buffer.peek() == expected.pop(0)
+            buffer.pop()
+        assert len(buffer) == len(expected)
+        if operation % 100 == 0:
+            # The records survive reopening, and the capacity of the existing file is retained.
+            buffer.close()
+            buffer = RingBuffer(path, capacity_bytes=1000)
+            assert len(buffer) == len(expected)
+            assert buffer.peek() == (expected[0] if expected else None)
+    buffer.close()
+
+
+def test_recovery_truncates_corrupted_records(tmp_path: Path) -> None:
+    path = tmp_path / "buffer.bin"
+    buffer = RingBuffer(str(path), capacity_bytes=64)
+    buffer.append(b"first")
+    buffer.append(b"second")
+    buffer.close()
+    # Tear the last byte of the second record, as if the process crashed while writing it.
+    content = bytearray(path.read_bytes())
+    content[content.index(b"second") + 5] ^= 0xFF
+    path.write_bytes(bytes(content))
+
+    buffer = RingBuffer(str(path), capacity_bytes=64)
+    assert len(buffer) == 1
+    assert buffer.peek() == b"first"
+    assert buffer.append(b"third")
+    buffer.pop()
+    assert buffer.peek() == b"third"
+    buffer.close()
+
+
+def test_recovery_resets_invalid_header(tmp_path: Path) -> None:
+    path = tmp_path / "buffer.bin"
+    buffer = RingBuffer(str(path), capacity_bytes=64)
+    buffer.append(b"first")
+    buffer.close()
+    content = bytearray(path.read_bytes())
+    content[0] ^= 0xFF
+    path.write_bytes(bytes(content))
+
+    buffer = RingBuffer(str(path), capacity_bytes=64)
+    assert len(buffer) == 0
+    assert buffer.peek() is None
+    buffer.close()
+
+
+def test_slots_are_exclusive(tmp_path: Path) -> None:
+    directory = str(tmp_path / "buffers")
+    first = RingBuffer.open_slot(directory, capacity_bytes=64)
+    second = RingBuffer.open_slot(directory, capacity_bytes=64)
+    assert first.path != second.path
+    with raises(BlockingIOError):
+        RingBuffer(first.path, capacity_bytes=64)
+    first.append(b"orphan")
+    first.close()
+    # The records of a closed (or crashed) process are adopted by the next one.
+    adopted = RingBuffer.open_slot(directory, capacity_bytes=64)
+    assert adopted.path == first.path
+    assert adopted.peek() == b"orphan"
+    adopted.close()
+    second.close()
+
+
+def test_flushes_changed_pages_only(tmp_path: Path) -> None:
+    flushes: List[Tuple[int, int]] = []
+
+    class _Map(mmap.mmap):
+        def flush(self, *args: int) -> None:
+            flushes.append(args)  # type: ignore
+            super().flush(*args)
+
+    with patch.object(mmap, "mmap", _Map):
+        buffer = RingBuffer(str(tmp_path / "buffer.bin"), capacity_bytes=64 * mmap.PAGESIZE)
+    for _ in range(10):
+        assert buffer.append(b"x" * 1000)
+    buffer.pop()
+    assert flushes
+    for offset, size in flushes:
+        assert offset % mmap.PAGESIZE == 0
+        assert size <= 2 * mmap.PAGESIZE
+    buffer.close()
@@ -0,0 +1,93 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import Counter
+from unittest.mock import patch
+
+from pytest import mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.core.managers import Managers
+from immuni_otp.helpers.otp import _key_for_otp, _otp_sha, store, store_many
+from immuni_otp.helpers.sharding import HashRing, shard_nodes
+from immuni_otp.helpers.storage import RedisStorage
+from immuni_otp.models.enums import AuthorizationOutcome
+from tests.test_helpers.test_otp import _CUN, _CUN_DATA, _OTP, _OTP_DATA
+
+_NODES = [f"redis://redis-{index}:6379/0" for index in range(4)]
+_KEYS = [f"~otp:{index}" for index in range(10000)]
+
+
+def test_ring_invalid_nodes() -> None:
+    with raises(ValueError):
+        HashRing(nodes=[], virtual_nodes=10)
+    with raises(ValueError):
+        HashRing(nodes=[_NODES[0], _NODES[0]], virtual_nodes=10)
+
+
+def test_ring_is_deterministic() -> None:
+    ring = HashRing(nodes=_NODES, virtual_nodes=160)
+    other_ring = HashRing(nodes=_NODES, virtual_nodes=160)
+    assert [ring.node_for(key) for key in _KEYS] == [other_ring.node_for(key) for key in _KEYS]
+
+
+def test_ring_is_balanced() -> None:
+    ring = HashRing(nodes=_NODES, virtual_nodes=160)
+    counts = Counter(ring.node_for(key) for key in _KEYS)
+    assert set(counts) == set(range(len(_NODES)))
+    assert all(count > len(_KEYS) / len(_NODES) * 0.75 for count in counts.values())
+
+
+def test_ring_remaps_few_keys_on_new_node() -> None:
+    ring = HashRing(nodes=_NODES, virtual_nodes=160)
+    grown_ring = HashRing(nodes=_NODES + ["redis://redis-4:6379/0"], virtual_nodes=160)
+    moved = [key for key in _KEYS if ring.node_for(key) != grown_ring.node_for(key)]
+    # Only the keys assigned to the new node should move, roughly a fifth of them.
+    assert all(grown_ring.node_for(key) == len(_NODES) for key in moved)
+    assert len(moved) < len(_KEYS) * 0.3
+
+
+def test_shard_nodes_ignore_urls() -> None:
+    assert shard_nodes(3) == ["shard-0", "shard-1", "shard-2"]
+    # Appending a shard leaves the identifiers of the existing ones unchanged.
+    assert shard_nodes(4)[:3] == shard_nodes(3)
+
+
+@mark.redis
+async def test_store_on_multiple_shards() -> None:
+    base_url = config.OTP_CACHE_REDIS_URL.rsplit("/", 1)[0]
+    urls = [f"{base_url}/1", f"{base_url}/2"]
+    sharded_managers = Managers()
+    with patch.object(config, "OTP_CACHE_REDIS_URLS", urls):
+        await sharded_managers.initialize()
+    try:
+        for otp_redis in sharded_managers.otp_redis_shards:
+            await otp_redis.flushdb()
+        with patch("immuni_otp.helpers.otp.managers", sharded_managers):
+            await store(otp=_OTP, otp_data=_OTP_DATA)
+            assert await store_many([(_OTP, _OTP_DATA), (_CUN, _CUN_DATA)]) == [
+                AuthorizationOutcome.DUPLICATE,
+                AuthorizationOutcome.STORED,
+            ]
+
+        storage = sharded_managers.otp_storage
+        assert isinstance(storage, RedisStorage)
+        for otp in (_OTP, _CUN):
+            key = _key_for_otp(otp)
+            shard = storage.redis_for(_otp_sha(otp))
+            for otp_redis in sharded_managers.otp_redis_shards:
+                assert (await otp_redis.exists(key)) == (otp_redis is shard)
+    finally:
+        for otp_redis in sharded_managers.otp_redis_shards:
+            await otp_redis.flushdb()
+        await sharded_managers.teardown()
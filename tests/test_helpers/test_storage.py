@@ -0,0 +1,96 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+
+from _pytest.fixtures import FixtureRequest
+from pytest import fixture, mark, param
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.storage import MemoryStorage, OtpStorage
+from immuni_otp.models.enums import AuthorizationOutcome
+
+_OTP_SHA = "b39e0733843b1b5d7c558f52f117a824dc41216e0c2bb671b3d79ba82105dd94"
+_OTHER_OTP_SHA = "0" * 64
+_OTP_DATA = OtpData(id_test_verification=None, symptoms_started_on=date(2020, 12, 10))
+_OTHER_DATA = OtpData(id_test_verification=None, symptoms_started_on=date(2020, 12, 11))
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@fixture
+def clock() -> _Clock:
+    return _Clock()
+
+
+@fixture(params=["memory", param("redis", marks=mark.redis)])
+def storage(request: FixtureRequest, clock: _Clock) -> OtpStorage:
+    if request.param == "memory":
+        return MemoryStorage(tick_seconds=1, clock=clock)
+    return managers.otp_storage
+
+
+async def test_store(storage: OtpStorage) -> None:
+    assert await storage.store(_OTP_SHA, _OTP_DATA) == AuthorizationOutcome.STORED
+    assert await storage.store(_OTP_SHA, _OTP_DATA) == AuthorizationOutcome.DUPLICATE
+    assert await storage.store(_OTP_SHA, _OTHER_DATA) == AuthorizationOutcome.COLLISION
+
+
+async def test_store_many(storage: OtpStorage) -> None:
+    await storage.store(_OTP_SHA, _OTP_DATA)
+    assert await storage.store_many(
+        [(_OTP_SHA, _OTP_DATA), (_OTHER_OTP_SHA, _OTHER_DATA), (_OTP_SHA, _OTHER_DATA)]
+    ) == [
+        AuthorizationOutcome.DUPLICATE,
+        AuthorizationOutcome.STORED,
+        AuthorizationOutcome.COLLISION,
+    ]
+    assert await storage.store_many([]) == []
+
+
+async def test_consume(storage: OtpStorage) -> None:
+    assert await storage.consume(_OTP_SHA) is None
+    await storage.store(_OTP_SHA, _OTP_DATA)
+    assert await storage.consume(_OTP_SHA) == _OTP_DATA
+    assert await storage.consume(_OTP_SHA) is None
+    assert await storage.store(_OTP_SHA, _OTHER_DATA) == AuthorizationOutcome.STORED
+
+
+async def test_flush(storage: OtpStorage) -> None:
+    await storage.store_many([(_OTP_SHA, _OTP_DATA), (_OTHER_OTP_SHA, _OTHER_DATA)])
+    await storage.flush()
+    assert await storage.consume(_OTP_SHA) is None
+    assert await storage.consume(_OTHER_OTP_SHA) is None
+
+
+async def test_memory_expiration(clock: _Clock) -> None:
+    storage = MemoryStorage(tick_seconds=1, clock=clock)
+    await storage.store(_OTP_SHA, _OTP_DATA)
+    clock.now += config.OTP_EXPIRATION_SECONDS - 0.5
+    assert await storage.store(_OTP_SHA, _OTHER_DATA) == AuthorizationOutcome.COLLISION
+    clock.now += 0.5
+    # Expired, even if the memory has not been reclaimed yet.
+    assert len(storage) == 1
+    assert await storage.consume(_OTP_SHA) is None
+    assert await storage.store(_OTP_SHA, _OTHER_DATA) == AuthorizationOutcome.STORED
+    clock.now += config.OTP_EXPIRATION_SECONDS + 1
+    assert await storage.consume(_OTHER_OTP_SHA) is None
+    assert len(storage) == 0
@@ -0,0 +1,49 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from sanic import Blueprint, Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse, text
+from sanic_openapi import swagger_blueprint
+from sanic_openapi.doc import route_specs
+
+from immuni_otp.apis import admin, health
+from immuni_otp.helpers.swagger import disable_api_docs
+
+
+def test_disable_api_docs() -> None:
+    bp = Blueprint("test", url_prefix="/test")
+
+    @bp.route("")
+    async def _handler(request: Request) -> HTTPResponse:  # pragma: no cover
+        return text("")
+
+    app = Sanic("test_disable_api_docs")
+    app.blueprint(swagger_blueprint)
+    app.blueprint(bp)
+    disable_api_docs(app)
+    assert not any(uri.startswith("/swagger") for uri in app.router.routes_all)
+    assert "/test" in app.router.routes_all
+    assert not any(
+        listener in app.listeners[event]
+        for event, listeners in swagger_blueprint.listeners.items()
+        for listener in listeners
+    )
+    assert list(app.blueprints) == ["test"]
+    # Nothing left to remove.
+    disable_api_docs(app)
+
+
+def test_internal_routes_excluded() -> None:
+    for handler in (admin.profile_worker, health.live, health.ready):
+        assert route_specs[handler].exclude
@@ -0,0 +1,101 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from random import Random
+from typing import Dict
+
+from pytest import mark
+
+from immuni_otp.helpers.timer_wheel import TimerWheel
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_expires_at_tick_resolution() -> None:
+    clock = _Clock()
+    wheel: TimerWheel[str] = TimerWheel(tick_seconds=1, slots=4, levels=2, clock=clock)
+    wheel.schedule("first", delay_seconds=2.5)
+    wheel.schedule("second", delay_seconds=3)
+    assert len(wheel) == 2
+    clock.now = 2.9
+    assert wheel.advance() == []
+    clock.now = 3
+    assert sorted(wheel.advance()) == ["first", "second"]
+    assert len(wheel) == 0
+    assert "first" not in wheel
+
+
+def test_cancel_and_reschedule() -> None:
+    clock = _Clock()
+    wheel: TimerWheel[str] = TimerWheel(tick_seconds=1, slots=4, levels=2, clock=clock)
+    wheel.schedule("cancelled", delay_seconds=1)
+    wheel.schedule("rescheduled", delay_seconds=1)
+    wheel.cancel("cancelled")
+    wheel.cancel("missing")
+    wheel.schedule("rescheduled", delay_seconds=10)
+    clock.now = 9
+    assert wheel.advance() == []
+    assert "rescheduled" in wheel
+    clock.now = 10
+    assert wheel.advance() == ["rescheduled"]
+
+
+def test_expirations_beyond_the_wheel() -> None:
+    clock = _Clock()
+    # The wheel spans 16 ticks only.
+    wheel: TimerWheel[str] = TimerWheel(tick_seconds=1, slots=4, levels=2, clock=clock)
+    wheel.schedule("far", delay_seconds=100)
+    clock.now = 99
+    assert wheel.advance() == []
+    clock.now = 100
+    assert wheel.advance() == ["far"]
+
+
+def test_idle_wheel_jumps_ahead() -> None:
+    clock = _Clock()
+    wheel: TimerWheel[str] = TimerWheel(tick_seconds=1, slots=4, levels=2, clock=clock)
+    clock.now = 10 ** 9
+    assert wheel.advance() == []
+    wheel.schedule("key", delay_seconds=1)
+    clock.now += 1
+    assert wheel.advance() == ["key"]
+
+
+@mark.parametrize("slots, levels", [(2, 2), (4, 3), (64, 4)])
+def test_random_schedules(slots: int, levels: int) -> None:
+    random = Random(slots)
+    clock = _Clock()
+    wheel: TimerWheel[int] = TimerWheel(tick_seconds=0.5, slots=slots, levels=levels, clock=clock)
+    expirations: Dict[int, float] = {}
+    for _ in range(2000):
+        if random.random() < 0.3:
+            key = random.randrange(300)
+            delay_seconds = random.uniform(0, 200)
+            wheel.schedule(key, delay_seconds=delay_seconds)
+            expirations[key] = clock.now + delay_seconds
+        if expirations and random.random() < 0.05:
+            key = random.choice(list(expirations))
+            wheel.cancel(key)
+            del expirations[key]
+        clock.now += random.choice((0, 0.1, 0.3, 1.7, 5))
+        # Keys never expire before time, nor later than a tick after.
+        for key in wheel.advance():
+            assert expirations.pop(key) <= clock.now
+        assert all(expiration > clock.now - 0.5 for expiration in expirations.values())
+        assert len(wheel) == len(expirations)
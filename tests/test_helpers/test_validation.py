@@ -0,0 +1,121 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import date
+from hashlib import sha256
+from random import Random
+from typing import Any, Dict, List
+from uuid import UUID, uuid1
+
+from marshmallow import Schema
+from pytest import mark
+
+from immuni_common.models.marshmallow.fields import IdTestVerification, IsoDate, OtpCode
+from immuni_otp.helpers.validation import (
+    OTP_CHARACTERS,
+    check_digit,
+    is_valid_otp,
+    parse_authorization,
+)
+
+_SCHEMA = Schema.from_dict(
+    dict(otp=OtpCode(), symptoms_started_on=IsoDate(), id_test_verification=IdTestVerification())
+)()
+
+
+def _random_otp(random: Random) -> str:
+    body = "".join(random.choice(OTP_CHARACTERS) for _ in range(9))
+    return body + check_digit(body)
+
+
+def _valid_bodies(random: Random, count: int) -> List[Dict[str, Any]]:
+    bodies: List[Dict[str, Any]] = []
+    for index in range(count):
+        otp = _random_otp(random)
+        symptoms_started_on = date.fromordinal(
+            date(2020, 1, 1).toordinal() + random.randint(0, 1000)
+        ).isoformat()
+        if index % 2:
+            bodies.append(
+                dict(
+                    otp=sha256(otp.encode("utf-8")).hexdigest(),
+                    symptoms_started_on=symptoms_started_on,
+                    id_test_verification=str(UUID(int=random.getrandbits(128), version=4)),
+                )
+            )
+        elif index % 4:
+            bodies.append(dict(otp=otp, symptoms_started_on=symptoms_started_on))
+        else:
+            bodies.append(
+                dict(otp=otp, symptoms_started_on=symptoms_started_on, id_test_verification=None)
+            )
+    return bodies
+
+
+_CUN = "b39e0733843b1b5d7c558f52f117a824dc41216e0c2bb671b3d79ba82105dd94"
+_INVALID_OTPS = [
+    "59FU36KR47",
+    "59fu36kr46",
+    "59FU36KR4",
+    "09FU36KR46",
+    "B9FU36KR46",
+    _CUN.upper(),
+    _CUN[:-1],
+    _CUN + "0",
+    None,
+    1234567890,
+]
+
+
+def _mutations(body: Dict[str, Any]) -> List[Any]:
+    return [
+        *({**body, "otp": otp} for otp in _INVALID_OTPS),
+        {**body, "symptoms_started_on": "2020-02-30"},
+        {**body, "symptoms_started_on": "2020-2-3"},
+        {**body, "symptoms_started_on": "20200203"},
+        {**body, "symptoms_started_on": "2020-W01-1"},
+        {**body, "symptoms_started_on": "2020-02-03T00:00:00"},
+        {**body, "symptoms_started_on": None},
+        {**body, "id_test_verification": str(uuid1())},
+        {**body, "id_test_verification": str(UUID(int=0, version=4)).upper()},
+        {**body, "id_test_verification": UUID(int=0, version=4).hex},
+        {**body, "id_test_verification": 1},
+        {**body, "other": "field"},
+        {key: value for key, value in body.items() if key != "otp"},
+        {key: value for key, value in body.items() if key != "symptoms_started_on"},
+        [body],
+        None,
+    ]
+
+
+@mark.parametrize("otp", ["59FU36KR46", "KJ23IWY5UJ"])
+def test_check_digit(otp: str) -> None:
+    assert check_digit(otp[:-1]) == otp[-1]
+    assert is_valid_otp(otp)
+    assert not is_valid_otp(otp[:-1] + ("A" if otp[-1] != "A" else "E"))
+
+
+def test_equivalence_with_generic_validation() -> None:
+    """
+    The specialized parser accepts the canonical valid bodies with the same values as the generic
+    validation, and leaves any other body to the generic validation.
+    """
+    for body in _valid_bodies(Random(0), 200):
+        loaded = _SCHEMA.load(body)
+        assert parse_authorization(body) == dict(
+            otp=loaded["otp"],
+            symptoms_started_on=loaded["symptoms_started_on"],
+            id_test_verification=loaded.get("id_test_verification"),
+        )
+        for mutation in _mutations(body):
+            assert parse_authorization(mutation) is None
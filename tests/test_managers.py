@@ -11,12 +11,18 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+from pathlib import Path
 from unittest.mock import PropertyMock, patch
 
-from pytest import raises
+from pytest import mark, raises
 
 from immuni_common.core.exceptions import ImmuniException
+from immuni_otp.core import config
 from immuni_otp.core.managers import Managers, managers
+from immuni_otp.helpers.audit import AuditLog, AuditRecord
+from immuni_otp.helpers.ring_buffer import RingBuffer
+from immuni_otp.helpers.storage import MemoryStorage, RedisStorage
+from immuni_otp.models.enums import StorageBackend
 
 
 def test_otp_failure() -> None:
@@ -26,6 +32,87 @@ def test_otp_failure() -> None:
             managers.otp_redis
 
 
+def test_otp_shards_failure() -> None:
+    uninitialized_managers = Managers()
+    with raises(ImmuniException):
+        uninitialized_managers.otp_storage
+    with raises(ImmuniException):
+        uninitialized_managers.otp_redis_shards
+
+
+@mark.redis
+def test_otp_redis_for_single_shard() -> None:
+    assert isinstance(managers.otp_storage, RedisStorage)
+    assert managers.otp_redis_shards == (managers.otp_redis,)
+    assert managers.otp_storage.redis_for("0" * 64) is managers.otp_redis
+
+
 async def test_teardown_on_uninitialized() -> None:
     uninitialized_managers = Managers()
     await uninitialized_managers.teardown()
+
+
+async def test_memory_storage() -> None:
+    memory_managers = Managers()
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.MEMORY):
+        await memory_managers.initialize()
+    try:
+        assert isinstance(memory_managers.otp_storage, MemoryStorage)
+        with raises(ImmuniException):
+            memory_managers.otp_redis
+    finally:
+        await memory_managers.teardown()
+
+
+@mark.redis
+async def test_buffer(tmp_path: Path) -> None:
+    assert managers.otp_buffer is None
+    buffered_managers = Managers()
+    with patch.object(config, "OTP_BUFFER_ENABLED", True), patch.object(
+        config, "OTP_BUFFER_DIRECTORY", str(tmp_path)
+    ):
+        await buffered_managers.initialize()
+    assert isinstance(buffered_managers.otp_buffer, RingBuffer)
+    await buffered_managers.teardown()
+    assert buffered_managers.otp_buffer is None
+
+
+@mark.redis
+async def test_pool_warm_up() -> None:
+    warm_managers = Managers()
+    with patch.object(config, "OTP_CACHE_REDIS_MIN_CONNECTIONS", 3), patch(
+        "immuni_otp.helpers.pool.OTP_REDIS_POOL_SIZE"
+    ) as pool_size:
+        await warm_managers.initialize()
+    try:
+        pool = warm_managers.otp_redis.connection
+        assert pool.size == pool.freesize == 3
+        pool_size.labels.assert_called_once_with("0")
+        pool_size.labels.return_value.set.assert_called_once_with(3)
+    finally:
+        await warm_managers.teardown()
+
+
+async def test_audit_log(tmp_path: Path) -> None:
+    assert managers.otp_audit_log is None
+    audited_managers = Managers()
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.MEMORY), patch.object(
+        config, "OTP_AUDIT_ENABLED", True
+    ), patch.object(config, "OTP_AUDIT_DIRECTORY", str(tmp_path)):
+        await audited_managers.initialize()
+    audit_log = audited_managers.otp_audit_log
+    assert isinstance(audit_log, AuditLog)
+    audit_log.push(
+        AuditRecord(
+            timestamp=0.0,
+            otp_sha="",
+            client=None,
+            outcome="stored",
+            validation_ms=0.0,
+            store_ms=0.0,
+        )
+    )
+    await audited_managers.teardown()
+    assert audited_managers.otp_audit_log is None
+    assert len(audit_log) == 0
+    assert len(list(tmp_path.iterdir())) == 1
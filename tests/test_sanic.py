@@ -0,0 +1,170 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+from pytest import mark, raises
+from sanic import Sanic
+
+from immuni_otp.apis import admin, health, otp
+from immuni_otp.core import config
+from immuni_otp.core.managers import managers
+from immuni_otp.helpers.audit import AuditLog, AuditRecord
+from immuni_otp.helpers.health import ProbeResult, redis_health
+from immuni_otp.models.enums import StorageBackend
+from immuni_otp.sanic import (
+    blueprints,
+    check_rate_limit,
+    start_audit_flush,
+    start_buffer_replay,
+    start_health_probe,
+    start_pool_sampling,
+    stop_audit_flush,
+    stop_buffer_replay,
+    stop_health_probe,
+    stop_pool_sampling,
+    stop_store_coalescing,
+)
+
+
+def test_blueprints() -> None:
+    assert blueprints() == (otp.bp,)
+    with patch.object(config, "OTP_PROFILER_ENABLED", True):
+        assert blueprints() == (otp.bp, admin.bp)
+    with patch.object(config, "OTP_HEALTH_ENABLED", True):
+        assert blueprints() == (otp.bp, health.bp)
+
+
+async def test_check_rate_limit(sanic: Sanic) -> None:
+    loop = asyncio.get_event_loop()
+    with patch.object(config, "OTP_RATE_LIMIT_PER_SECOND", 0):
+        await check_rate_limit(sanic, loop)
+        with patch.object(config, "OTP_RATE_LIMIT_ENABLED", True), raises(ValueError):
+            await check_rate_limit(sanic, loop)
+
+
+async def test_buffer_replay_listeners(sanic: Sanic) -> None:
+    loop = asyncio.get_event_loop()
+    with patch.object(config, "OTP_BUFFER_ENABLED", True):
+        await start_buffer_replay(sanic, loop)
+    buffer_replay = sanic.buffer_replay
+    assert not buffer_replay.done()
+    await stop_buffer_replay(sanic, loop)
+    assert sanic.buffer_replay is None
+    await asyncio.sleep(0)
+    assert buffer_replay.cancelled()
+    await stop_buffer_replay(sanic, loop)
+
+
+async def test_store_coalescing_listener(sanic: Sanic) -> None:
+    with patch("immuni_otp.sanic.close_store_coalescer") as close_store_coalescer:
+        close_store_coalescer.side_effect = lambda: asyncio.sleep(0)
+        await stop_store_coalescing(sanic, asyncio.get_event_loop())
+    close_store_coalescer.assert_called_once_with()
+
+
+async def test_audit_flush_listeners(sanic: Sanic, tmp_path: Path) -> None:
+    loop = asyncio.get_event_loop()
+    await start_audit_flush(sanic, loop)
+    assert getattr(sanic, "audit_flush", None) is None
+    audit_log = AuditLog(str(tmp_path), queue_size=10, batch_size=10, max_file_bytes=1024)
+    with patch.object(managers, "_otp_audit_log", audit_log):
+        await start_audit_flush(sanic, loop)
+        audit_flush = sanic.audit_flush
+        assert not audit_flush.done()
+        audit_log.push(
+            AuditRecord(
+                timestamp=0.0,
+                otp_sha="",
+                client=None,
+                outcome="stored",
+                validation_ms=0.0,
+                store_ms=0.0,
+            )
+        )
+        await stop_audit_flush(sanic, loop)
+        assert sanic.audit_flush is None
+        assert audit_flush.done()
+        assert len(audit_log) == 0
+        await stop_audit_flush(sanic, loop)
+    audit_log.close()
+
+
+@mark.parametrize(
+    "enabled, backend",
+    [(False, StorageBackend.REDIS), (True, StorageBackend.MEMORY), (False, StorageBackend.MEMORY)],
+)
+async def test_health_probe_listeners_disabled(
+    sanic: Sanic, enabled: bool, backend: StorageBackend
+) -> None:
+    with patch.object(config, "OTP_HEALTH_ENABLED", enabled), patch.object(
+        config, "OTP_STORAGE_BACKEND", backend
+    ):
+        await start_health_probe(sanic, asyncio.get_event_loop())
+    assert getattr(sanic, "health_probe", None) is None
+
+
+async def test_health_probe_listeners(sanic: Sanic) -> None:
+    loop = asyncio.get_event_loop()
+    shards = (object(),)
+    with patch.object(config, "OTP_HEALTH_ENABLED", True), patch.object(
+        config, "OTP_STORAGE_BACKEND", StorageBackend.REDIS
+    ), patch.object(managers, "_otp_redis_shards", shards), patch(
+        "immuni_otp.sanic.probe_forever", side_effect=lambda *args, **kwargs: asyncio.sleep(10)
+    ) as probe_forever:
+        await start_health_probe(sanic, loop)
+    probe_forever.assert_called_once_with(
+        redis_health,
+        shards,
+        interval_seconds=config.OTP_HEALTH_PROBE_INTERVAL_MILLISECONDS / 1000,
+        timeout_seconds=config.OTP_HEALTH_PROBE_TIMEOUT_MILLISECONDS / 1000,
+    )
+    health_probe = sanic.health_probe
+    assert not health_probe.done()
+    redis_health.record(
+        ProbeResult(probed_at=0.0, latency_seconds=0.0, failed=False, pool_size=0, pool_free=0)
+    )
+    await stop_health_probe(sanic, loop)
+    assert sanic.health_probe is None
+    assert redis_health.readiness()["reason"] == "not_probed"
+    await asyncio.sleep(0)
+    assert health_probe.cancelled()
+    await stop_health_probe(sanic, loop)
+
+
+@mark.redis
+async def test_pool_sampling_listeners(sanic: Sanic) -> None:
+    loop = asyncio.get_event_loop()
+    with patch(
+        "immuni_otp.sanic.observe_pools_forever",
+        side_effect=lambda *args, **kwargs: asyncio.sleep(10),
+    ) as observe_pools_forever:
+        await start_pool_sampling(sanic, loop)
+    observe_pools_forever.assert_called_once_with(
+        [("0", managers.otp_redis.connection)],
+        config.OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS / 1000,
+    )
+    pool_sampling = sanic.pool_sampling
+    await stop_pool_sampling(sanic, loop)
+    assert sanic.pool_sampling is None
+    await asyncio.sleep(0)
+    assert pool_sampling.cancelled()
+    await stop_pool_sampling(sanic, loop)
+
+
+async def test_pool_sampling_disabled(sanic: Sanic) -> None:
+    with patch.object(config, "OTP_CACHE_REDIS_POOL_SAMPLING_MILLISECONDS", 0):
+        await start_pool_sampling(sanic, asyncio.get_event_loop())
+    assert getattr(sanic, "pool_sampling", None) is None
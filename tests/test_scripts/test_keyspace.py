@@ -0,0 +1,64 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from asyncio import AbstractEventLoop
+from datetime import date
+from pathlib import Path
+from unittest.mock import patch
+
+from pytest import mark, raises
+
+from immuni_common.models.dataclasses import OtpData
+from immuni_otp.core import config
+from immuni_otp.core.managers import Managers
+from immuni_otp.helpers.otp import store
+from immuni_otp.models.enums import StorageBackend
+from immuni_otp.scripts.keyspace import main
+
+
+@mark.redis
+def test_main(tmp_path: Path, loop: AbstractEventLoop) -> None:
+    loop.run_until_complete(
+        store(
+            otp="59FU36KR46",
+            otp_data=OtpData(id_test_verification=None, symptoms_started_on=date(2020, 12, 10)),
+        )
+    )
+    output = tmp_path / "keyspace.json"
+    with patch("immuni_otp.scripts.keyspace.managers", Managers()), patch(
+        "immuni_otp.scripts.keyspace.asyncio.get_event_loop", return_value=loop
+    ):
+        main(["--scan-count=10", "--pause-milliseconds=1", f"--output={output}"])
+    report = json.loads(output.read_text())
+    assert report["shards"] == 1
+    assert report["keys"] == report["json_keys"] == 1
+    assert sum(report["ttl_distribution"].values()) == 1
+    assert len(report["ttl_distribution"]) == 11
+
+
+@mark.redis
+def test_main_sorts_ttl_buckets(tmp_path: Path, loop: AbstractEventLoop) -> None:
+    output = tmp_path / "keyspace.json"
+    with patch("immuni_otp.scripts.keyspace.managers", Managers()), patch(
+        "immuni_otp.scripts.keyspace.asyncio.get_event_loop", return_value=loop
+    ):
+        main(["--ttl-buckets", "120", "60", "120", f"--output={output}"])
+    report = json.loads(output.read_text())
+    assert list(report["ttl_distribution"]) == ["le_60s", "le_120s", "inf"]
+
+
+def test_main_requires_redis() -> None:
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.MEMORY):
+        with raises(SystemExit):
+            main([])
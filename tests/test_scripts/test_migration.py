@@ -0,0 +1,68 @@
+#   Copyright (C) 2020 Presidenza del Consiglio dei Ministri.
+#   Please refer to the AUTHORS file for more information.
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#   GNU Affero General Public License for more details.
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+import json
+from asyncio import AbstractEventLoop
+from pathlib import Path
+from unittest.mock import patch
+
+from _pytest.capture import CaptureFixture
+from pytest import mark, raises
+
+from immuni_otp.core import config
+from immuni_otp.core.managers import Managers
+from immuni_otp.helpers.otp import store
+from immuni_otp.models.enums import StorageBackend
+from immuni_otp.scripts.migration import main
+from tests.test_helpers.test_otp import _OTP, _OTP_DATA
+
+
+@mark.redis
+def test_main(tmp_path: Path, loop: AbstractEventLoop, capsys: CaptureFixture) -> None:
+    loop.run_until_complete(store(otp=_OTP, otp_data=_OTP_DATA))
+    base_url = config.OTP_CACHE_REDIS_URL.rsplit("/", 1)[0]
+    stream = tmp_path / "otps.bin"
+    with patch("immuni_otp.scripts.migration.managers", Managers()), patch(
+        "immuni_otp.scripts.migration.asyncio.get_event_loop", return_value=loop
+    ), patch.object(config, "OTP_MIGRATION_REDIS_URLS", [f"{base_url}/1"]):
+        main(["export", f"--output={stream}", "--scan-count=10", "--pause-milliseconds=1"])
+        assert json.loads(capsys.readouterr().out) == dict(exported=1)
+        main(["import", f"--input={stream}", "--batch-size=10"])
+        assert json.loads(capsys.readouterr().out) == dict(
+            restored=1, existing=0, consumed=0, expired=0
+        )
+        main(["import", f"--input={stream}"])
+        assert json.loads(capsys.readouterr().out) == dict(
+            restored=0, existing=1, consumed=0, expired=0
+        )
+
+    target_managers = Managers()
+    with patch.object(config, "OTP_CACHE_REDIS_URLS", [f"{base_url}/1"]):
+        loop.run_until_complete(target_managers.initialize())
+    loop.run_until_complete(target_managers.otp_storage.flush())
+    loop.run_until_complete(target_managers.teardown())
+
+
+def test_main_requires_redis(tmp_path: Path) -> None:
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.MEMORY):
+        with raises(SystemExit):
+            main(["export", f"--output={tmp_path / 'otps.bin'}"])
+
+
+def test_import_requires_target(tmp_path: Path) -> None:
+    stream = tmp_path / "otps.bin"
+    stream.write_bytes(b"")
+    with patch.object(config, "OTP_STORAGE_BACKEND", StorageBackend.REDIS), patch.object(
+        config, "OTP_MIGRATION_REDIS_URLS", []
+    ):
+        with raises(SystemExit):
+            main(["import", f"--input={stream}"])